@@ -13,7 +13,12 @@ from api.routes.kms import api as kms_api
 from api.routes.storage import api as storage_api
 from api.routes.disks import api as disks_api
 from api.config import Config
-from api.extensions import  bcrypt, couchbase
+from api.extensions import  database, job_events, user_cache
+from api.internal.threads import executor, job_queue, job_archiver
+from utils.operation_waiter import operation_waiter
+from utils.password_hasher import password_hasher
+from api.internal.indexes import bootstrap_indexes
+from api.internal.api_keys import api_keys
 
 
 # create the api blueprint 
@@ -61,8 +66,19 @@ def create_app(test_config=None):
         app.config.from_mapping(test_config)
    
     # initialize extensions
-    bcrypt.init_app(app)
-    couchbase.init_couchbase()
+    password_hasher.init_app(app)
+    database.connect()
+    job_events.init_app(app)
+    user_cache.init_app(app)
+    if app.config['DB_BOOTSTRAP_INDEXES']:
+        bootstrap_indexes()
+    api_keys.init_app(app)
+    job_queue.init_app(app)
+    job_archiver.init_app(app)
+    operation_waiter.configure(app.config['OPERATION_POLL_MAX_INTERVAL'], app.config['OPERATION_POLL_BATCH_SIZE'])
+    # with the durable queue the jobs are run by the worker processes
+    if not job_queue.enabled:
+        executor.init_app(app)
     # register the cluster blueprint
     app.register_blueprint(api_blueprint)
     return app
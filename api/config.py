@@ -6,11 +6,76 @@ import base64
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 
+def parse_project_weights(value):
+    """
+    Parse the weights of the GCP projects given as `project-a=2,project-b=1`.
+    Raises:
+        ValueError: if a weight isn't a number greater than 0
+    """
+    weights = {}
+    for item in value.split(','):
+        if '=' not in item:
+            continue
+        project, weight = (part.strip() for part in item.split('=', 1))
+        if not float(weight) > 0:
+            raise ValueError(f"The weight of the project {project} in JOB_PROJECT_WEIGHTS must be greater than 0, got {weight}")
+        weights[project] = float(weight)
+    return weights
+
+
 class Config:
     SECRET_KEY = base64.b64encode(os.urandom(24)).decode('utf-8'),
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URI')\
         or 'sqlite:///' + os.path.join(basedir, 'app.db')
     DEBUG = True
-    BCRYPT_LOG_ROUNDS = 4
+    # bcrypt cost factor of the password hashes, the passwords hashed with another cost are hashed again on the next login
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 4))
+    # password hashing pool: worker processes (0 hashes on the request threads), passwords waiting for a worker and seconds a password waits before the request fails with 503
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_QUEUE_SIZE = int(os.environ.get('PASSWORD_HASH_QUEUE_SIZE', 32))
+    PASSWORD_HASH_QUEUE_TIMEOUT = float(os.environ.get('PASSWORD_HASH_QUEUE_TIMEOUT', 5))
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-
+    # background jobs executor
+    JOB_EXECUTOR_WORKERS = int(os.environ.get('JOB_EXECUTOR_WORKERS', 8))
+    JOB_EXECUTOR_QUEUE_SIZE = int(os.environ.get('JOB_EXECUTOR_QUEUE_SIZE', 64))
+    # seconds a client should wait before retrying when the job queue is full
+    JOB_EXECUTOR_RETRY_AFTER = int(os.environ.get('JOB_EXECUTOR_RETRY_AFTER', 30))
+    # fair share of the workers between the GCP projects: maximum running jobs per project (0 for no limit),
+    # weights of the projects as `project-a=2,project-b=1`, and seconds after which a waiting job is promoted to the next priority class
+    JOB_PROJECT_MAX_RUNNING = int(os.environ.get('JOB_PROJECT_MAX_RUNNING', 0))
+    JOB_PROJECT_WEIGHTS = parse_project_weights(os.environ.get('JOB_PROJECT_WEIGHTS', ''))
+    JOB_PRIORITY_AGING_SECONDS = int(os.environ.get('JOB_PRIORITY_AGING_SECONDS', 300))
+    # `local` runs the jobs in the server process, `couchbase` stores them in the durable queue run by `main.py worker`
+    JOB_QUEUE_BACKEND = os.environ.get('JOB_QUEUE_BACKEND', 'local')
+    JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 60))
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+    # job event streams: number of events buffered per job and seconds the events of a finished job are kept
+    JOB_EVENTS_BUFFER_SIZE = int(os.environ.get('JOB_EVENTS_BUFFER_SIZE', 500))
+    JOB_EVENTS_RETENTION = int(os.environ.get('JOB_EVENTS_RETENTION', 600))
+    # seconds between two keep-alive comments, and between two reads of the job when it is run by another process
+    JOB_EVENTS_KEEPALIVE = int(os.environ.get('JOB_EVENTS_KEEPALIVE', 15))
+    JOB_EVENTS_POLL_INTERVAL = int(os.environ.get('JOB_EVENTS_POLL_INTERVAL', 2))
+    # seconds the finished jobs are kept before couchbase removes them, 0 keeps them forever
+    JOB_RETENTION_SECONDS = int(os.environ.get('JOB_RETENTION_SECONDS', 30 * 24 * 3600))
+    # `couchbase` compacts the old finished jobs into per-day summary documents, `gcs` into NDJSON files of JOB_ARCHIVE_BUCKET, empty disables the archiver
+    JOB_ARCHIVE_TARGET = os.environ.get('JOB_ARCHIVE_TARGET', '')
+    JOB_ARCHIVE_AFTER_SECONDS = int(os.environ.get('JOB_ARCHIVE_AFTER_SECONDS', 7 * 24 * 3600))
+    JOB_ARCHIVE_INTERVAL = int(os.environ.get('JOB_ARCHIVE_INTERVAL', 3600))
+    JOB_ARCHIVE_BATCH_SIZE = int(os.environ.get('JOB_ARCHIVE_BATCH_SIZE', 500))
+    JOB_ARCHIVE_BUCKET = os.environ.get('JOB_ARCHIVE_BUCKET')
+    JOB_ARCHIVE_PROJECT_ID = os.environ.get('JOB_ARCHIVE_PROJECT_ID')
+    # seconds during which a request with the same Idempotency-Key returns the job of the first request
+    IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', 24 * 3600))
+    # GCP operations: maximum seconds between two polls of a pending operation and operations polled per round by the waiter thread
+    OPERATION_POLL_MAX_INTERVAL = float(os.environ.get('OPERATION_POLL_MAX_INTERVAL', 10))
+    OPERATION_POLL_BATCH_SIZE = int(os.environ.get('OPERATION_POLL_BATCH_SIZE', 50))
+    # create the indexes of the database when the server starts, they can also be created with `python main.py migrate-db`
+    DB_BOOTSTRAP_INDEXES = os.environ.get('DB_BOOTSTRAP_INDEXES', 'true').lower() == 'true'
+    # look up by username with a query the users without a username key document, can be disabled once `python main.py migrate-db` wrote the key documents of the existing users
+    USERNAME_QUERY_FALLBACK = os.environ.get('USERNAME_QUERY_FALLBACK', 'true').lower() == 'true'
+    # authenticated users cached by `check_token`: maximum number of cached tokens (0 disables the cache) and seconds a user is served from the cache
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 1024))
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60))
+    # API keys of the service clients: secret of the HMAC digests of the keys (unset disables the API keys) and seconds between two reloads of the keys
+    API_KEY_HMAC_SECRET = os.environ.get('API_KEY_HMAC_SECRET')
+    API_KEY_REFRESH_INTERVAL = int(os.environ.get('API_KEY_REFRESH_INTERVAL', 30))
@@ -1,8 +1,12 @@
 # Description: This file contains the extensions used by the application.
 
-from flask_bcrypt import Bcrypt
-from api.internal.couchbase import CouchbaseCluster
+from api.internal.database import DatabaseProxy
+from api.internal.job_events import JobEventBus
+from api.internal.user_cache import UserCache
 
 
-bcrypt = Bcrypt()
-couchbase = CouchbaseCluster()
+# database of the REST API, the backend is selected with `DATABASE_BACKEND` when it is first used
+database = DatabaseProxy()
+job_events = JobEventBus()
+# users of the tokens seen recently
+user_cache = UserCache()
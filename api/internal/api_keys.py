@@ -0,0 +1,214 @@
+# Description: This module contains the ApiKeyStore class which authenticates the API keys of the service clients in memory. The keys are stored in the users bucket as HMAC-SHA256
+# digests of their secret, keyed with `API_KEY_HMAC_SECRET`. The store keeps all the keys in memory and a background thread reloads them every `API_KEY_REFRESH_INTERVAL` seconds,
+# so a request authenticated with an API key doesn't read the database. The requests per key are counted in memory and added to the key documents by the same thread.
+# A key created or revoked by this process applies right away, a key created or revoked by another process applies after the next refresh.
+import datetime
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from loguru import logger
+from api.extensions import database
+from api.models.api_key import ApiKey, API_KEY_PREFIX
+from utils.exceptions import UnAuthorizedException, ApiKeysDisabledException, DatabaseDocumentNotFoundException
+
+
+class ApiKeyStore():
+    # init method or constructor
+    def __init__(self):
+        self.hmac_secret = None
+        self.refresh_interval = 30
+        # API keys per id
+        self.keys = {}
+        # requests per key id and time of the last request, not added to the key documents yet
+        self.pending_usage = {}
+        # keys created by this process per id and creation time, kept until the database queries return them
+        self.created_keys = {}
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopped = threading.Event()
+        self.last_refresh_at = None
+
+    def init_app(self, app):
+        """
+        Configure the store with the configuration of the flask application, load the keys and start the refresh thread if `API_KEY_HMAC_SECRET` is set.
+        Parameters:
+            app: the Flask application instance.
+        """
+        self.configure(app.config.get('API_KEY_HMAC_SECRET'), app.config.get('API_KEY_REFRESH_INTERVAL', 30))
+        if self.enabled:
+            self.refresh()
+            self.start()
+
+    def configure(self, hmac_secret, refresh_interval=30):
+        """
+        Parameters:
+            hmac_secret (str): the secret of the HMAC digests of the keys, None disables the API keys
+            refresh_interval (int): the seconds between two reloads of the keys
+        """
+        self.hmac_secret = hmac_secret.encode() if hmac_secret else None
+        self.refresh_interval = refresh_interval
+
+    @property
+    def enabled(self):
+        return self.hmac_secret is not None
+
+    def start(self):
+        """
+        Start the refresh thread, this function does nothing if it is already running.
+        """
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.__loop, name="api-keys-refresh", daemon=True)
+        self.thread.start()
+        logger.info(f"API keys refreshed every {self.refresh_interval}s")
+
+    def stop(self):
+        """
+        Stop the refresh thread, the pending usage counters are saved.
+        """
+        self.stopped.set()
+        self.flush_usage()
+
+    def create(self, name, role="user", scopes=None):
+        """
+        Create an API key.
+        Parameters:
+            name (str): the name of the key, e.g. the service using it
+            role (str): the role of the key, like the role of a user
+            scopes (list): the namespaces the key can access, `*` for all of them
+        Returns:
+            tuple: the ApiKey and the API key itself, which isn't stored and can't be retrieved later
+        Raises:
+            ApiKeysDisabledException: if `API_KEY_HMAC_SECRET` isn't set
+        """
+        if not self.enabled:
+            raise ApiKeysDisabledException("API keys are disabled, API_KEY_HMAC_SECRET is not set")
+        secret = secrets.token_urlsafe(32)
+        api_key = ApiKey(name, role, scopes, self.__digest(secret))
+        database.insert("users", ApiKey.document_key(api_key.id), api_key.to_dict())
+        with self.lock:
+            self.keys[api_key.id] = api_key
+            self.created_keys[api_key.id] = (api_key, time.monotonic())
+        return api_key, f"{API_KEY_PREFIX}{api_key.id}.{secret}"
+
+    def revoke(self, key_id):
+        """
+        Revoke an API key.
+        Raises:
+            DatabaseDocumentNotFoundException: if the key doesn't exist
+        """
+        with self.lock:
+            self.keys.pop(key_id, None)
+            self.pending_usage.pop(key_id, None)
+            self.created_keys.pop(key_id, None)
+        database.remove("users", ApiKey.document_key(key_id))
+
+    def authenticate(self, token, namespace):
+        """
+        Authenticate a request with an API key, without reading the database.
+        Parameters:
+            token (str): the API key
+            namespace (str): the namespace of the requested route
+        Returns:
+            ApiKey: the key
+        Raises:
+            UnAuthorizedException: if the key is unknown, revoked, invalid or out of its scopes
+        """
+        if not self.enabled:
+            raise UnAuthorizedException("Invalid token")
+        key_id, _, secret = token[len(API_KEY_PREFIX):].partition('.')
+        with self.lock:
+            api_key = self.keys.get(key_id)
+        # the digest is compared even for the unknown keys so that the response time doesn't tell them apart
+        expected = api_key.digest if api_key else ''
+        if not hmac.compare_digest(self.__digest(secret), expected) or api_key is None:
+            raise UnAuthorizedException("Invalid token")
+        if not api_key.allows(namespace):
+            raise UnAuthorizedException(f"The API key has no access to the {namespace} routes")
+        with self.lock:
+            usage = self.pending_usage.setdefault(key_id, {'requests': 0, 'last_used_at': None})
+            usage['requests'] += 1
+            usage['last_used_at'] = datetime.datetime.utcnow().isoformat()
+        return api_key
+
+    def list(self):
+        """
+        List the API keys with their usage counters, the digests are left out.
+        Returns:
+            list: the keys, the number of requests includes the requests not saved yet
+        """
+        with self.lock:
+            api_keys = []
+            for api_key in self.keys.values():
+                api_key_dict = api_key.to_dict()
+                api_key_dict.pop('digest')
+                api_key_dict.pop('api_key')
+                pending = self.pending_usage.get(api_key.id)
+                if pending:
+                    api_key_dict['usage'] = {
+                        'requests': (api_key.usage.get('requests') or 0) + pending['requests'],
+                        'last_used_at': pending['last_used_at']
+                    }
+                api_keys.append(api_key_dict)
+            return sorted(api_keys, key=lambda api_key_dict: api_key_dict['created_at'])
+
+    def refresh(self):
+        """
+        Save the usage counters and reload all the API keys from the database.
+        """
+        self.flush_usage()
+        rows = database.find("users", [("api_key", "=", True)])
+        keys = {api_key.id: api_key for api_key in (ApiKey.from_dict(document) for _, document in rows)}
+        with self.lock:
+            # the index of the query may not include the keys just created yet
+            now = time.monotonic()
+            for key_id, (api_key, created_at) in list(self.created_keys.items()):
+                if key_id in keys or now - created_at > 2 * self.refresh_interval:
+                    del self.created_keys[key_id]
+                else:
+                    keys[key_id] = api_key
+            self.keys = keys
+            self.last_refresh_at = datetime.datetime.utcnow().isoformat()
+
+    def flush_usage(self):
+        """
+        Add the requests counted since the last flush to the key documents.
+        """
+        with self.lock:
+            pending_usage = self.pending_usage
+            self.pending_usage = {}
+        for key_id, usage in pending_usage.items():
+            try:
+                database.mutate_in("users", ApiKey.document_key(key_id), fields={'usage.last_used_at': usage['last_used_at']},
+                    increments={'usage.requests': usage['requests']})
+            except DatabaseDocumentNotFoundException:
+                # the key has been revoked meanwhile
+                pass
+            except Exception as e:
+                logger.warning(f"Error saving the usage of the API key {key_id}: {e}")
+                # the requests are saved with the next flush
+                with self.lock:
+                    current = self.pending_usage.setdefault(key_id, {'requests': 0, 'last_used_at': usage['last_used_at']})
+                    current['requests'] += usage['requests']
+
+    def __loop(self):
+        """
+        Reload the keys every `refresh_interval` seconds until the store is stopped.
+        """
+        while not self.stopped.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Error refreshing the API keys: {e}")
+
+    def __digest(self, secret):
+        """
+        HMAC digest of the secret of a key.
+        """
+        return hmac.new(self.hmac_secret, secret.encode(), hashlib.sha256).hexdigest()
+
+
+# API keys of the service clients
+api_keys = ApiKeyStore()
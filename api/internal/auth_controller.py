@@ -1,35 +1,169 @@
+import hashlib
+import time
+from flask import current_app
+from loguru import logger
 from api.models.user import User
-from api.extensions import couchbase
-from utils.exceptions import UserAlreadyExistsException, UserDoesNotExistException, InvalidPasswordException
+from api.extensions import database, user_cache
+from utils.exceptions import UserAlreadyExistsException, UserDoesNotExistException, InvalidPasswordException, InvalidRoleException, DatabaseDocumentNotFoundException, DatabaseConflictException
 
 
+# seconds during which the reservation of a username is left to the registration that made it, an older reservation whose user doesn't exist was left by a failed registration
+USERNAME_RESERVATION_GRACE_SECONDS = 60
+# roles a user can be given
+USER_ROLES = ('admin', 'user')
+
+
+def username_key(username):
+    """
+    Key of the document mapping a username to the id of its user, in the users bucket. The username is hashed so that the key has a fixed length.
+    """
+    return "username::" + hashlib.sha256(username.encode()).hexdigest()
+
 def register_user(user: User):
     """
-    Controller function to register a new user and generate the jwt token for access. 
+    Controller function to register a new user and generate the jwt token for access.
     """
-    # insert user to the couchbase database
     user_dict = user.to_dict()
-    # check if the user already exists 
-    users = couchbase.list_filter("users", username=user_dict["username"])
-    if len(list(users)) > 0:
+    # reserve the username atomically, two concurrent registrations of the same username can't both succeed
+    reservation = {"user_id": user.id, "reserved_at": time.time()}
+    if not database.insert_if_absent("users", username_key(user.username), reservation) and not take_over_username(user.username, reservation):
         raise UserAlreadyExistsException("User already exists")
-    couchbase.insert("users", user_dict["id"], user_dict)
+    # insert user to the database
+    try:
+        database.insert("users", user_dict["id"], user_dict)
+    except Exception as e:
+        # release the username so that the registration can be retried
+        database.remove("users", username_key(user.username))
+        raise e
     return user.encode_auth_token(user_dict["id"], user_dict["role"])
 
+def take_over_username(username, reservation):
+    """
+    Take over the reservation of a username left by a registration that failed before inserting its user, e.g. when the process crashed.
+    The reservation is replaced with a CAS guard so that only one of the concurrent registrations gets it.
+    Returns:
+        bool: True if the username is now reserved for the user of `reservation`, False if it belongs to another user
+    """
+    key = username_key(username)
+    try:
+        current, cas = database.get_with_cas("users", key)
+    except DatabaseDocumentNotFoundException:
+        # the reservation has been released meanwhile
+        return database.insert_if_absent("users", key, reservation)
+    # a recent reservation may belong to a registration still in progress
+    if time.time() - current.get("reserved_at", 0) < USERNAME_RESERVATION_GRACE_SECONDS:
+        return False
+    if database.check("users", current["user_id"]):
+        return False
+    try:
+        database.replace_with_cas("users", key, reservation, cas)
+    except (DatabaseConflictException, DatabaseDocumentNotFoundException):
+        return False
+    logger.warning(f"Username reservation of the missing user {current['user_id']} taken over")
+    return True
+
+def get_user_by_username(username):
+    """
+    Get a stored user by username with two key-value reads: the username key document, then the user document.
+    Returns:
+        dict: the stored user, None if no user has this username
+    """
+    try:
+        user_id = database.get("users", username_key(username))["user_id"]
+        return database.get("users", user_id)
+    except DatabaseDocumentNotFoundException:
+        pass
+    # once `migrate-db` has written the key documents of all the users, a missing key document means an unknown username
+    if not current_app.config.get('USERNAME_QUERY_FALLBACK', True):
+        return None
+    # the users registered before the username key documents are found with the username index, their key document is written on the way
+    users = database.find("users", [("username", "=", username)], limit=1)
+    if not users:
+        return None
+    user_dict = users[0][1]
+    database.insert_if_absent("users", username_key(username), {"user_id": user_dict["id"]})
+    return user_dict
+
 def login_user(username, password):
     """
     Controller function to login a user and generate the jwt token for access.
     """
-    # check if the user exists 
-    users = list(couchbase.list_filter("users", username=username))
-    if len(users) == 0:
+    # check if the user exists
+    user_dict = get_user_by_username(username)
+    if user_dict is None:
         raise UserDoesNotExistException("User does not exist")
-    user_dict = users[0]["users"]
     user = User.from_dict(user_dict)
     # check if the password is correct
-    if not user.check_password(user_dict["password"]):
+    if not user.check_password(password):
         raise InvalidPasswordException("Incorrect password")
+    # the cost factor changed since the password was hashed, the clear text password is only known at login
+    if user.needs_rehash():
+        try:
+            user.set_password(password)
+            database.mutate_in("users", user.id, fields={"password": user.password})
+        except Exception as e:
+            logger.warning(f"Error hashing again the password of the user {user.id}: {e}")
     # generate jwt token
     return user.encode_auth_token(user_dict["id"], user_dict["role"])
 
+def get_user_document(user_id):
+    """
+    Get the document of a user, the username and API key documents share the `users` bucket and are not users.
+    Raises:
+        UserDoesNotExistException: if the user doesn't exist or the document isn't a user
+    """
+    try:
+        user_dict = database.get("users", user_id)
+    except DatabaseDocumentNotFoundException:
+        raise UserDoesNotExistException("User does not exist")
+    if "username" not in user_dict or "role" not in user_dict:
+        raise UserDoesNotExistException("User does not exist")
+    return user_dict
+
+def delete_user(user_id):
+    """
+    Controller function to delete a user, the tokens of the user are rejected right away.
+    Raises:
+        UserDoesNotExistException: if the user doesn't exist
+    """
+    user_dict = get_user_document(user_id)
+    try:
+        database.remove("users", user_id)
+    except DatabaseDocumentNotFoundException:
+        raise UserDoesNotExistException("User does not exist")
+    # the username can be registered again
+    try:
+        database.remove("users", username_key(user_dict["username"]))
+    except DatabaseDocumentNotFoundException:
+        pass
+    # the cached tokens of the user would otherwise stay valid until the TTL of the cache
+    user_cache.invalidate_user(user_id)
 
+def update_user_role(user_id, role):
+    """
+    Controller function to change the role of a user, the new role applies to the tokens already issued.
+    Raises:
+        InvalidRoleException: if the role isn't one of USER_ROLES
+        UserDoesNotExistException: if the user doesn't exist
+    """
+    if role not in USER_ROLES:
+        raise InvalidRoleException(f"The role must be one of {', '.join(USER_ROLES)}")
+    get_user_document(user_id)
+    try:
+        database.mutate_in("users", user_id, fields={"role": role})
+    except DatabaseDocumentNotFoundException:
+        raise UserDoesNotExistException("User does not exist")
+    user_cache.invalidate_user(user_id)
+
+def backfill_username_keys():
+    """
+    Write the username key documents of the users registered before them.
+    Returns:
+        int: the number of key documents written
+    """
+    written = 0
+    for _, user_dict in database.find("users", [("username", "exists", None)]):
+        if database.insert_if_absent("users", username_key(user_dict["username"]), {"user_id": user_dict["id"]}):
+            written += 1
+    logger.info(f"{written} username key documents written")
+    return written
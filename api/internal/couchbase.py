@@ -1,17 +1,195 @@
 # Description: This module contains the CouchbaseCluster class which is an abstraction on top of the Couchbase Python SDK. This allows us to easily switch to another database in the future. The CouchbaseCluster class is used to connect to the Couchbase cluster and perform operations on the cluster.
+# It is the default backend of the Database interface (api/internal/database.py).
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 from couchbase.cluster import Cluster
 from couchbase.auth import PasswordAuthenticator, CertificateAuthenticator
-from couchbase.options import ClusterOptions, QueryOptions
-from couchbase.management.options import CreatePrimaryQueryIndexOptions
+from couchbase.options import ClusterOptions, QueryOptions, ReplaceOptions, UpsertOptions, MutateInOptions, InsertOptions, GetMultiOptions, UpsertMultiOptions, RemoveMultiOptions
+from couchbase.durability import ServerDurability, Durability
+from couchbase.n1ql import QueryScanConsistency
+import couchbase.subdocument as SD
+from couchbase.subdocument import StoreSemantics
+from couchbase.management.options import CreatePrimaryQueryIndexOptions, CreateQueryIndexOptions
+from couchbase.exceptions import CasMismatchException, DocumentExistsException, DocumentNotFoundException, UnAmbiguousTimeoutException, ServiceUnavailableException, BucketNotFoundException
+from utils.exceptions import DatabaseConflictException, DatabaseDocumentNotFoundException
+from api.internal.database import Database, field_parts
 import os 
 from loguru import logger
 
 
-class CouchbaseCluster():
+# buckets opened by init_couchbase
+BUCKETS = ('users', 'clusters', 'jobs', 'idempotency')
+# errors after which the handle of the bucket is reopened and the operation retried once, the operation wasn't applied by the server
+RECONNECT_ERRORS = (UnAmbiguousTimeoutException, ServiceUnavailableException, BucketNotFoundException)
+
+
+# durability levels accepted by the write methods
+DURABILITY_LEVELS = {
+    'none': Durability.NONE,
+    'majority': Durability.MAJORITY,
+    'majority_and_persist_to_active': Durability.MAJORITY_AND_PERSIST_TO_ACTIVE,
+    'persist_to_majority': Durability.PERSIST_TO_MAJORITY
+}
+
+
+# scan consistencies accepted by `query`, `request_plus` waits for the indexes to contain the writes acknowledged before the query
+SCAN_CONSISTENCIES = {
+    'not_bounded': QueryScanConsistency.NOT_BOUNDED,
+    'request_plus': QueryScanConsistency.REQUEST_PLUS
+}
+
+
+def durability_options(durability):
+    """
+    Options of a write with the given durability level, the write is acknowledged by the active node only when None.
+    """
+    if durability is None:
+        return {}
+    return {'durability': ServerDurability(DURABILITY_LEVELS[durability])}
+
+
+def mutation_result(result):
+    """
+    Convert the result of a write to a dict with its CAS value and its mutation token, the token is None if the bucket doesn't enable them.
+    """
+    token = result.mutation_token()
+    return {
+        'cas': result.cas,
+        'mutation_token': {
+            'bucket_name': token.bucket_name,
+            'partition_id': token.partition_id,
+            'partition_uuid': token.partition_uuid,
+            'sequence_number': token.sequence_number
+        } if token else None
+    }
+
+
+def raise_multi_exceptions(result):
+    """
+    Raise the first error of a multi-document operation, the missing documents are not errors.
+    """
+    for exception in result.exceptions.values():
+        if not isinstance(exception, DocumentNotFoundException):
+            raise exception
+
+
+def escape_field(field):
+    """
+    Escape a field of the Database interface for N1QL, e.g. `project-id` or `statuses.COMPLETED DESC`.
+    """
+    parts, descending = field_parts(field)
+    return '.'.join(f"`{part}`" for part in parts) + (' DESC' if descending else '')
+
+
+def n1ql_conditions(conditions):
+    """
+    Build the N1QL conditions of a find statement on the documents aliased `d`.
+    Returns:
+        tuple: the list of conditions and their named parameters
+    """
+    where = []
+    params = {}
+    for index, (field, operator, value) in enumerate(conditions or []):
+        expression = f"d.{escape_field(field)}"
+        if operator == 'exists':
+            where.append(f"{expression} IS NOT MISSING")
+            continue
+        params[f"p{index}"] = value
+        where.append(f"{expression} {'IN' if operator == 'in' else operator} $p{index}")
+    return where, params
+
+
+def n1ql_keyset(columns, operator, params, values):
+    """
+    Build the condition selecting the rows after `values` in the order of `columns`, e.g. (a < $a OR (a = $a AND b < $b)).
+    """
+    name = f"k{len(values) - 1}"
+    params[name] = values[-1]
+    condition = f"{columns[-1]} {operator} ${name}"
+    for index in range(len(columns) - 2, -1, -1):
+        name = f"k{index}"
+        params[name] = values[index]
+        condition = f"({columns[index]} {operator} ${name} OR ({columns[index]} = ${name} AND {condition}))"
+    return condition
+
+
+def reconnect_on_failure(method):
+    """
+    Decorator of the key-value methods: on a connection error the cached handle of the bucket is dropped and the call retried once with a new handle.
+    The missing documents are reported with DatabaseDocumentNotFoundException like with the other backends.
+    """
+    @functools.wraps(method)
+    def wrapper(self, bucket, *args, **kwargs):
+        try:
+            try:
+                return method(self, bucket, *args, **kwargs)
+            except RECONNECT_ERRORS as e:
+                logger.warning(f"Error accessing the bucket {bucket}, reopening it: {e}")
+                self.invalidate(bucket)
+                return method(self, bucket, *args, **kwargs)
+        except DocumentNotFoundException as e:
+            raise DatabaseDocumentNotFoundException(f"Document not found in the bucket {bucket}: {e}")
+    return wrapper
+
+
+class CouchbaseCluster(Database):
+    # the statements of the controllers specific to couchbase (e.g. the durable job queue) are run with `query`
+    supports_query = True
+
     # init method or constructor
     def __init__(self):
         self.cluster = None 
+        # default collection per bucket name, opened once and shared by all the threads
+        self.collections = {}
+        self.collections_lock = threading.Lock()
+        # the multi-document operations are split in batches of `multi_batch_size` keys, `multi_fan_out` batches run at the same time
+        self.multi_batch_size = int(os.environ.get('COUCHBASE_MULTI_BATCH_SIZE', 100))
+        self.multi_fan_out = int(os.environ.get('COUCHBASE_MULTI_FAN_OUT', 4))
+        self.multi_executor = None
+
+    def collection(self, bucket):
+        """
+        Get the default collection of a bucket, the handle is opened on the first call and reused afterwards
+        Parameters:
+            bucket (str): The name of the bucket
+        Returns:
+            Collection: The default collection of the bucket
+        """
+        collection = self.collections.get(bucket)
+        if collection is not None:
+            return collection
+        with self.collections_lock:
+            # another thread may have opened the bucket while waiting for the lock
+            collection = self.collections.get(bucket)
+            if collection is None:
+                collection = self.cluster.bucket(bucket).default_collection()
+                self.collections[bucket] = collection
+            return collection
+
+    def invalidate(self, bucket):
+        """
+        Drop the cached handle of a bucket, the next call opens it again.
+        """
+        with self.collections_lock:
+            self.collections.pop(bucket, None)
+
+    def warmup(self, buckets=BUCKETS):
+        """
+        Open the handles of the buckets so that the first requests don't pay for it, the buckets that can't be opened are opened on first use.
+        """
+        for bucket in buckets:
+            try:
+                self.collection(bucket)
+            except Exception as e:
+                logger.warning(f"Error opening the bucket {bucket}: {e}")
+
+    def connect(self):
+        """
+        Connect to the Couchbase cluster.
+        """
+        self.init_couchbase()
 
     def init_couchbase(self):
         # check if the environment variable is set
@@ -55,42 +233,77 @@ class CouchbaseCluster():
                 exit(1)
         # Wait until the cluster is ready for use.
         self.cluster.wait_until_ready(timedelta(seconds=5))
+        # the handles of a previous connection can't be reused
+        with self.collections_lock:
+            self.collections = {}
+        self.warmup()
 
 
-    def insert(self, bucket, key, value):
+    @reconnect_on_failure
+    def upsert(self, bucket, key, value, durability=None):
         """
-        Insert a document into the database
+        Insert or replace a document without reading it back
         Parameters:
             bucket (str): The name of the bucket
             key (str): The key of the document
             value (dict): The value of the document
+            durability (str): Optional durability level of the write: none, majority, majority_and_persist_to_active or persist_to_majority
         Returns:
-            dict: The document that was inserted
-        """
-        # get the bucket
-        bucket = self.cluster.bucket(bucket)
-        # get the collection
-        collection = bucket.default_collection()
-        # insert the document
-        collection.upsert(key, value)
-        # return the document
-        document = collection.get(key)
-        return document.content_as[dict]
+            dict: The CAS value and the mutation token of the write
+        """
+        # get the cached collection of the bucket
+        collection = self.collection(bucket)
+        result = collection.upsert(key, value, UpsertOptions(**durability_options(durability)))
+        return mutation_result(result)
 
-    def update(self, bucket, key, value):
+    @reconnect_on_failure
+    def replace(self, bucket, key, value, cas=None, durability=None):
         """
-        Update a document in the database
+        Replace an existing document without reading it back
+        Parameters:
+            bucket (str): The name of the bucket
+            key (str): The key of the document
+            value (dict): The new value of the document
+            cas (int): Optional CAS value, the document is only replaced if it hasn't changed since it was read
+            durability (str): Optional durability level of the write
+        Returns:
+            dict: The CAS value and the mutation token of the write
+        Raises:
+            DatabaseConflictException: if a CAS value is given and the document has been modified since it was read
         """
-        # get the bucket
-        bucket = self.cluster.bucket(bucket)
-        # get the collection
-        collection = bucket.default_collection()
-        # update the document
-        collection.replace(key, value)
-        # return the document
-        document = collection.get(key)
-        return document.content_as[dict]
-    
+        # get the cached collection of the bucket
+        collection = self.collection(bucket)
+        options = durability_options(durability)
+        if cas:
+            options['cas'] = cas
+        try:
+            result = collection.replace(key, value, ReplaceOptions(**options))
+        except CasMismatchException:
+            raise DatabaseConflictException(f"Document {key} has been modified concurrently")
+        return mutation_result(result)
+
+    @reconnect_on_failure
+    def insert_if_absent(self, bucket, key, value, expiry=None):
+        """
+        Insert a document only if no document has the same key, the check and the write are a single atomic operation
+        Parameters:
+            bucket (str): The name of the bucket
+            key (str): The key of the document
+            value (dict): The value of the document
+            expiry (timedelta): Optional time to live of the document
+        Returns:
+            bool: True if the document has been inserted, False if a document with the same key exists
+        """
+        # get the cached collection of the bucket
+        collection = self.collection(bucket)
+        options = InsertOptions(expiry=expiry) if expiry else InsertOptions()
+        try:
+            collection.insert(key, value, options)
+        except DocumentExistsException:
+            return False
+        return True
+
+    @reconnect_on_failure
     def get(self, bucket, key):
         """
         Get a document from the database
@@ -100,71 +313,248 @@ class CouchbaseCluster():
         Returns:
             dict: The document that was retrieved
         """
-        # get the bucket
-        bucket = self.cluster.bucket(bucket)
-        # get the collection
-        collection = bucket.default_collection()
+        # get the cached collection of the bucket
+        collection = self.collection(bucket)
         # return the document
         document = collection.get(key)
 
         return document.content_as[dict]
 
+    def get_multi(self, bucket, keys):
+        """
+        Get several documents with batched key-value operations
+        Parameters:
+            bucket (str): The name of the bucket
+            keys (list): The keys of the documents
+        Returns:
+            dict: The documents per key, the missing documents are left out
+        """
+        def get_batch(batch):
+            result = self.collection(bucket).get_multi(batch, GetMultiOptions(return_exceptions=True))
+            raise_multi_exceptions(result)
+            return {key: document.content_as[dict] for key, document in result.results.items()}
+        return self.__run_multi(keys, get_batch)
+
+    def upsert_multi(self, bucket, documents, durability=None):
+        """
+        Insert or replace several documents with batched key-value operations
+        Parameters:
+            bucket (str): The name of the bucket
+            documents (dict): The values of the documents per key
+            durability (str): Optional durability level of the writes
+        Returns:
+            dict: The CAS value and the mutation token of each write, per key
+        """
+        def upsert_batch(batch):
+            options = UpsertMultiOptions(return_exceptions=True, **durability_options(durability))
+            result = self.collection(bucket).upsert_multi({key: documents[key] for key in batch}, options)
+            raise_multi_exceptions(result)
+            return {key: mutation_result(mutation) for key, mutation in result.results.items()}
+        return self.__run_multi(list(documents.keys()), upsert_batch)
+
+    def remove_multi(self, bucket, keys):
+        """
+        Remove several documents with batched key-value operations
+        Parameters:
+            bucket (str): The name of the bucket
+            keys (list): The keys of the documents
+        Returns:
+            list: The keys of the removed documents, the documents that didn't exist are left out
+        """
+        def remove_batch(batch):
+            result = self.collection(bucket).remove_multi(batch, RemoveMultiOptions(return_exceptions=True))
+            raise_multi_exceptions(result)
+            return {key: True for key in result.results}
+        return list(self.__run_multi(keys, remove_batch).keys())
+
+    def __run_multi(self, keys, run_batch):
+        """
+        Split the keys in batches and run the batches concurrently, at most `multi_fan_out` at the same time.
+        Returns:
+            dict: the merged results of the batches
+        """
+        keys = list(dict.fromkeys(keys))
+        batches = [keys[index:index + self.multi_batch_size] for index in range(0, len(keys), self.multi_batch_size)]
+        results = {}
+        if len(batches) <= 1 or self.multi_fan_out <= 1:
+            for batch in batches:
+                results.update(run_batch(batch))
+            return results
+        with self.collections_lock:
+            if self.multi_executor is None:
+                self.multi_executor = ThreadPoolExecutor(max_workers=self.multi_fan_out, thread_name_prefix="couchbase-multi")
+        for batch_results in self.multi_executor.map(run_batch, batches):
+            results.update(batch_results)
+        return results
+
+    @reconnect_on_failure
+    def get_with_cas(self, bucket, key):
+        """
+        Get a document and its CAS value, the CAS is used to update the document only if it hasn't changed since
+        Parameters:
+            bucket (str): The name of the bucket
+            key (str): The key of the document
+        Returns:
+            tuple: The document and its CAS value
+        """
+        # get the cached collection of the bucket
+        collection = self.collection(bucket)
+        # return the document
+        document = collection.get(key)
+        return document.content_as[dict], document.cas
+
+    @reconnect_on_failure
+    def mutate_in(self, bucket, key, fields=None, appends=None, cas=None, increments=None, expiry=None, create_document=False, durability=None):
+        """
+        Update some fields of a document with a single sub-document operation, the other fields are left untouched
+        Parameters:
+            bucket (str): The name of the bucket
+            key (str): The key of the document
+            fields (dict): The values of the fields to set, per path
+            appends (dict): The lists of values to append to array fields, per path, the arrays are created if needed
+            cas (int): Optional CAS value, the document is only updated if it hasn't changed since it was read
+            increments (dict): The values to add to counter fields, per path, the counters start at 0
+            expiry (timedelta): Optional time to live of the document, the document is removed by the server once expired
+            create_document (bool): Create the document if it doesn't exist
+            durability (str): Optional durability level of the write
+        Returns:
+            int: The new CAS value of the document
+        Raises:
+            DatabaseConflictException: if a CAS value is given and the document has been modified since it was read
+        """
+        # get the cached collection of the bucket
+        collection = self.collection(bucket)
+        specs = [SD.upsert(path, value, create_parents=True) for path, value in (fields or {}).items()]
+        specs += [SD.array_append(path, *values, create_parents=True) for path, values in (appends or {}).items()]
+        specs += [SD.increment(path, delta, create_parents=True) for path, delta in (increments or {}).items()]
+        options = durability_options(durability)
+        if cas:
+            options['cas'] = cas
+        if expiry:
+            options['expiry'] = expiry
+        if create_document:
+            options['store_semantics'] = StoreSemantics.UPSERT
+        try:
+            result = collection.mutate_in(key, specs, MutateInOptions(**options))
+        except CasMismatchException:
+            raise DatabaseConflictException(f"Document {key} has been modified concurrently")
+        return result.cas
+
+    @reconnect_on_failure
+    def remove(self, bucket, key):
+        """
+        Remove a document from the database
+        Parameters:
+            bucket (str): The name of the bucket
+            key (str): The key of the document
+        """
+        # get the cached collection of the bucket
+        collection = self.collection(bucket)
+        collection.remove(key)
+
+    @reconnect_on_failure
     def check(self, bucket, key):
         """
-        Check if a document exists in the database
+        Check if a document exists in the database, with a key-value lookup that doesn't fetch the document
+        Parameters:
+            bucket (str): The name of the bucket
+            key (str): The key of the document
+        Returns:
+            bool: True if the document exists
         """
-        # get the bucket
-        bucket = self.cluster.bucket(bucket)
-        # get the collection
-        collection = bucket.default_collection()
+        # get the cached collection of the bucket
+        collection = self.collection(bucket)
         # check if the document exists
-        query = 'SELECT * FROM `' + bucket.name + '` WHERE META().id = $1'
-        options = QueryOptions(positional_parameters=[key])
-        result = self.cluster.query(query, options)
-        # return the result
-        return len(list(result.rows())) > 0
+        return collection.exists(key).exists
 
 
     
     def list(self, bucket):
         """
-        List the documents of a bucket.
+        List the documents of a bucket, the query needs the primary index of the bucket (`python main.py migrate-db --primary-indexes`).
         """
-        # get the bucket
-        bucket = self.cluster.bucket(bucket)
-        # get the collection
-        collection = bucket.default_collection()
-
-        # create primary index and ignore if it exists
-        view_manager = bucket.view_indexes()
-        query_index_manager = self.cluster.query_indexes()
-        query_index_manager.create_primary_index(bucket.name, CreatePrimaryQueryIndexOptions(ignore_if_exists=True))
-
         # create query options
-        options = QueryOptions(positional_parameters=[bucket.name])
+        options = QueryOptions(positional_parameters=[bucket])
         # create query
-        query = 'SELECT * FROM `' + bucket.name + '`'
+        query = 'SELECT * FROM `' + bucket + '`'
         # execute query
         result = self.cluster.query(query, options)
         # return the result
         return list(result.rows())
 
-    def list_filter(self, bucket, **kwargs):
+    def query(self, statement, scan_consistency=None, **params):
+        """
+        Run a N1QL query with named parameters.
+        Parameters:
+            statement (str): The N1QL statement, the parameters are referenced with $name
+            scan_consistency (str): Optional scan consistency of the indexes, `request_plus` to see the writes made before the query, `not_bounded` by default
+            params: The values of the named parameters
+        Returns:
+            list: The rows of the result
+        """
+        consistency = {} if scan_consistency is None else {'scan_consistency': SCAN_CONSISTENCIES[scan_consistency]}
+        options = QueryOptions(named_parameters=params, **consistency)
+        result = self.cluster.query(statement, options)
+        return list(result.rows())
+
+    def create_primary_index(self, bucket):
         """
-        List the documents of a bucket with filters.
+        Create the primary index of a bucket if it doesn't exist.
         """
-        # get the bucket
-        bucket = self.cluster.bucket(bucket)
-        # get the collection
-        collection = bucket.default_collection()
+        query_index_manager = self.cluster.query_indexes()
+        query_index_manager.create_primary_index(bucket, CreatePrimaryQueryIndexOptions(ignore_if_exists=True))
 
-        # create primary index and ignore if it exists
-        view_manager = bucket.view_indexes()
+    def create_index(self, bucket, index_name, fields):
+        """
+        Create a secondary index of a bucket if it doesn't exist.
+        Parameters:
+            bucket (str): The name of the bucket
+            index_name (str): The name of the index
+            fields (list): The indexed fields, a field followed by ` DESC` is indexed in descending order
+        """
         query_index_manager = self.cluster.query_indexes()
-        query_index_manager.create_primary_index(bucket.name, CreatePrimaryQueryIndexOptions(ignore_if_exists=True))
+        query_index_manager.create_index(bucket, index_name, [escape_field(field) for field in fields], CreateQueryIndexOptions(ignore_if_exists=True))
+
+    def find(self, bucket, conditions=None, order_by=None, descending=False, limit=None, after=None):
+        """
+        Find the documents of a bucket matching all the conditions, see Database.find. The query only reads the ids
+        from the index, the documents are then fetched with batched key-value gets.
+        """
+        where, params = n1ql_conditions(conditions)
+        columns = [f"d.{escape_field(field)}" for field in order_by or []] + ['META(d).id']
+        if after is not None:
+            # keyset pagination, the rows after the last row of the previous page in the sort order
+            where.append(n1ql_keyset(columns, '<' if descending else '>', params, list(after)))
+        statement = f"SELECT META(d).id AS id FROM `{bucket}` AS d"
+        if where:
+            statement += " WHERE " + " AND ".join(where)
+        direction = ' DESC' if descending else ''
+        statement += " ORDER BY " + ", ".join(column + direction for column in columns)
+        if limit is not None:
+            statement += " LIMIT $limit"
+            params['limit'] = limit
+        keys = [row['id'] for row in self.query(statement, **params)]
+        documents = self.get_multi(bucket, keys)
+        # the documents removed since the query are left out
+        return [(key, documents[key]) for key in keys if key in documents]
+
+    def measure(self, bucket, conditions=None):
+        """
+        Count the documents of a bucket matching the conditions and their size.
+        """
+        where, params = n1ql_conditions(conditions)
+        statement = f"SELECT COUNT(*) AS items, SUM(ENCODED_SIZE(d)) AS size FROM `{bucket}` AS d"
+        if where:
+            statement += " WHERE " + " AND ".join(where)
+        rows = self.query(statement, **params)
+        return {'items': rows[0]['items'] if rows else 0, 'size': (rows[0]['size'] or 0) if rows else 0}
 
+    def list_filter(self, bucket, **kwargs):
+        """
+        List the documents of a bucket with filters, the filtered fields must be indexed (see api/internal/indexes.py).
+        """
         # create query
-        query = 'SELECT * FROM `' + bucket.name + '` WHERE '
+        query = 'SELECT * FROM `' + bucket + '` WHERE '
         #
         params = []
         # add filters to query
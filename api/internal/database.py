@@ -0,0 +1,392 @@
+# Description: This module contains the Database class, the interface of the persistence backends of the REST API, and the DatabaseProxy singleton used by the controllers.
+# A backend stores JSON documents per bucket and key. It implements a small core of methods (connect, get_with_cas, upsert, replace, insert_if_absent, mutate_in, remove, find, measure, create_index),
+# the other methods of the interface are derived from them and can be overridden with faster implementations (e.g. the batched operations of Couchbase).
+# The backend is selected with `DATABASE_BACKEND`: `couchbase` (default), `sqlite` (embedded database file `DATABASE_PATH`) or `memory` (local runs and tests, nothing is persisted).
+# Field names are plain document paths, the nested fields are separated with dots (e.g. `statuses.COMPLETED`), each backend escapes them itself.
+import os
+from utils.exceptions import DatabaseDocumentNotFoundException, DatabaseOperationNotSupportedException
+
+
+# backends accepted by `DATABASE_BACKEND`
+DATABASE_BACKENDS = ('couchbase', 'sqlite', 'memory')
+# operators of the find conditions
+CONDITION_OPERATORS = ('=', '<', '<=', '>', '>=', 'in', 'exists')
+# value returned by get_path for the missing fields
+MISSING = object()
+
+
+class Database():
+    # backends able to run N1QL statements with `query`
+    supports_query = False
+
+    def connect(self):
+        """
+        Open the database, called once when the server, the worker or a command starts.
+        """
+        raise NotImplementedError
+
+    def get_with_cas(self, bucket, key):
+        """
+        Get a document and its CAS value, the CAS is used to update the document only if it hasn't changed since
+        Parameters:
+            bucket (str): The name of the bucket
+            key (str): The key of the document
+        Returns:
+            tuple: The document and its CAS value
+        Raises:
+            DatabaseDocumentNotFoundException: if the document doesn't exist
+        """
+        raise NotImplementedError
+
+    def upsert(self, bucket, key, value, durability=None):
+        """
+        Insert or replace a document without reading it back
+        Parameters:
+            bucket (str): The name of the bucket
+            key (str): The key of the document
+            value (dict): The value of the document
+            durability (str): Optional durability level of the write, ignored by the single node backends
+        Returns:
+            dict: The CAS value and the mutation token of the write
+        """
+        raise NotImplementedError
+
+    def replace(self, bucket, key, value, cas=None, durability=None):
+        """
+        Replace an existing document without reading it back
+        Parameters:
+            bucket (str): The name of the bucket
+            key (str): The key of the document
+            value (dict): The new value of the document
+            cas (int): Optional CAS value, the document is only replaced if it hasn't changed since it was read
+            durability (str): Optional durability level of the write
+        Returns:
+            dict: The CAS value and the mutation token of the write
+        Raises:
+            DatabaseDocumentNotFoundException: if the document doesn't exist
+            DatabaseConflictException: if a CAS value is given and the document has been modified since it was read
+        """
+        raise NotImplementedError
+
+    def insert_if_absent(self, bucket, key, value, expiry=None):
+        """
+        Insert a document only if no document has the same key, the check and the write are a single atomic operation
+        Parameters:
+            bucket (str): The name of the bucket
+            key (str): The key of the document
+            value (dict): The value of the document
+            expiry (timedelta): Optional time to live of the document
+        Returns:
+            bool: True if the document has been inserted, False if a document with the same key exists
+        """
+        raise NotImplementedError
+
+    def mutate_in(self, bucket, key, fields=None, appends=None, cas=None, increments=None, expiry=None, create_document=False, durability=None):
+        """
+        Update some fields of a document with a single atomic operation, the other fields are left untouched
+        Parameters:
+            bucket (str): The name of the bucket
+            key (str): The key of the document
+            fields (dict): The values of the fields to set, per path
+            appends (dict): The lists of values to append to array fields, per path, the arrays are created if needed
+            cas (int): Optional CAS value, the document is only updated if it hasn't changed since it was read
+            increments (dict): The values to add to counter fields, per path, the counters start at 0
+            expiry (timedelta): Optional time to live of the document
+            create_document (bool): Create the document if it doesn't exist
+            durability (str): Optional durability level of the write
+        Returns:
+            int: The new CAS value of the document
+        Raises:
+            DatabaseDocumentNotFoundException: if the document doesn't exist and `create_document` isn't set
+            DatabaseConflictException: if a CAS value is given and the document has been modified since it was read
+        """
+        raise NotImplementedError
+
+    def remove(self, bucket, key):
+        """
+        Remove a document from the database
+        Raises:
+            DatabaseDocumentNotFoundException: if the document doesn't exist
+        """
+        raise NotImplementedError
+
+    def find(self, bucket, conditions=None, order_by=None, descending=False, limit=None, after=None):
+        """
+        Find the documents of a bucket matching all the conditions.
+        Parameters:
+            bucket (str): The name of the bucket
+            conditions (list): The (field, operator, value) conditions, the operators are =, <, <=, >, >=, in (value is a list) and exists (value is ignored)
+            order_by (list): The fields the documents are sorted by, the key of the documents is the last sort field
+            descending (bool): Sort the documents in descending order
+            limit (int): The maximum number of documents returned
+            after (list): The values of the `order_by` fields and the key of the last document of the previous page, the documents are returned from the next one
+        Returns:
+            list: The (key, document) tuples
+        """
+        raise NotImplementedError
+
+    def measure(self, bucket, conditions=None):
+        """
+        Count the documents of a bucket matching the conditions and their size.
+        Returns:
+            dict: the number of documents (`items`) and their size in bytes (`size`)
+        """
+        raise NotImplementedError
+
+    def create_index(self, bucket, index_name, fields):
+        """
+        Create a secondary index of a bucket if it doesn't exist.
+        Parameters:
+            bucket (str): The name of the bucket
+            index_name (str): The name of the index
+            fields (list): The indexed fields, a field followed by ` DESC` is indexed in descending order
+        """
+        raise NotImplementedError
+
+    def create_primary_index(self, bucket):
+        """
+        Create the primary index of a bucket if it doesn't exist, the backends indexing the keys don't need it.
+        """
+
+    def query(self, statement, scan_consistency=None, **params):
+        """
+        Run a N1QL statement, only supported by the backends with `supports_query`.
+        Parameters:
+            statement (str): the N1QL statement, the parameters are referenced with $name
+            scan_consistency (str): optional scan consistency, `request_plus` or `not_bounded`
+            params: the values of the named parameters
+        Raises:
+            DatabaseOperationNotSupportedException: if the backend doesn't run N1QL statements
+        """
+        raise DatabaseOperationNotSupportedException(f"The {type(self).__name__} database doesn't support N1QL queries")
+
+    def get(self, bucket, key):
+        """
+        Get a document from the database
+        Raises:
+            DatabaseDocumentNotFoundException: if the document doesn't exist
+        """
+        return self.get_with_cas(bucket, key)[0]
+
+    def check(self, bucket, key):
+        """
+        Check if a document exists in the database
+        """
+        try:
+            self.get_with_cas(bucket, key)
+        except DatabaseDocumentNotFoundException:
+            return False
+        return True
+
+    def insert(self, bucket, key, value, read_back=False, durability=None):
+        """
+        Insert a document into the database, `value` is returned unless `read_back` is set
+        """
+        self.upsert(bucket, key, value, durability)
+        return self.get(bucket, key) if read_back else value
+
+    def update(self, bucket, key, value, read_back=False, durability=None):
+        """
+        Update a document in the database, `value` is returned unless `read_back` is set
+        """
+        self.replace(bucket, key, value, durability=durability)
+        return self.get(bucket, key) if read_back else value
+
+    def replace_with_cas(self, bucket, key, value, cas):
+        """
+        Replace a document only if its CAS value still matches
+        Returns:
+            int: The new CAS value of the document
+        """
+        return self.replace(bucket, key, value, cas=cas)['cas']
+
+    def get_multi(self, bucket, keys):
+        """
+        Get several documents
+        Returns:
+            dict: The documents per key, the missing documents are left out
+        """
+        documents = {}
+        for key in keys:
+            try:
+                documents[key] = self.get(bucket, key)
+            except DatabaseDocumentNotFoundException:
+                continue
+        return documents
+
+    def upsert_multi(self, bucket, documents, durability=None):
+        """
+        Insert or replace several documents
+        Returns:
+            dict: The CAS value and the mutation token of each write, per key
+        """
+        return {key: self.upsert(bucket, key, value, durability) for key, value in documents.items()}
+
+    def remove_multi(self, bucket, keys):
+        """
+        Remove several documents
+        Returns:
+            list: The keys of the removed documents, the documents that didn't exist are left out
+        """
+        removed = []
+        for key in keys:
+            try:
+                self.remove(bucket, key)
+            except DatabaseDocumentNotFoundException:
+                continue
+            removed.append(key)
+        return removed
+
+    def list(self, bucket):
+        """
+        List the documents of a bucket, each row holds the document under the name of the bucket.
+        """
+        return [{bucket: document} for _, document in self.find(bucket)]
+
+    def list_filter(self, bucket, **kwargs):
+        """
+        List the documents of a bucket having the given field values, each row holds the document under the name of the bucket.
+        """
+        conditions = [(field, '=', value) for field, value in kwargs.items()]
+        return [{bucket: document} for _, document in self.find(bucket, conditions)]
+
+
+class DatabaseProxy():
+    # init method or constructor
+    def __init__(self):
+        self.backend = None
+
+    def select(self, backend=None):
+        """
+        Select the backend of the database, `DATABASE_BACKEND` by default. The backend is only created once.
+        Parameters:
+            backend (str): couchbase, sqlite or memory
+        Returns:
+            Database: the backend
+        """
+        if self.backend is None:
+            self.backend = create_database(backend or os.environ.get('DATABASE_BACKEND', 'couchbase'))
+        return self.backend
+
+    def connect(self):
+        """
+        Select the backend if needed and open the database.
+        """
+        self.select().connect()
+
+    def __getattr__(self, name):
+        # the methods of the interface are called on the selected backend
+        return getattr(self.select(), name)
+
+
+def create_database(backend):
+    """
+    Create a database backend.
+    Parameters:
+        backend (str): couchbase, sqlite or memory
+    Returns:
+        Database: the backend, not connected yet
+    Raises:
+        DatabaseOperationNotSupportedException: if the backend is unknown
+    """
+    if backend == 'couchbase':
+        from api.internal.couchbase import CouchbaseCluster
+        return CouchbaseCluster()
+    if backend == 'sqlite':
+        from api.internal.sqlite_database import SQLiteDatabase
+        return SQLiteDatabase(os.environ.get('DATABASE_PATH', 'couchbase-manager.db'))
+    if backend == 'memory':
+        from api.internal.memory_database import MemoryDatabase
+        return MemoryDatabase()
+    raise DatabaseOperationNotSupportedException(f"Unknown database backend {backend}, expected one of {', '.join(DATABASE_BACKENDS)}")
+
+
+def field_parts(field):
+    """
+    Split a field in its path and its sort order.
+    Returns:
+        tuple: the parts of the path and True if the field is in descending order
+    """
+    descending = field.endswith(' DESC')
+    if descending:
+        field = field[:-len(' DESC')]
+    return field.split('.'), descending
+
+
+def get_path(document, field):
+    """
+    Get the value of a field of a document, MISSING if the field doesn't exist.
+    """
+    value = document
+    for part in field.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return MISSING
+        value = value[part]
+    return value
+
+
+def apply_mutations(document, fields=None, appends=None, increments=None):
+    """
+    Apply the changes of a mutate_in call to a document, the missing parent fields are created.
+    """
+    for path, value in (fields or {}).items():
+        parent, name = __parent(document, path)
+        parent[name] = value
+    for path, values in (appends or {}).items():
+        parent, name = __parent(document, path)
+        parent[name] = list(parent.get(name) or []) + list(values)
+    for path, delta in (increments or {}).items():
+        parent, name = __parent(document, path)
+        parent[name] = (parent.get(name) or 0) + delta
+
+
+def matches(document, conditions):
+    """
+    Check if a document matches all the (field, operator, value) conditions.
+    """
+    for field, operator, value in conditions or []:
+        current = get_path(document, field)
+        if operator == 'exists':
+            if current is MISSING:
+                return False
+            continue
+        if current is MISSING or current is None:
+            return False
+        if operator == 'in':
+            if current not in value:
+                return False
+        elif operator == '=':
+            if current != value:
+                return False
+        elif not __compare(current, operator, value):
+            return False
+    return True
+
+
+def __compare(current, operator, value):
+    """
+    Compare a field with a value, the values of different types don't match.
+    """
+    try:
+        if operator == '<':
+            return current < value
+        if operator == '<=':
+            return current <= value
+        if operator == '>':
+            return current > value
+        return current >= value
+    except TypeError:
+        return False
+
+
+def __parent(document, path):
+    """
+    Get the object holding the last part of a path, the missing objects are created.
+    """
+    parts = path.split('.')
+    parent = document
+    for part in parts[:-1]:
+        if not isinstance(parent.get(part), dict):
+            parent[part] = {}
+        parent = parent[part]
+    return parent, parts[-1]
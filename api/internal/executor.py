@@ -0,0 +1,241 @@
+# Description: This module contains the JobExecutor class, a fixed pool of worker threads that runs the background jobs of the API. Submitted jobs wait in a bounded queue and new submissions are rejected once the queue is full, so the number of threads stays constant whatever the load.
+# Jobs can be submitted with a lock key (e.g. the project, region and name of a cluster), the jobs sharing a key are executed one at a time in their submission order while jobs with different keys still run in parallel.
+# The order in which the queued jobs are started is decided by a FairShareScheduler, according to their GCP project and priority class.
+# The queue positions are saved by the position listener outside of the executor lock, each position carries a sequence number and the positions overtaken by a newer one are not saved.
+import itertools
+import threading
+from collections import deque
+from loguru import logger
+from api.internal.scheduler import FairShareScheduler
+from utils.exceptions import JobQueueFullException, JobExecutorUnavailableException
+
+
+class JobExecutor():
+    # init method or constructor
+    def __init__(self, on_position_change=None):
+        # callback called with (job_id, position) when a job waits behind another job with the same lock key,
+        # the position is None once the job is moved to the executor queue
+        self.on_position_change = on_position_change
+        self.max_workers = 0
+        self.max_queue_size = 0
+        self.running = False
+        self.workers = []
+        # jobs waiting for a free worker
+        self.scheduler = FairShareScheduler()
+        # jobs waiting for the job holding the same lock key to finish, per lock key
+        self.key_queues = {}
+        # lock keys held by a job of the executor queue or by a running job
+        self.busy_keys = set()
+        # ids of the jobs currently executed by a worker
+        self.active_jobs = set()
+        # sequence number of the last position of each job waiting for a lock key, a position is only saved if it is still the last one
+        self.position_sequence = itertools.count()
+        self.position_versions = {}
+        # serializes the calls of the position listener, so that a newer position is never saved before an older one
+        self.position_lock = threading.Lock()
+        # counters
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        # the condition protects all the attributes above and wakes up the workers
+        self.condition = threading.Condition()
+
+    def init_app(self, app):
+        """
+        Start the executor with the configuration of the flask application.
+        Parameters:
+            app: the Flask application instance.
+        """
+        with self.condition:
+            self.scheduler.configure(
+                app.config.get('JOB_PROJECT_MAX_RUNNING', 0),
+                app.config.get('JOB_PROJECT_WEIGHTS', {}),
+                app.config.get('JOB_PRIORITY_AGING_SECONDS', 300)
+            )
+        self.start(app.config.get('JOB_EXECUTOR_WORKERS', 8), app.config.get('JOB_EXECUTOR_QUEUE_SIZE', 64))
+
+    def start(self, max_workers, max_queue_size):
+        """
+        Start the worker threads, this function does nothing if the executor is already running.
+        Parameters:
+            max_workers (int): the number of worker threads
+            max_queue_size (int): the maximum number of jobs waiting for a worker
+        """
+        with self.condition:
+            if self.running:
+                return
+            self.max_workers = max_workers
+            self.max_queue_size = max_queue_size
+            self.running = True
+            for index in range(max_workers):
+                worker = threading.Thread(target=self.__work, name=f"job-worker-{index}", daemon=True)
+                worker.start()
+                self.workers.append(worker)
+        logger.info(f"Job executor started with {max_workers} workers and a queue of {max_queue_size} jobs")
+
+    def submit(self, job_id, function, *args, lock_key=None, project=None, priority=None, **kwargs):
+        """
+        Submit a job to the executor, the function is called by one of the workers with the given arguments.
+        Parameters:
+            job_id (str): the id of the job
+            function (callable): the function to run
+            lock_key (tuple): optional key serializing the jobs that operate on the same resource
+            project (str): the GCP project of the job, used to share the workers fairly between the projects
+            priority (str): the priority class of the job: `high`, `normal` or `low`
+        Returns:
+            int: the position of the job behind the jobs with the same lock key, 0 if the job went directly to the executor queue
+        Raises:
+            JobExecutorUnavailableException: if the executor is not running
+            JobQueueFullException: if the queue is full
+        """
+        job = (job_id, function, args, kwargs, lock_key, project, priority)
+        with self.condition:
+            if not self.running:
+                self.rejected += 1
+                raise JobExecutorUnavailableException("The job executor is not running")
+            if self.__waiting_jobs() >= self.max_queue_size:
+                self.rejected += 1
+                raise JobQueueFullException(f"The job queue is full ({self.max_queue_size} jobs waiting), retry later")
+            self.submitted += 1
+            if lock_key is None or lock_key not in self.busy_keys:
+                if lock_key is not None:
+                    self.busy_keys.add(lock_key)
+                self.scheduler.push(job, project, priority)
+                # wake up one idle worker
+                self.condition.notify()
+                return 0
+            # another job holds the key, wait behind it
+            key_queue = self.key_queues.setdefault(lock_key, deque())
+            key_queue.append(job)
+            position = len(key_queue)
+            # the position is versioned under the lock and saved once the lock is released, it is skipped if the job is handed the key meanwhile
+            update = self.__version_position(job_id, position)
+        self.__notify_positions([update])
+        return position
+
+    def stats(self):
+        """
+        Get the state of the executor.
+        Returns:
+            dict: the number of workers, running and queued jobs and the counters of the executor
+        """
+        with self.condition:
+            return {
+                'running': self.running,
+                'workers': self.max_workers,
+                'active': len(self.active_jobs),
+                'queued': len(self.scheduler),
+                'waiting_for_lock': self.__waiting_jobs() - len(self.scheduler),
+                'locked_keys': len(self.busy_keys),
+                'queue_size': self.max_queue_size,
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+                'completed': self.completed,
+                'scheduler': self.scheduler.stats()
+            }
+
+    def shutdown(self, wait=True):
+        """
+        Stop accepting new jobs, the workers exit once the queued jobs are executed.
+        Parameters:
+            wait (bool): wait for the workers to exit
+        """
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if wait:
+            for worker in self.workers:
+                worker.join()
+        self.workers = []
+
+    def __work(self):
+        """
+        Main loop of a worker thread, it takes the jobs chosen by the scheduler one by one.
+        """
+        while True:
+            with self.condition:
+                while True:
+                    entry = self.scheduler.pop()
+                    if entry is not None:
+                        break
+                    if not self.running:
+                        # the executor has been shut down, the queue is drained regardless of the project quotas
+                        entry = self.scheduler.drain()
+                        break
+                    # the queue is empty or its jobs are blocked by the quotas of their project
+                    self.condition.wait()
+                if entry is None:
+                    return
+                job, project = entry
+                job_id, function, args, kwargs, lock_key, _, _ = job
+                self.active_jobs.add(job_id)
+            with logger.contextualize(job_id=job_id):
+                try:
+                    function(*args, **kwargs)
+                except Exception as e:
+                    logger.error(f"Unhandled error in the job: {e}")
+                finally:
+                    with self.condition:
+                        self.active_jobs.discard(job_id)
+                        self.completed += 1
+                        self.scheduler.release(project)
+                        # a job of the project may have been blocked by its quota
+                        self.condition.notify()
+                    if lock_key is not None:
+                        self.__release_key(lock_key)
+
+    def __release_key(self, lock_key):
+        """
+        Hand the lock key over to the next job waiting for it, or free the key if no job is waiting.
+        """
+        with self.condition:
+            key_queue = self.key_queues.get(lock_key)
+            if not key_queue:
+                self.key_queues.pop(lock_key, None)
+                self.busy_keys.discard(lock_key)
+                return
+            next_job = key_queue.popleft()
+            updates = [self.__version_position(next_job[0], None)]
+            updates += [self.__version_position(job[0], position) for position, job in enumerate(key_queue, start=1)]
+        # the listeners are called outside of the lock, the next job is only queued afterwards
+        # so that its status can't be overwritten once a worker started it
+        self.__notify_positions(updates)
+        with self.condition:
+            self.scheduler.push(next_job, next_job[5], next_job[6])
+            self.condition.notify()
+
+    def __waiting_jobs(self):
+        """
+        Number of jobs waiting for a worker or for a lock key, the condition must be held by the caller.
+        """
+        return len(self.scheduler) + sum(len(key_queue) for key_queue in self.key_queues.values())
+
+    def __version_position(self, job_id, position):
+        """
+        Give a new sequence number to the position of a job, the condition must be held by the caller.
+        Returns:
+            tuple: the job id, the position and its sequence number, to pass to `__notify_positions`
+        """
+        sequence = next(self.position_sequence)
+        self.position_versions[job_id] = sequence
+        return job_id, position, sequence
+
+    def __notify_positions(self, updates):
+        """
+        Call the position listener for the versioned positions, the condition must not be held by the caller.
+        The positions overtaken by a newer position of the same job are skipped, the errors of the listener are logged and ignored.
+        """
+        for job_id, position, sequence in updates:
+            with self.position_lock:
+                if self.position_versions.get(job_id) != sequence:
+                    # a newer position of the job has been saved or is about to be
+                    continue
+                if position is None:
+                    # the job left the lock key queue, it has no position anymore
+                    del self.position_versions[job_id]
+                if self.on_position_change is None:
+                    continue
+                try:
+                    self.on_position_change(job_id, position)
+                except Exception as e:
+                    logger.error(f"Error updating the queue position of the job {job_id}: {e}")
@@ -0,0 +1,32 @@
+# Description: This module contains the secondary indexes of the buckets used by the REST API and the function creating them. The indexes are created once,
+# when the server starts or with `python main.py migrate-db`, instead of on every query. Each hot-path query has an index starting with the fields of its filter:
+# - users: the login looks up by username the users registered before the username key documents, and `migrate-db` backfills their key documents, the API keys are reloaded by a query on their `api_key` flag,
+# - jobs: the job list filters and sorts by creation time, the durable queue filters the queued jobs by status, lock key and lease.
+# The clusters bucket is only read by key and has no secondary index.
+from loguru import logger
+from api.extensions import database
+from api.internal.jobs_controller import JOB_INDEXES
+
+
+# secondary indexes per bucket: the indexed expressions per index name
+INDEXES = {
+    'users': {
+        'idx_users_username': ['username'],
+        'idx_users_api_keys': ['api_key']
+    },
+    'jobs': dict(JOB_INDEXES, idx_jobs_queue=['queued', 'status', 'lock_key', 'lease_expires_at', 'created_at'])
+}
+
+
+def bootstrap_indexes(primary_indexes=False):
+    """
+    Create the secondary indexes of the buckets if they don't exist.
+    Parameters:
+        primary_indexes (bool): also create the primary indexes, only needed to list whole buckets
+    """
+    for bucket, indexes in INDEXES.items():
+        if primary_indexes:
+            database.create_primary_index(bucket)
+        for index_name, fields in indexes.items():
+            logger.info(f"Creating the index {index_name} of the bucket {bucket} if it doesn't exist")
+            database.create_index(bucket, index_name, fields)
@@ -0,0 +1,210 @@
+# Description: This module contains the JobArchiver class which applies the retention policy of the `jobs` bucket. The finished jobs get a document TTL and are removed by couchbase once it expires.
+# The optional archiver compacts the finished jobs older than a given age, either into per-day summary documents of the `jobs` bucket or into NDJSON files of a GCS bucket, and removes them from the bucket.
+# A batch whose removal failed is archived again by the next run: the summaries skip the jobs they already list, and the NDJSON file of a batch is named after its jobs so that it is overwritten.
+import datetime
+import hashlib
+import json
+import threading
+from loguru import logger
+from api.extensions import database
+from api.internal.job_events import TERMINAL_STATUSES
+from shared.entities.gcp_project import GCPProject
+from shared.lib.storage import upload_blob_from_string
+
+
+# fields of a job kept in the per-day summary documents
+SUMMARY_FIELDS = ('name', 'type', 'status', 'cluster_name', 'project-id', 'created_at', 'message')
+
+
+class JobArchiver():
+    # init method or constructor
+    def __init__(self):
+        self.retention_seconds = 0
+        self.target = None
+        self.archive_after_seconds = 7 * 24 * 3600
+        self.interval = 3600
+        self.batch_size = 500
+        self.gcs_bucket = None
+        self.gcs_project_id = None
+        self.thread = None
+        self.stopped = threading.Event()
+        # counters of the archiver, protected by the lock
+        self.lock = threading.Lock()
+        self.runs = 0
+        self.archived = 0
+        self.failed = 0
+        self.last_run_at = None
+        self.last_error = None
+
+    def init_app(self, app):
+        """
+        Configure the retention policy with the configuration of the flask application and start the archiver
+        if `JOB_ARCHIVE_TARGET` is set.
+        Parameters:
+            app: the Flask application instance.
+        """
+        self.configure(
+            app.config.get('JOB_RETENTION_SECONDS', 0),
+            app.config.get('JOB_ARCHIVE_TARGET') or None,
+            app.config.get('JOB_ARCHIVE_AFTER_SECONDS', 7 * 24 * 3600),
+            app.config.get('JOB_ARCHIVE_INTERVAL', 3600),
+            app.config.get('JOB_ARCHIVE_BATCH_SIZE', 500),
+            app.config.get('JOB_ARCHIVE_BUCKET'),
+            app.config.get('JOB_ARCHIVE_PROJECT_ID')
+        )
+        if self.target:
+            self.start()
+
+    def configure(self, retention_seconds, target=None, archive_after_seconds=7 * 24 * 3600, interval=3600, batch_size=500, gcs_bucket=None, gcs_project_id=None):
+        """
+        Configure the retention policy.
+        Parameters:
+            retention_seconds (int): the time to live of the finished jobs, 0 to keep them forever
+            target (str): where the archiver compacts the old jobs: `couchbase`, `gcs` or None to disable it
+            archive_after_seconds (int): the age of the finished jobs compacted by the archiver
+            interval (int): the seconds between two runs of the archiver
+            batch_size (int): the maximum number of jobs compacted per run
+            gcs_bucket (str): the GCS bucket of the NDJSON archives, for the `gcs` target
+            gcs_project_id (str): the GCP project of the GCS bucket
+        """
+        if target not in (None, 'couchbase', 'gcs'):
+            raise ValueError(f"Unknown job archive target {target}")
+        self.retention_seconds = retention_seconds
+        self.target = target
+        self.archive_after_seconds = archive_after_seconds
+        self.interval = interval
+        self.batch_size = batch_size
+        self.gcs_bucket = gcs_bucket
+        self.gcs_project_id = gcs_project_id
+
+    def expiry(self):
+        """
+        Time to live of the finished jobs, None if they are kept forever.
+        """
+        if self.retention_seconds > 0:
+            return datetime.timedelta(seconds=self.retention_seconds)
+        return None
+
+    def start(self):
+        """
+        Start the archiver thread, this function does nothing if it is already running.
+        """
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.__loop, name="job-archiver", daemon=True)
+        self.thread.start()
+        logger.info(f"Job archiver started, finished jobs older than {self.archive_after_seconds}s are compacted to {self.target}")
+
+    def stop(self):
+        """
+        Stop the archiver thread.
+        """
+        self.stopped.set()
+
+    def run_once(self):
+        """
+        Compact one batch of old finished jobs.
+        Returns:
+            dict: the number of archived jobs and the number of jobs that couldn't be archived
+        """
+        cutoff = (datetime.datetime.utcnow() - datetime.timedelta(seconds=self.archive_after_seconds)).isoformat()
+        rows = database.find('jobs', [('status', 'in', list(TERMINAL_STATUSES)), ('created_at', '<', cutoff)], order_by=['created_at'], limit=self.batch_size)
+        jobs = [dict(job, id=job_id) for job_id, job in rows]
+        # the jobs are archived per creation day
+        days = {}
+        for job in jobs:
+            days.setdefault(job['created_at'][:10], []).append(job)
+        archived = 0
+        failed = 0
+        errors = []
+        for day, day_jobs in days.items():
+            try:
+                if self.target == 'gcs':
+                    self.__archive_to_gcs(day, day_jobs)
+                else:
+                    self.__archive_to_summary(day, day_jobs)
+            except Exception as e:
+                logger.error(f"Error archiving the jobs of {day}: {e}")
+                errors.append(f"Error archiving the jobs of {day}: {e}")
+                failed += len(day_jobs)
+                continue
+            try:
+                # the jobs expired meanwhile are already removed
+                archived += len(database.remove_multi('jobs', [job['id'] for job in day_jobs]))
+            except Exception as e:
+                # the jobs are archived again by the next run, without duplicates
+                logger.warning(f"Could not remove the archived jobs of {day}: {e}")
+                errors.append(f"Could not remove the archived jobs of {day}: {e}")
+        with self.lock:
+            self.runs += 1
+            self.archived += archived
+            self.failed += failed
+            self.last_run_at = datetime.datetime.utcnow().isoformat()
+            # the error of the last run, None once a run succeeds
+            self.last_error = errors[-1] if errors else None
+        logger.info(f"Job archiver run: {archived} jobs archived, {failed} failed")
+        return {'archived': archived, 'failed': failed}
+
+    def stats(self):
+        """
+        Get the size of the jobs bucket and the counters of the archiver.
+        Returns:
+            dict: the number and size of the jobs, the retention settings and the counters of the archiver
+        """
+        size = database.measure('jobs', [('created_at', 'exists', None)])
+        with self.lock:
+            return {
+                'jobs': size['items'],
+                'size_bytes': size['size'],
+                'retention_seconds': self.retention_seconds,
+                'archive_target': self.target,
+                'archive_after_seconds': self.archive_after_seconds,
+                'runs': self.runs,
+                'archived': self.archived,
+                'failed': self.failed,
+                'last_run_at': self.last_run_at,
+                'last_error': self.last_error
+            }
+
+    def __loop(self):
+        """
+        Main loop of the archiver thread.
+        """
+        while not self.stopped.wait(self.interval):
+            try:
+                # the batches are compacted until no old job is left
+                while self.run_once()['archived'] >= self.batch_size:
+                    pass
+            except Exception as e:
+                logger.error(f"Error running the job archiver: {e}")
+                with self.lock:
+                    self.last_error = str(e)
+
+    def __archive_to_summary(self, day, jobs):
+        """
+        Add the jobs to the summary document of their creation day with a single sub-document operation. The jobs already
+        listed by the summary are skipped, and the update is guarded by the CAS of the read so that two runs can't add the same jobs.
+        Raises:
+            DatabaseConflictException: if the summary has been modified since it was read, the jobs are archived by the next run
+        """
+        key = f"jobs-archive::{day}"
+        database.insert_if_absent('jobs', key, {'archive': True, 'day': day, 'total': 0, 'statuses': {}, 'types': {}, 'jobs': []})
+        summary, cas = database.get_with_cas('jobs', key)
+        archived_names = {job['name'] for job in summary.get('jobs', [])}
+        jobs = [job for job in jobs if job['name'] not in archived_names]
+        if not jobs:
+            return
+        increments = {'total': len(jobs)}
+        for job in jobs:
+            for path in (f"statuses.{job['status']}", f"types.{job['type']}"):
+                increments[path] = increments.get(path, 0) + 1
+        summaries = [{field: job[field] for field in SUMMARY_FIELDS if field in job} for job in jobs]
+        database.mutate_in('jobs', key, appends={'jobs': summaries}, increments=increments, cas=cas)
+
+    def __archive_to_gcs(self, day, jobs):
+        """
+        Upload the jobs as a NDJSON file named after their creation day and a digest of their ids, the same batch archived again overwrites its file.
+        """
+        content = "\n".join(json.dumps({key: value for key, value in job.items() if key != 'id'}) for job in jobs) + "\n"
+        digest = hashlib.sha256(",".join(sorted(job['id'] for job in jobs)).encode()).hexdigest()[:16]
+        upload_blob_from_string(GCPProject(self.gcs_project_id), self.gcs_bucket, content, f"jobs/{day}/{digest}.ndjson", "application/x-ndjson")
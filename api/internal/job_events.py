@@ -0,0 +1,143 @@
+# Description: This module contains the JobEventBus class, an in-memory buffer of the events of the jobs run by this process: status transitions, step starts and finishes, and log lines.
+# The events of a job are numbered so that the clients of the `/jobs/<id>/events` stream can resume after the last event they received.
+import threading
+import time
+from collections import deque, OrderedDict
+from loguru import logger
+
+
+# statuses after which a job doesn't publish any other event
+TERMINAL_STATUSES = ('COMPLETED', 'FAILED', 'REJECTED', 'CANCELLED')
+
+
+class JobEventBus():
+    # init method or constructor
+    def __init__(self):
+        self.buffer_size = 500
+        self.retention_seconds = 600
+        self.sink_id = None
+        # events of the jobs per job id, in the order the jobs published their first event
+        self.streams = OrderedDict()
+        # the condition protects the streams and wakes up the subscribers
+        self.condition = threading.Condition()
+
+    def init_app(self, app):
+        """
+        Configure the bus with the configuration of the flask application and forward the log lines of the jobs to it.
+        Parameters:
+            app: the Flask application instance.
+        """
+        self.buffer_size = app.config.get('JOB_EVENTS_BUFFER_SIZE', 500)
+        self.retention_seconds = app.config.get('JOB_EVENTS_RETENTION', 600)
+        if self.sink_id is None:
+            # the executor contextualizes the logs of a job with its id
+            self.sink_id = logger.add(self.log_sink, level='INFO', format='{message}', filter=lambda record: 'job_id' in record['extra'])
+
+    def publish(self, job_id, event_type, data):
+        """
+        Publish an event of a job and wake up its subscribers.
+        Parameters:
+            job_id (str): the id of the job
+            event_type (str): the type of the event: status, step or log
+            data (dict): the json payload of the event
+        Returns:
+            dict: the event
+        """
+        with self.condition:
+            stream = self.__stream(job_id)
+            stream['last_id'] += 1
+            event = {'id': stream['last_id'], 'event': event_type, 'data': data}
+            stream['events'].append(event)
+            if event_type == 'status':
+                stream['status'] = data['status']
+                if data['status'] in TERMINAL_STATUSES:
+                    stream['finished_at'] = time.time()
+            self.condition.notify_all()
+            return event
+
+    def publish_status(self, job_id, job):
+        """
+        Publish a status event from a job document, nothing is published if the status didn't change.
+        Parameters:
+            job_id (str): the id of the job
+            job (dict): the job document
+        """
+        with self.condition:
+            stream = self.streams.get(job_id)
+            if stream and stream['status'] == job['status'] and stream['queue_position'] == job.get('queue_position'):
+                return
+            self.__stream(job_id)['queue_position'] = job.get('queue_position')
+            self.publish(job_id, 'status', {
+                'status': job['status'],
+                'message': job.get('message'),
+                'queue_position': job.get('queue_position')
+            })
+
+    def tracks(self, job_id):
+        """
+        Check if the events of a job are published by this process.
+        """
+        with self.condition:
+            return job_id in self.streams
+
+    def wait(self, job_id, last_event_id, timeout):
+        """
+        Wait for the events of a job published after `last_event_id`.
+        Parameters:
+            job_id (str): the id of the job
+            last_event_id (int): the id of the last event received by the client, 0 to get all the buffered events
+            timeout (float): the maximum number of seconds to wait
+        Returns:
+            tuple: the new events and a boolean set once the job is finished and all its events have been returned
+        """
+        deadline = time.time() + timeout
+        with self.condition:
+            while True:
+                stream = self.streams.get(job_id)
+                if stream is None:
+                    return [], False
+                events = [event for event in stream['events'] if event['id'] > last_event_id]
+                finished = stream['finished_at'] is not None
+                if events or finished:
+                    return events, finished
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return [], False
+                self.condition.wait(remaining)
+
+    def log_sink(self, message):
+        """
+        Loguru sink publishing the log lines of the jobs, the records bound with a `step` are published as step events.
+        """
+        record = message.record
+        extra = record['extra']
+        if 'step' in extra:
+            data = {'step': extra['step'], 'status': extra.get('step_status')}
+            if 'duration' in extra:
+                data['duration'] = extra['duration']
+            self.publish(extra['job_id'], 'step', data)
+            return
+        self.publish(extra['job_id'], 'log', {
+            'level': record['level'].name,
+            'message': record['message'],
+            'time': record['time'].isoformat()
+        })
+
+    def __stream(self, job_id):
+        """
+        Get the stream of a job, it is created on the first event. The condition must be held by the caller.
+        """
+        stream = self.streams.get(job_id)
+        if stream is None:
+            self.__prune()
+            stream = {'events': deque(maxlen=self.buffer_size), 'last_id': 0, 'status': None, 'queue_position': None, 'finished_at': None}
+            self.streams[job_id] = stream
+        return stream
+
+    def __prune(self):
+        """
+        Forget the streams of the jobs finished for longer than the retention. The condition must be held by the caller.
+        """
+        expired_before = time.time() - self.retention_seconds
+        for job_id in [job_id for job_id, stream in self.streams.items() if stream['finished_at'] and stream['finished_at'] < expired_before]:
+            del self.streams[job_id]
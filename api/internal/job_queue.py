@@ -0,0 +1,249 @@
+# Description: This module contains the DurableJobQueue class, a job queue persisted in the couchbase `jobs` bucket. The API servers enqueue the jobs and the worker processes (`main.py worker`) claim them with a lease that they renew with heartbeats. The jobs of a worker that stopped are claimed again by another worker once their lease expired.
+# The jobs are claimed by priority class first, then in their creation order.
+# A job with a lock key only runs while it holds the lock document of its key, inserted if absent when the job is claimed, renewed with the lease and removed when the job ends,
+# so two workers can't run jobs with the same lock key even if their claims race. The queue queries wait for the indexes to contain the claims made before them.
+import datetime
+import hashlib
+import json
+import time
+from loguru import logger
+from api.extensions import database, job_events
+from api.internal.jobs_controller import status_entry
+from api.internal.scheduler import PRIORITY_CLASSES
+from utils.exceptions import DatabaseConflictException, DatabaseDocumentNotFoundException, DatabaseOperationNotSupportedException
+
+
+class DurableJobQueue():
+    # init method or constructor
+    def __init__(self):
+        self.enabled = False
+        self.lease_seconds = 60
+        self.max_attempts = 3
+
+    def init_app(self, app):
+        """
+        Configure the queue with the configuration of the flask application, the queue is only used when the
+        `JOB_QUEUE_BACKEND` setting is `couchbase`.
+        """
+        self.configure(
+            app.config.get('JOB_QUEUE_BACKEND', 'local') == 'couchbase',
+            app.config.get('JOB_LEASE_SECONDS', 60),
+            app.config.get('JOB_MAX_ATTEMPTS', 3)
+        )
+
+    def configure(self, enabled, lease_seconds, max_attempts):
+        """
+        Configure the queue.
+        Parameters:
+            enabled (bool): whether the jobs are sent to the durable queue instead of the local executor
+            lease_seconds (int): the duration of the lease of a claimed job
+            max_attempts (int): the number of times a job is claimed before being failed
+        Raises:
+            DatabaseOperationNotSupportedException: if the queue is enabled with a database backend that can't be shared by the worker processes
+        """
+        if enabled and not database.supports_query:
+            raise DatabaseOperationNotSupportedException("The durable job queue needs the couchbase database backend")
+        self.enabled = enabled
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def queue_fields(self, operation_name, gcp_project, lock_key, operation_params, priority='normal'):
+        """
+        Build the fields stored on a job document so that any worker can run it.
+        Parameters:
+            operation_name (str): the name of the registered operation
+            gcp_project (GCPProject): the GCP project of the job
+            lock_key (tuple): the lock key of the job or None
+            operation_params (dict): the json parameters of the operation
+            priority (str): the priority class of the job
+        Returns:
+            dict: the queue fields of the job
+        """
+        return {
+            'queued': True,
+            'operation': operation_name,
+            'operation_params': operation_params,
+            'gcp': {
+                'project-id': gcp_project.project_id,
+                'project-number': gcp_project.project_number
+            },
+            'lock_key': list(lock_key) if lock_key else None,
+            'priority': priority,
+            # rank of the priority class, the claims are sorted by rank
+            'priority_rank': PRIORITY_CLASSES.index(priority),
+            'attempts': 0,
+            'lease_owner': None,
+            'lease_expires_at': None
+        }
+
+    def claim(self, owner, limit):
+        """
+        Claim up to `limit` jobs for a worker. The pending jobs and the running jobs whose lease expired are claimed
+        by priority class then in their creation order, a job is skipped while an older job with the same lock key is waiting or running.
+        Parameters:
+            owner (str): the id of the worker
+            limit (int): the maximum number of jobs to claim
+        Returns:
+            list: the claimed jobs
+        """
+        now = time.time()
+        rows = database.query(
+            "SELECT META().id AS id FROM `jobs` WHERE queued = true "
+            "AND (status = 'PENDING' OR (status IN ['RUNNING', 'CANCELLING'] AND lease_expires_at < $now)) "
+            "ORDER BY IFMISSING(priority_rank, 1), created_at LIMIT $limit",
+            scan_consistency='request_plus', now=now, limit=limit * 4
+        )
+        claimed = []
+        for row in rows:
+            if len(claimed) >= limit:
+                break
+            job = self.__try_claim(row['id'], owner)
+            if job:
+                claimed.append(job)
+        return claimed
+
+    def heartbeat(self, owner, job_ids):
+        """
+        Extend the lease of the jobs run by a worker, and the lock documents of their lock keys.
+        Parameters:
+            owner (str): the id of the worker
+            job_ids (list): the ids of the running jobs
+        Returns:
+            list: the ids of the jobs whose lease has been lost
+        """
+        lost = []
+        for job_id in job_ids:
+            try:
+                job, cas = database.get_with_cas('jobs', job_id)
+                if job.get('lease_owner') != owner or job['status'] not in ('RUNNING', 'CANCELLING'):
+                    lost.append(job_id)
+                    continue
+                database.mutate_in('jobs', job_id, {'lease_expires_at': time.time() + self.lease_seconds}, cas=cas)
+                if job.get('lock_key') and not self.__acquire_lock(job, owner):
+                    # another job holds the lock key, this job lost its exclusivity
+                    lost.append(job_id)
+            except (DatabaseConflictException, DatabaseDocumentNotFoundException) as e:
+                logger.warning(f"Could not extend the lease of the job {job_id}: {e}")
+        return lost
+
+    def release(self, job):
+        """
+        Release the lock key of a finished job so that the next job with the same key can be claimed.
+        Parameters:
+            job (dict): the job returned by `claim`
+        """
+        if not job.get('lock_key'):
+            return
+        key = lock_document_id(job['lock_key'])
+        try:
+            lock = database.get('jobs', key)
+            if lock['job_id'] == job['name']:
+                database.remove('jobs', key)
+        except DatabaseDocumentNotFoundException:
+            pass
+
+    def stats(self):
+        """
+        Count the jobs of the durable queue per status.
+        """
+        rows = database.query(
+            "SELECT status, COUNT(*) AS count FROM `jobs` WHERE queued = true "
+            "AND status IN ['PENDING', 'RUNNING'] GROUP BY status"
+        )
+        counts = {row['status']: row['count'] for row in rows}
+        return {
+            'backend': 'couchbase',
+            'queued': counts.get('PENDING', 0),
+            'active': counts.get('RUNNING', 0),
+            'lease_seconds': self.lease_seconds
+        }
+
+    def __try_claim(self, job_id, owner):
+        """
+        Claim a job with a CAS guarded write, None is returned if another worker claimed it first.
+        """
+        try:
+            job, cas = database.get_with_cas('jobs', job_id)
+        except DatabaseDocumentNotFoundException:
+            return None
+        now = time.time()
+        # the job may have been claimed since the query was run
+        if job['status'] in ('RUNNING', 'CANCELLING') and (job.get('lease_expires_at') or 0) >= now:
+            return None
+        if job['status'] not in ('PENDING', 'RUNNING', 'CANCELLING'):
+            return None
+        if job.get('lock_key') and self.__lock_key_busy(job, now):
+            return None
+        if job['status'] == 'CANCELLING':
+            # the worker stopped before it noticed the cancellation
+            changes = {'status': 'CANCELLED', 'message': "The job has been cancelled, its worker stopped before the end of the job"}
+        elif job.get('attempts', 0) >= self.max_attempts:
+            changes = {'status': 'FAILED', 'message': f"The job lease expired {job['attempts']} times"}
+        else:
+            if job['status'] == 'RUNNING':
+                logger.warning(f"The lease of the job {job_id} held by {job.get('lease_owner')} expired, claiming it again")
+            changes = {
+                'status': 'RUNNING',
+                'attempts': job.get('attempts', 0) + 1,
+                'lease_owner': owner,
+                'lease_expires_at': now + self.lease_seconds
+            }
+            # the job only runs while it holds its lock key
+            if job.get('lock_key') and not self.__acquire_lock(job, owner):
+                return None
+        try:
+            database.mutate_in('jobs', job_id, changes, {'status_history': [status_entry(changes['status'], changes.get('message'))]}, cas=cas)
+        except DatabaseConflictException:
+            if changes['status'] == 'RUNNING':
+                self.release(job)
+            return None
+        job.update(changes)
+        job_events.publish_status(job_id, job)
+        if job['status'] != 'RUNNING':
+            # the lock key may still be held by the stopped worker of the job
+            self.release(job)
+            return None
+        return job
+
+    def __lock_key_busy(self, job, now):
+        """
+        Check if an older job with the same lock key is waiting, or if a job with the same lock key is running.
+        """
+        rows = database.query(
+            "SELECT COUNT(*) AS count FROM `jobs` WHERE queued = true AND lock_key = $lock_key AND META().id != $job_id "
+            "AND ((status IN ['RUNNING', 'CANCELLING'] AND lease_expires_at >= $now) OR (status = 'PENDING' AND created_at < $created_at))",
+            scan_consistency='request_plus', lock_key=job['lock_key'], job_id=job['name'], now=now, created_at=job['created_at']
+        )
+        return rows[0]['count'] > 0
+
+    def __acquire_lock(self, job, owner):
+        """
+        Take or renew the lock document of the lock key of a job, it expires with the lease if the worker stops.
+        Returns:
+            bool: True if the job holds the lock key, False if another job holds it
+        """
+        key = lock_document_id(job['lock_key'])
+        lock = {'job_id': job['name'], 'owner': owner}
+        expiry = datetime.timedelta(seconds=self.lease_seconds)
+        if database.insert_if_absent('jobs', key, lock, expiry):
+            return True
+        try:
+            current, cas = database.get_with_cas('jobs', key)
+        except DatabaseDocumentNotFoundException:
+            # the lock expired meanwhile
+            return database.insert_if_absent('jobs', key, lock, expiry)
+        if current['job_id'] != job['name']:
+            return False
+        # the lock of the job itself, renewed by its worker or left by a worker whose lease expired
+        try:
+            database.mutate_in('jobs', key, lock, cas=cas, expiry=expiry)
+        except (DatabaseConflictException, DatabaseDocumentNotFoundException):
+            return False
+        return True
+
+
+def lock_document_id(lock_key):
+    """
+    Key of the lock document of a lock key, in the jobs bucket.
+    """
+    return "job-lock::" + hashlib.sha256(json.dumps(list(lock_key)).encode()).hexdigest()
@@ -1,9 +1,43 @@
 # Description: Main functions for the management of the jobs. 
-from api.extensions import couchbase
+import base64
+import datetime
+import json
+from api.extensions import database, job_events
+from utils.exceptions import DatabaseConflictException, DatabaseDocumentNotFoundException, InvalidCursorException
+
+
+# number of times a CAS guarded update is retried when the job is modified concurrently
+MAX_CONFLICT_RETRIES = 5
+
+# filters of the job list, per query parameter: the field of the job document
+JOB_LIST_FILTERS = {
+    'status': 'status',
+    'type': 'type',
+    'cluster_name': 'cluster_name',
+    'project-id': 'project-id'
+}
+
+# secondary indexes of the jobs bucket, each filter is indexed with the creation time used to sort the list,
+# the unfiltered list selects the jobs by their name, the other documents of the bucket (archive summaries, lock documents) have none
+JOB_INDEXES = dict(
+    [('idx_jobs_created_at', ['created_at DESC']), ('idx_jobs_name_created_at', ['name', 'created_at DESC'])] +
+    [(f"idx_jobs_{name.replace('-', '_')}_created_at", [field, 'created_at DESC']) for name, field in JOB_LIST_FILTERS.items()]
+)
+
+
+# build an entry of the status history of a job
+def status_entry(status, message=None):
+    """
+    Build an entry of the append-only status history of a job.
+    """
+    entry = {'status': status, 'at': datetime.datetime.utcnow().isoformat()}
+    if message:
+        entry['message'] = message
+    return entry
 
 
 # insert a job in the database  
-def add_job(job_id, cluster_name, job_type, status, project_id):
+def add_job(job_id, cluster_name, job_type, status, project_id, queue_fields=None):
     """
     Insert a job in the database.
     Parameters: 
@@ -12,34 +46,154 @@ def add_job(job_id, cluster_name, job_type, status, project_id):
         job_type (str): the type of the job
         status (str): the status of the job
         project_id (str): the id of the project
+        queue_fields (dict): the fields used by the durable job queue, they are stored but not returned
+    Returns:
+        dict: the job
     """
     job= {
         'name': job_id,
         'cluster_name': cluster_name,
         'type': job_type,
         'status': status,
-        'project-id': project_id
+        'project-id': project_id,
+        'created_at': datetime.datetime.utcnow().isoformat()
     }
     # insert the job in the database
-    couchbase.insert('jobs', job_id, job)
+    document = dict(job, status_history=[status_entry(status)], **(queue_fields or {}))
+    database.insert('jobs', job_id, document)
+    job_events.publish_status(job_id, job)
+    return job
 
 # update the status of a job
-def update_job_status(job_id, status, message=None):
+def update_job_status(job_id, status, message=None, expected_statuses=None, fields=None, expiry=None):
     """
-    Update the status of a job.
+    Update the status of a job and append it to the status history with a single sub-document operation.
+    When `expected_statuses` is given, the job is read first and only updated if its current status is one of them,
+    the update is guarded by the CAS of the read and retried if another writer modified the job in between.
     Parameters:
         job_id (str): the id of the jobs
         status (str): the status of the job
         message (str): the message of the job
+        expected_statuses (tuple): the statuses the job may be in for the update to be applied
+        fields (dict): other fields of the job to set with the status
+        expiry (timedelta): optional time to live of the job document, set with the final status of the job
+    Returns:
+        bool: True if the job has been updated, False if its status wasn't one of the expected statuses
+    Raises:
+        DatabaseConflictException: if the job kept being modified concurrently
     """
-    # get the job from the database
-    job = couchbase.get('jobs', job_id)
-    # update the status of the job
-    job['status'] = status
+    changes = dict(fields or {}, status=status)
     if message:
-        job['message'] = message
-    # update the job in the database
-    couchbase.update('jobs', job_id, job)
+        changes['message'] = message
+    history = {'status_history': [status_entry(status, message)]}
+    if expected_statuses is None:
+        database.mutate_in('jobs', job_id, changes, history, expiry=expiry)
+    else:
+        for attempt in range(MAX_CONFLICT_RETRIES):
+            job, cas = database.get_with_cas('jobs', job_id)
+            if job['status'] not in expected_statuses:
+                return False
+            try:
+                database.mutate_in('jobs', job_id, changes, history, cas=cas, expiry=expiry)
+                break
+            except DatabaseConflictException:
+                continue
+        else:
+            raise DatabaseConflictException(f"The job {job_id} kept being modified concurrently, status {status} not saved")
+    job_events.publish_status(job_id, changes)
+    return True
+
+# update the position of a job waiting behind another job of the same cluster
+def update_job_queue_position(job_id, position):
+    """
+    Update the queue position of a job waiting for the jobs of the same cluster to finish.
+    Parameters:
+        job_id (str): the id of the job
+        position (int): the position of the job, None once the job is handed to the executor
+    """
+    # the job may have been cancelled while it was waiting
+    update_job_status(job_id, 'PENDING' if position is None else 'QUEUED', fields={'queue_position': position}, expected_statuses=('PENDING', 'QUEUED'))
+
+
+# save the steps of a job
+def update_job_steps(job_id, steps):
+    """
+    Save the step records of a running job (name, start and end time, duration, GCP operation ids, retries).
+    """
+    database.mutate_in('jobs', job_id, {'steps': steps})
+
+
+# compute the duration percentiles of the steps
+def get_step_stats(job_type=None, since=None):
+    """
+    Compute the p50, p95 and p99 durations of the finished jobs and of their steps, per job type and step name.
+    Parameters:
+        job_type (str): only the jobs of this type are aggregated
+        since (str): only the jobs created after this ISO date are aggregated
+    Returns:
+        dict: per job type, the percentiles of the job durations and of each step
+    """
+    if not database.supports_query:
+        job_rows, step_rows = aggregate_durations(job_type, since)
+    else:
+        conditions = ['j.created_at >= $since']
+        params = {'since': since or ''}
+        if job_type:
+            conditions.append('j.type = $type')
+            params['type'] = job_type
+        where = ' AND '.join(conditions)
+        step_rows = database.query(
+            "SELECT j.type AS job_type, s.name AS step, ARRAY_AGG(s.duration) AS durations FROM `jobs` AS j UNNEST j.steps AS s "
+            "WHERE " + where + " AND s.status = 'completed' AND s.duration IS VALUED GROUP BY j.type, s.name",
+            **params
+        )
+        job_rows = database.query(
+            "SELECT j.type AS job_type, ARRAY_AGG(j.duration) AS durations FROM `jobs` AS j "
+            "WHERE " + where + " AND j.status = 'COMPLETED' AND j.duration IS VALUED GROUP BY j.type",
+            **params
+        )
+    stats = {}
+    for row in job_rows:
+        stats.setdefault(row['job_type'], {'steps': {}})['job'] = percentiles(row['durations'])
+    for row in step_rows:
+        stats.setdefault(row['job_type'], {'steps': {}})['steps'][row['step']] = percentiles(row['durations'])
+    return stats
+
+
+# group the durations of the jobs and of their steps without N1QL
+def aggregate_durations(job_type=None, since=None):
+    """
+    Group the durations of the completed jobs and of their completed steps per job type and step name, used with the
+    database backends that don't run N1QL statements.
+    Returns:
+        tuple: the job rows and the step rows, with the same fields as the N1QL aggregations of get_step_stats
+    """
+    conditions = [('created_at', '>=', since or '')]
+    if job_type:
+        conditions.append(('type', '=', job_type))
+    job_durations = {}
+    step_durations = {}
+    for _, job in database.find('jobs', conditions):
+        if job.get('status') == 'COMPLETED' and job.get('duration') is not None:
+            job_durations.setdefault(job['type'], []).append(job['duration'])
+        for step in job.get('steps') or []:
+            if step.get('status') == 'completed' and step.get('duration') is not None:
+                step_durations.setdefault((job['type'], step['name']), []).append(step['duration'])
+    job_rows = [{'job_type': name, 'durations': durations} for name, durations in job_durations.items()]
+    step_rows = [{'job_type': name, 'step': step, 'durations': durations} for (name, step), durations in step_durations.items()]
+    return job_rows, step_rows
+
+
+# compute the percentiles of a list of durations
+def percentiles(durations):
+    """
+    Compute the count, p50, p95, p99 and max of a list of durations with the nearest-rank method, the null durations are ignored.
+    """
+    values = sorted(duration for duration in durations or [] if isinstance(duration, (int, float)))
+    if not values:
+        return {'count': 0, 'p50': None, 'p95': None, 'p99': None, 'max': None}
+    rank = lambda percent: values[max(0, -(-len(values) * percent // 100) - 1)]
+    return {'count': len(values), 'p50': rank(50), 'p95': rank(95), 'p99': rank(99), 'max': values[-1]}
 
 
 # check if the job exists in the database.
@@ -47,20 +201,83 @@ def check_job(job_id):
     """
     Check if the job exists in the database.
     """
-    return couchbase.check('jobs', job_id)
+    return database.check('jobs', job_id)
 
 # get the job from the database
 def get_job(job_id):
     """
     Get the job from the database.
     """
-    return couchbase.get('jobs', job_id)
+    return database.get('jobs', job_id)
+
+# get a page of the list of the jobs from the database
+def get_job_list(filters=None, limit=100, cursor=None):
+    """
+    Get a page of the jobs from the database, the newest jobs first. The pages are read with keyset pagination:
+    the cursor of a page is the creation time and the id of its last job, the next page starts after it.
+    Parameters:
+        filters (dict): the values the jobs must have, per key of JOB_LIST_FILTERS, the None values are ignored
+        limit (int): the maximum number of jobs of the page
+        cursor (str): the cursor returned with the previous page, None for the first page
+    Returns:
+        tuple: the jobs of the page and the cursor of the next page, None if it is the last page
+    Raises:
+        InvalidCursorException: if the cursor can't be decoded
+    """
+    # the jobs created before `created_at` was recorded get one from `python main.py migrate-db`
+    conditions = [('name', 'exists', None)]
+    for name, value in (filters or {}).items():
+        if value is not None:
+            conditions.append((JOB_LIST_FILTERS[name], '=', value))
+    after = decode_job_cursor(cursor) if cursor else None
+    # one more job than the page size is read to know if there is a next page
+    rows = database.find('jobs', conditions, order_by=['created_at'], descending=True, limit=limit + 1, after=after)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        job_id, job = rows[-1]
+        next_cursor = encode_job_cursor(job['created_at'], job_id)
+    jobs_list = [job for _, job in rows]
+    return jobs_list, next_cursor
+
+# set the creation time of the jobs created before it was recorded
+def backfill_job_created_at():
+    """
+    Set the `created_at` field of the jobs created before it was recorded, so that they are sorted and paginated with the other jobs.
+    The creation time is the time of the first status of the job, or the epoch if the job has no status history, the job is then listed last.
+    Returns:
+        int: the number of jobs updated
+    """
+    written = 0
+    for job_id, job in database.find('jobs', [('name', 'exists', None)]):
+        if job.get('created_at'):
+            continue
+        history = job.get('status_history') or []
+        created_at = history[0]['at'] if history and history[0].get('at') else datetime.datetime(1970, 1, 1).isoformat()
+        try:
+            database.mutate_in('jobs', job_id, {'created_at': created_at})
+        except DatabaseDocumentNotFoundException:
+            # the job expired meanwhile
+            continue
+        written += 1
+    return written
+
+# encode the cursor of a page of jobs
+def encode_job_cursor(created_at, job_id):
+    """
+    Encode the position of a job in the job list as an opaque cursor.
+    """
+    return base64.urlsafe_b64encode(json.dumps([created_at, job_id]).encode()).decode()
 
-# get the list of the jobs from the database
-def get_job_list():
+# decode the cursor of a page of jobs
+def decode_job_cursor(cursor):
     """
-    Get the list of the jobs from the database.
+    Decode a cursor built by encode_job_cursor.
+    Raises:
+        InvalidCursorException: if the cursor is malformed
     """
-    jobs_list = couchbase.list('jobs')
-    jobs_list = list(map(lambda jobs: jobs['jobs'], jobs_list))
-    return jobs_list
+    try:
+        created_at, job_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise InvalidCursorException("Invalid cursor")
+    return created_at, job_id
@@ -0,0 +1,127 @@
+# Description: This file contains the MemoryDatabase class, a database backend keeping the documents in dictionaries of the process. It is used for local runs and tests,
+# nothing is persisted and the documents aren't shared between processes. The documents are copied on every read and write so that the callers never share them with the store.
+import copy
+import itertools
+import json
+import threading
+import time
+from api.internal.database import Database, get_path, apply_mutations, matches, MISSING
+from utils.exceptions import DatabaseConflictException, DatabaseDocumentNotFoundException
+
+
+class MemoryDatabase(Database):
+    # init method or constructor
+    def __init__(self):
+        # entries per bucket and key: the document, its CAS value and its expiration time
+        self.buckets = {}
+        self.cas_counter = itertools.count(1)
+        # the lock makes every operation atomic
+        self.lock = threading.RLock()
+
+    def connect(self):
+        """
+        Nothing to open, the buckets are created on their first write.
+        """
+
+    def get_with_cas(self, bucket, key):
+        with self.lock:
+            entry = self.__entry(bucket, key)
+            if entry is None:
+                raise DatabaseDocumentNotFoundException(f"Document {key} not found")
+            return copy.deepcopy(entry['value']), entry['cas']
+
+    def upsert(self, bucket, key, value, durability=None):
+        with self.lock:
+            return self.__store(bucket, key, copy.deepcopy(value))
+
+    def replace(self, bucket, key, value, cas=None, durability=None):
+        with self.lock:
+            entry = self.__entry(bucket, key)
+            if entry is None:
+                raise DatabaseDocumentNotFoundException(f"Document {key} not found")
+            if cas and entry['cas'] != cas:
+                raise DatabaseConflictException(f"Document {key} has been modified concurrently")
+            return self.__store(bucket, key, copy.deepcopy(value))
+
+    def insert_if_absent(self, bucket, key, value, expiry=None):
+        with self.lock:
+            if self.__entry(bucket, key) is not None:
+                return False
+            self.__store(bucket, key, copy.deepcopy(value), expiry)
+            return True
+
+    def mutate_in(self, bucket, key, fields=None, appends=None, cas=None, increments=None, expiry=None, create_document=False, durability=None):
+        with self.lock:
+            entry = self.__entry(bucket, key)
+            if entry is None and not create_document:
+                raise DatabaseDocumentNotFoundException(f"Document {key} not found")
+            if entry is not None and cas and entry['cas'] != cas:
+                raise DatabaseConflictException(f"Document {key} has been modified concurrently")
+            document = copy.deepcopy(entry['value']) if entry else {}
+            apply_mutations(document, fields, copy.deepcopy(appends), increments)
+            # the expiration is kept unless a new one is given
+            expires_at = entry['expires_at'] if entry and not expiry else None
+            return self.__store(bucket, key, document, expiry, expires_at)['cas']
+
+    def remove(self, bucket, key):
+        with self.lock:
+            if self.__entry(bucket, key) is None:
+                raise DatabaseDocumentNotFoundException(f"Document {key} not found")
+            del self.buckets[bucket][key]
+
+    def find(self, bucket, conditions=None, order_by=None, descending=False, limit=None, after=None):
+        with self.lock:
+            now = time.time()
+            documents = [(key, entry['value']) for key, entry in self.buckets.get(bucket, {}).items()
+                         if not self.__expired(entry, now) and matches(entry['value'], conditions)]
+            if order_by:
+                # the documents missing a sort field can't be ordered and are left out
+                rows = []
+                for key, document in documents:
+                    values = [get_path(document, field) for field in order_by]
+                    if MISSING not in values and None not in values:
+                        rows.append((tuple(values) + (key,), key, document))
+            else:
+                rows = [((key,), key, document) for key, document in documents]
+            if after is not None:
+                after = tuple(after)
+                rows = [row for row in rows if (row[0] < after if descending else row[0] > after)]
+            rows.sort(key=lambda row: row[0], reverse=descending)
+            if limit is not None:
+                rows = rows[:limit]
+            return [(key, copy.deepcopy(document)) for _, key, document in rows]
+
+    def measure(self, bucket, conditions=None):
+        documents = [document for _, document in self.find(bucket, conditions)]
+        return {'items': len(documents), 'size': sum(len(json.dumps(document)) for document in documents)}
+
+    def create_index(self, bucket, index_name, fields):
+        """
+        The documents are scanned in memory, no index is needed.
+        """
+
+    def __entry(self, bucket, key):
+        """
+        Get the entry of a document, None if it doesn't exist or expired. The lock must be held by the caller.
+        """
+        entry = self.buckets.get(bucket, {}).get(key)
+        if entry is not None and self.__expired(entry, time.time()):
+            del self.buckets[bucket][key]
+            return None
+        return entry
+
+    def __store(self, bucket, key, document, expiry=None, expires_at=None):
+        """
+        Store a document with a new CAS value. The lock must be held by the caller.
+        """
+        if expiry:
+            expires_at = time.time() + expiry.total_seconds()
+        entry = {'value': document, 'cas': next(self.cas_counter), 'expires_at': expires_at}
+        self.buckets.setdefault(bucket, {})[key] = entry
+        return {'cas': entry['cas'], 'mutation_token': None}
+
+    def __expired(self, entry, now):
+        """
+        Check if the time to live of a document is over.
+        """
+        return entry['expires_at'] is not None and entry['expires_at'] <= now
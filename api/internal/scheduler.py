@@ -0,0 +1,167 @@
+# Description: This module contains the FairShareScheduler class, the queue of the JobExecutor. The jobs are queued per GCP project and per priority class:
+# - a job of a higher priority class (e.g. deletes and scaling) is started before the jobs of the lower classes, a job waiting for longer than the aging delay is promoted to the next class so that the low priority jobs still run,
+# - among the projects having a job of the same class, the project that received the smallest share of the workers relative to its weight is served first (weighted fair queuing),
+# - a project can't run more than its quota of jobs at the same time, its other jobs wait even if some workers are idle.
+# The scheduler isn't thread safe, it is protected by the condition of the executor.
+import time
+from collections import deque
+
+
+# priority classes, from the most to the least urgent
+PRIORITY_CLASSES = ('high', 'normal', 'low')
+
+
+class FairShareScheduler():
+    # init method or constructor
+    def __init__(self, project_quota=0, project_weights=None, aging_seconds=300):
+        """
+        Parameters:
+            project_quota (int): the maximum number of running jobs per project, 0 for no limit
+            project_weights (dict): the share of the workers of the projects relative to each other, 1 by default
+            aging_seconds (int): the seconds after which a waiting job is promoted to the next priority class, 0 to disable the aging
+        """
+        self.project_quota = project_quota
+        self.project_weights = self.__check_weights(project_weights)
+        self.aging_seconds = aging_seconds
+        # state of the projects having queued or running jobs
+        self.projects = {}
+        self.size = 0
+
+    def configure(self, project_quota, project_weights, aging_seconds):
+        """
+        Change the quotas, the weights and the aging delay, the queued jobs are kept.
+        Raises:
+            ValueError: if a weight isn't greater than 0
+        """
+        self.project_quota = project_quota
+        self.project_weights = self.__check_weights(project_weights)
+        self.aging_seconds = aging_seconds
+
+    def __len__(self):
+        return self.size
+
+    def push(self, job, project=None, priority=None):
+        """
+        Queue a job.
+        Parameters:
+            job: the job, returned as is by pop
+            project (str): the GCP project of the job, the jobs without project share the same queue
+            priority (str): the priority class of the job, `normal` by default
+        """
+        rank = PRIORITY_CLASSES.index(priority or 'normal')
+        state = self.__project(project)
+        state['queues'][rank].append((time.time(), job))
+        self.size += 1
+
+    def pop(self):
+        """
+        Remove the next job to run from the queue, the job counts as running for its project until `release` is called.
+        Returns:
+            tuple: the job and its project, or None if all the queued jobs are blocked by the quotas of their project
+        """
+        now = time.time()
+        best = None
+        for project, state in self.projects.items():
+            if not self.__has_capacity(project, state):
+                continue
+            for rank, queue in enumerate(state['queues']):
+                if not queue:
+                    continue
+                enqueued_at = queue[0][0]
+                key = (self.__effective_rank(rank, enqueued_at, now), state['pass'], enqueued_at)
+                if best is None or key < best[0]:
+                    best = (key, project, rank)
+        if best is None:
+            return None
+        _, project, rank = best
+        state = self.projects[project]
+        _, job = state['queues'][rank].popleft()
+        self.size -= 1
+        state['running'] += 1
+        # the project pays for the job with its weight, the heavier projects are served more often
+        state['pass'] += 1.0 / self.__weight(project)
+        return job, project
+
+    def release(self, project):
+        """
+        Record that a job of a project finished.
+        """
+        state = self.projects.get(project)
+        if state is None:
+            return
+        state['running'] -= 1
+        if state['running'] <= 0 and not any(state['queues']):
+            del self.projects[project]
+
+    def drain(self):
+        """
+        Remove the next job regardless of the quotas, used to empty the queue when the executor shuts down.
+        """
+        for project, state in self.projects.items():
+            for queue in state['queues']:
+                if queue:
+                    self.size -= 1
+                    state['running'] += 1
+                    return queue.popleft()[1], project
+        return None
+
+    def stats(self):
+        """
+        Get the state of the queue per project.
+        Returns:
+            dict: the settings of the scheduler and, per project, the running jobs and the queued jobs per priority class
+        """
+        return {
+            'project_quota': self.project_quota,
+            'aging_seconds': self.aging_seconds,
+            'projects': {
+                str(project): {
+                    'running': state['running'],
+                    'queued': {priority: len(state['queues'][rank]) for rank, priority in enumerate(PRIORITY_CLASSES)},
+                    'weight': self.__weight(project),
+                    'pass': round(state['pass'], 3)
+                }
+                for project, state in self.projects.items()
+            }
+        }
+
+    def __project(self, project):
+        """
+        Get the state of a project, a new project starts with the smallest pass of the active projects so that
+        it doesn't get the workers for itself until it catches up.
+        """
+        state = self.projects.get(project)
+        if state is None:
+            start = min((other['pass'] for other in self.projects.values()), default=0.0)
+            state = {'queues': [deque() for _ in PRIORITY_CLASSES], 'running': 0, 'pass': start}
+            self.projects[project] = state
+        return state
+
+    def __has_capacity(self, project, state):
+        """
+        Check if a project can start another job.
+        """
+        return project is None or self.project_quota <= 0 or state['running'] < self.project_quota
+
+    def __effective_rank(self, rank, enqueued_at, now):
+        """
+        Priority class of a job once promoted by the aging.
+        """
+        if self.aging_seconds <= 0:
+            return rank
+        return max(0, rank - int((now - enqueued_at) / self.aging_seconds))
+
+    def __check_weights(self, project_weights):
+        """
+        Check that the weights are greater than 0, the pass of a project is incremented by the inverse of its weight.
+        """
+        for project, weight in (project_weights or {}).items():
+            if not weight > 0:
+                raise ValueError(f"The weight of the project {project} must be greater than 0, got {weight}")
+        return dict(project_weights or {})
+
+    def __weight(self, project):
+        """
+        Weight of a project.
+        """
+        return self.project_weights.get(project, 1)
@@ -0,0 +1,270 @@
+# Description: This file contains the SQLiteDatabase class, a database backend embedded in the process for single node deployments. Each bucket is a table of JSON documents
+# (key, value, cas, expires_at) of a single database file opened in WAL mode, so the readers don't block the writer. Every thread gets its own connection and the statements are
+# parameterized so that sqlite reuses their prepared form. The secondary indexes are expression indexes on the JSON fields, the find queries use the same expressions.
+import json
+import re
+import sqlite3
+import threading
+import time
+from loguru import logger
+from api.internal.database import Database, apply_mutations, field_parts
+from utils.exceptions import DatabaseConflictException, DatabaseDocumentNotFoundException, DatabaseOperationNotSupportedException
+
+
+# names accepted for the buckets and the fields, they are inlined in the statements
+NAME_PATTERN = re.compile(r'^[A-Za-z0-9_-]+$')
+# number of prepared statements kept per connection
+CACHED_STATEMENTS = 256
+# seconds between two purges of the expired documents
+PURGE_INTERVAL = 60
+
+
+class SQLiteDatabase(Database):
+    # init method or constructor
+    def __init__(self, path):
+        """
+        Parameters:
+            path (str): the path of the database file
+        """
+        self.path = path
+        self.local = threading.local()
+        self.tables = set()
+        self.tables_lock = threading.Lock()
+        # time of the last purge of the expired documents, per table
+        self.last_purges = {}
+
+    def connect(self):
+        """
+        Open the database file in WAL mode.
+        """
+        connection = self.__connection()
+        mode = connection.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+        logger.info(f"SQLite database {self.path} opened in {mode} mode")
+
+    def get_with_cas(self, bucket, key):
+        row = self.__connection().execute(
+            f'SELECT value, cas FROM {self.__table(bucket)} WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)',
+            (key, time.time())
+        ).fetchone()
+        if row is None:
+            raise DatabaseDocumentNotFoundException(f"Document {key} not found")
+        return json.loads(row[0]), row[1]
+
+    def upsert(self, bucket, key, value, durability=None):
+        table = self.__table(bucket)
+        with self.__transaction() as connection:
+            cas = self.__next_cas(connection, table, key)
+            connection.execute(
+                f'INSERT INTO {table} (key, value, cas, expires_at) VALUES (?, ?, ?, NULL) '
+                'ON CONFLICT(key) DO UPDATE SET value = excluded.value, cas = excluded.cas, expires_at = NULL',
+                (key, json.dumps(value), cas)
+            )
+        return {'cas': cas, 'mutation_token': None}
+
+    def replace(self, bucket, key, value, cas=None, durability=None):
+        table = self.__table(bucket)
+        with self.__transaction() as connection:
+            current = self.__current(connection, table, key)
+            if current is None:
+                raise DatabaseDocumentNotFoundException(f"Document {key} not found")
+            if cas and current[1] != cas:
+                raise DatabaseConflictException(f"Document {key} has been modified concurrently")
+            new_cas = current[1] + 1
+            connection.execute(f'UPDATE {table} SET value = ?, cas = ?, expires_at = NULL WHERE key = ?', (json.dumps(value), new_cas, key))
+        return {'cas': new_cas, 'mutation_token': None}
+
+    def insert_if_absent(self, bucket, key, value, expiry=None):
+        table = self.__table(bucket)
+        expires_at = time.time() + expiry.total_seconds() if expiry else None
+        with self.__transaction() as connection:
+            if self.__current(connection, table, key) is not None:
+                return False
+            connection.execute(
+                f'INSERT OR REPLACE INTO {table} (key, value, cas, expires_at) VALUES (?, ?, 1, ?)',
+                (key, json.dumps(value), expires_at)
+            )
+        return True
+
+    def mutate_in(self, bucket, key, fields=None, appends=None, cas=None, increments=None, expiry=None, create_document=False, durability=None):
+        table = self.__table(bucket)
+        with self.__transaction() as connection:
+            current = self.__current(connection, table, key)
+            if current is None and not create_document:
+                raise DatabaseDocumentNotFoundException(f"Document {key} not found")
+            if current is not None and cas and current[1] != cas:
+                raise DatabaseConflictException(f"Document {key} has been modified concurrently")
+            document = json.loads(current[0]) if current else {}
+            apply_mutations(document, fields, appends, increments)
+            new_cas = current[1] + 1 if current else 1
+            # the expiration is kept unless a new one is given
+            expires_at = time.time() + expiry.total_seconds() if expiry else (current[2] if current else None)
+            connection.execute(
+                f'INSERT OR REPLACE INTO {table} (key, value, cas, expires_at) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(document), new_cas, expires_at)
+            )
+        return new_cas
+
+    def remove(self, bucket, key):
+        table = self.__table(bucket)
+        with self.__transaction() as connection:
+            if self.__current(connection, table, key) is None:
+                raise DatabaseDocumentNotFoundException(f"Document {key} not found")
+            connection.execute(f'DELETE FROM {table} WHERE key = ?', (key,))
+
+    def find(self, bucket, conditions=None, order_by=None, descending=False, limit=None, after=None):
+        table = self.__table(bucket)
+        self.__purge(table)
+        where, params = self.__where(conditions)
+        statement = f'SELECT key, value FROM {table} WHERE (expires_at IS NULL OR expires_at > ?)' + where
+        params = [time.time()] + params
+        columns = [self.__expression(field) for field in order_by or []] + ['key']
+        if after is not None:
+            # keyset pagination, the rows after the last row of the previous page in the sort order
+            operator = '<' if descending else '>'
+            statement += f" AND ({', '.join(columns)}) {operator} ({', '.join('?' for _ in columns)})"
+            params += list(after)
+        if order_by:
+            statement += ' AND ' + ' AND '.join(f'{column} IS NOT NULL' for column in columns[:-1])
+        direction = ' DESC' if descending else ''
+        statement += ' ORDER BY ' + ', '.join(column + direction for column in columns)
+        if limit is not None:
+            statement += ' LIMIT ?'
+            params.append(limit)
+        rows = self.__connection().execute(statement, params).fetchall()
+        return [(row[0], json.loads(row[1])) for row in rows]
+
+    def measure(self, bucket, conditions=None):
+        table = self.__table(bucket)
+        where, params = self.__where(conditions)
+        row = self.__connection().execute(
+            f'SELECT COUNT(*), SUM(LENGTH(value)) FROM {table} WHERE (expires_at IS NULL OR expires_at > ?)' + where,
+            [time.time()] + params
+        ).fetchone()
+        return {'items': row[0], 'size': row[1] or 0}
+
+    def create_index(self, bucket, index_name, fields):
+        table = self.__table(bucket)
+        columns = []
+        for field in fields:
+            parts, descending = field_parts(field)
+            columns.append(self.__expression('.'.join(parts)) + (' DESC' if descending else ''))
+        name = self.__name(f"{bucket}_{index_name}")
+        self.__connection().execute(f'CREATE INDEX IF NOT EXISTS "{name}" ON {table} ({", ".join(columns)})')
+
+    def __connection(self):
+        """
+        Get the connection of the current thread, it is opened on the first call.
+        """
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            # autocommit mode, the read-modify-write operations open their own transaction
+            connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, cached_statements=CACHED_STATEMENTS, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        return connection
+
+    def __transaction(self):
+        """
+        Open a write transaction, the write lock is taken right away so that the read-modify-write operations are atomic.
+        """
+        return Transaction(self.__connection())
+
+    def __table(self, bucket):
+        """
+        Get the quoted name of the table of a bucket, the table is created on first use.
+        """
+        table = f'"{self.__name(bucket)}"'
+        if bucket not in self.tables:
+            with self.tables_lock:
+                self.__connection().execute(
+                    f'CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, cas INTEGER NOT NULL, expires_at REAL)'
+                )
+                self.__connection().execute(f'CREATE INDEX IF NOT EXISTS "{self.__name(bucket)}_expires_at" ON {table} (expires_at)')
+                self.tables.add(bucket)
+        return table
+
+    def __current(self, connection, table, key):
+        """
+        Get the value, the CAS value and the expiration time of a document, None if it doesn't exist or expired.
+        """
+        row = connection.execute(f'SELECT value, cas, expires_at FROM {table} WHERE key = ?', (key,)).fetchone()
+        if row is None or (row[2] is not None and row[2] <= time.time()):
+            return None
+        return row
+
+    def __next_cas(self, connection, table, key):
+        """
+        Get the next CAS value of a document.
+        """
+        row = connection.execute(f'SELECT cas FROM {table} WHERE key = ?', (key,)).fetchone()
+        return row[0] + 1 if row else 1
+
+    def __where(self, conditions):
+        """
+        Build the conditions of a find statement.
+        Returns:
+            tuple: the SQL conditions, starting with AND, and their parameters
+        """
+        clauses = []
+        params = []
+        for field, operator, value in conditions or []:
+            expression = self.__expression(field)
+            if operator == 'exists':
+                # json_extract can't tell a missing field from a null one, json_type returns 'null' for the latter
+                clauses.append(f"json_type(value, '{self.__path(field)}') IS NOT NULL")
+            elif operator == 'in':
+                clauses.append(f"{expression} IN ({', '.join('?' for _ in value)})")
+                params += list(value)
+            elif operator in ('=', '<', '<=', '>', '>='):
+                clauses.append(f'{expression} {operator} ?')
+                params.append(value)
+            else:
+                raise DatabaseOperationNotSupportedException(f"Unknown condition operator {operator}")
+        return ''.join(f' AND {clause}' for clause in clauses), params
+
+    def __expression(self, field):
+        """
+        SQL expression of a field of the documents, the expression of the indexes and of the queries must be identical.
+        """
+        return f"json_extract(value, '{self.__path(field)}')"
+
+    def __path(self, field):
+        """
+        JSON path of a field of the documents.
+        """
+        return '$' + ''.join(f'."{self.__name(part)}"' for part in field.split('.'))
+
+    def __name(self, name):
+        """
+        Check a name inlined in a statement.
+        """
+        if not NAME_PATTERN.match(name):
+            raise DatabaseOperationNotSupportedException(f"Invalid name {name}")
+        return name
+
+    def __purge(self, table):
+        """
+        Remove the expired documents, at most once per PURGE_INTERVAL.
+        """
+        now = time.time()
+        if now - self.last_purges.get(table, 0) < PURGE_INTERVAL:
+            return
+        self.last_purges[table] = now
+        self.__connection().execute(f'DELETE FROM {table} WHERE expires_at IS NOT NULL AND expires_at <= ?', (now,))
+
+
+class Transaction():
+    """
+    Context manager of a write transaction of a connection in autocommit mode.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.connection.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
@@ -1,151 +1,281 @@
-# Purpose: This module contains basic classes that works as an abstraction on the Python threading module. The purpose is to manage the threads in a more efficient way.
+# Purpose: This module contains the background jobs of the API. The jobs are run by a shared JobExecutor, a bounded pool of worker threads, instead of starting a new thread per request.
+# When the durable queue is enabled the jobs are stored in the database and run by the worker processes instead.
+import datetime
+import hashlib
+import json
+import threading
+import time
 from loguru import logger
-import threading 
 from shared.core.create_cluster import create_cluster
 from shared.core.update_cluster import update_cluster
+from shared.core.steps import StepCheckpoint, StepTrace, traced
 from shared.core.apply_migration_cluster import apply_migration
 from shared.core.delete_cluster import delete_cluster
+from shared.core.instance_template_operations import create_instance_template, update_instance_template, delete_instance_template
+from shared.core.managed_instance_group_operations import create_managed_instance_group, update_managed_instance_group, delete_managed_instance_group
+from shared.core.kms_operations import key_ring_create, key_create
+from shared.core.storage_operations import create_gcp_bucket, delete_gcp_bucket
+from shared.core.attach_disk import attach_disk_to_instance
 from shared.entities.cluster import ClusterUpdateType
-from utils.exceptions import InternalException
-from api.internal.jobs_controller import update_job_status
-from shared.lib.template import create_template, update_template
-from api.extensions import couchbase
-
-
-class AsyncOperationThread(threading.Thread): 
-    def __init__(self, job_id, gcp_project, operation, **operation_params):
-        threading.Thread.__init__(self)
-        self.name = job_id
-        self.gcp_project = gcp_project
-        self.operation = operation
-        self.operation_params = operation_params
-
-    def run(self):
-        with logger.contextualize(job_id=self.name):
-            try:
-                self.operation(self.gcp_project, **self.operation_params)
-                update_job_status(self.name, 'COMPLETED')
-            except InternalException as e:
-                if e.message:
-                    update_job_status(self.name, 'FAILED', e.message)
-                else:
-                    update_job_status(self.name, 'FAILED')
-                # log the error
-                logger.error(f"Internal Error: {e}")
-            except Exception as e:
-                update_job_status(self.name, 'FAILED')
-                # log the error
-                logger.error(f"Error: {e}")
-
-
-
-
-class CreateClusterThread(threading.Thread):
-    def __init__(self, job_id, gcp_project, cluster, cluster_json):
-        threading.Thread.__init__(self)
-        self.name = job_id
-        self.gcp_project = gcp_project
-        self.cluster = cluster
-        self.cluster_json = cluster_json
-
-    def run(self):
-        with logger.contextualize(job_id=self.name):
-            try:
-                res =couchbase.insert('clusters', self.cluster.name, self.cluster_json)
-                create_cluster(self.gcp_project, self.cluster)
-                update_job_status(self.name, 'COMPLETED')
-            except InternalException as e:
-                if e.message:
-                    update_job_status(self.name, 'FAILED', e.message)
-                else:
-                    update_job_status(self.name, 'FAILED')
-                # log the error
-                logger.error(f"Internal Error creating the cluster: {e}")
-            except Exception as e:
-                update_job_status(self.name, 'FAILED')
-                # log the error
-                logger.error(f"Error creating the cluster: {e}")
-
-class UpdateClusterThread(threading.Thread):
-    def __init__(self, job_id, gcp_project, cluster, cluster_update_type, cluster_json):
-        threading.Thread.__init__(self)
-        self.name = job_id
-        self.gcp_project = gcp_project
-        self.cluster = cluster
-        self.cluster_update_type = cluster_update_type
-        self.cluster_json = cluster_json
-
-    def run(self):
-        with logger.contextualize(job_id=self.name):
-            try:
-                res =couchbase.update('clusters', self.cluster.name, self.cluster_json)
-                update_cluster(self.gcp_project, self.cluster, self.cluster_update_type)
-                update_job_status(self.name, 'COMPLETED')
-            except InternalException as e:
-                if e.message:
-                    update_job_status(self.name, 'FAILED', e.message)
-                else:
-                    update_job_status(self.name, 'FAILED')
-                # log the error
-                logger.error(f"Error updating the cluster: {e}")
-            except Exception as e:
-                update_job_status(self.name, 'FAILED')
-                # log the error
-                logger.error(f"Error updating the cluster: {e}")
-
-
-
-
-class DeleteClusterThread(threading.Thread):
-    def __init__(self, job_id, gcp_project, cluster_name, cluster_region):
-        threading.Thread.__init__(self)
-        self.name = job_id
-        self.gcp_project = gcp_project
-        self.cluster_name = cluster_name
-        self.cluster_region = cluster_region
-
-    def run(self):
-        with logger.contextualize(job_id=self.name):
-            try:
-                delete_cluster(self.gcp_project, self.cluster_name, self.cluster_region)
-                update_job_status(self.name, 'COMPLETED')
-            except InternalException as e:
-                if e.message:
-                    update_job_status(self.name, 'FAILED', e.message)
-                else:
-                    update_job_status(self.name, 'FAILED')
-                # log the error
-                logger.error(f"Error updating the cluster: {e}")
-            except Exception as e:
-                update_job_status(self.name, 'FAILED')
-                # log the error
-                logger.error(f"Error updating the cluster: {e}")
-
-
-
-class MigrateClusterThread(threading.Thread):
-    def __init__(self, job_id, gcp_project, cluster_name, cluster_region):
-        threading.Thread.__init__(self)
-        self.name = job_id
-        self.gcp_project = gcp_project
-        self.cluster_name = cluster_name
-        self.cluster_region = cluster_region
-
-
-    def run(self):
-        with logger.contextualize(job_id=self.name):
-            try:
-                apply_migration(self.gcp_project, self.cluster_name, self.cluster_region)
-                update_job_status(self.name, 'COMPLETED')
-            except InternalException as e:
-                if e.message:
-                    update_job_status(self.name, 'FAILED', e.message)
-                else:
-                    update_job_status(self.name, 'FAILED')
-                # log the error
-                logger.error(f"Error updating the cluster: {e}")
-            except Exception as e:
-                update_job_status(self.name, 'FAILED')
-                # log the error
-                logger.error(f"Error updating the cluster: {e}")
+from utils.exceptions import InternalException, JobCancelledException, DatabaseDocumentNotFoundException
+from utils.cancellation import CancellationToken, cancellable
+from utils.parse_requests import parse_cluster_def_from_json, parse_instance_template_from_json
+from utils.shared import check_gcp_params_from_request
+from api.internal.jobs_controller import add_job, update_job_status, update_job_queue_position, get_job, update_job_steps
+from api.internal.executor import JobExecutor
+from api.internal.job_queue import DurableJobQueue
+from api.internal.job_archiver import JobArchiver
+from api.extensions import database
 
+
+# shared executor of the background jobs, it is started by create_app or by the worker command
+executor = JobExecutor(on_position_change=update_job_queue_position)
+# durable queue of the jobs, used instead of the executor when `JOB_QUEUE_BACKEND` is `couchbase`
+job_queue = DurableJobQueue()
+# retention policy of the finished jobs and optional archiver of the old jobs
+job_archiver = JobArchiver()
+# cancellation tokens of the jobs run by this process, per job id
+running_tokens = {}
+running_tokens_lock = threading.Lock()
+# seconds between two reads of the status of a running job, to notice the cancellations requested to another process
+CANCEL_CHECK_INTERVAL = 30
+
+
+def submit_job(job_id, resource_name, job_type, gcp_project, operation, lock_key=None, **operation_params):
+    """
+    Register a job in the database and submit it to the executor.
+    Parameters:
+        job_id (str): the id of the job
+        resource_name (str): the name of the resource the job operates on
+        job_type (str): the type of the job
+        gcp_project (GCPProject): the GCP project of the job
+        operation (callable): the operation to run, it is called with the GCP project and the json operation parameters, it must be registered in JOB_OPERATIONS
+        lock_key (tuple): optional key, the jobs with the same key are run one after the other
+    The priority class of the job is the one of its operation in JOB_PRIORITIES.
+    Returns:
+        dict: the job
+    Raises:
+        JobQueueFullException: if the executor queue is full
+        JobExecutorUnavailableException: if the executor is not running
+    """
+    priority = JOB_PRIORITIES.get(operation.__name__, 'normal')
+    if job_queue.enabled:
+        # the job is run by one of the worker processes
+        queue_fields = job_queue.queue_fields(operation.__name__, gcp_project, lock_key, operation_params, priority)
+        return add_job(job_id, resource_name, job_type, 'PENDING', gcp_project.project_id, queue_fields)
+    # the job is inserted first so that the worker always finds it when updating its status
+    job = add_job(job_id, resource_name, job_type, 'PENDING', gcp_project.project_id)
+    try:
+        position = executor.submit(job_id, run_job, job_id, gcp_project, operation, lock_key=lock_key,
+            project=gcp_project.project_id, priority=priority, **operation_params)
+    except InternalException as e:
+        update_job_status(job_id, 'REJECTED', e.message, expiry=job_archiver.expiry())
+        raise e
+    if position > 0:
+        job['status'] = 'QUEUED'
+        job['queue_position'] = position
+    return job
+
+
+def cluster_lock_key(gcp_project, region, cluster_name):
+    """
+    Lock key of the jobs operating on a cluster, the jobs of a cluster are run one after the other.
+    """
+    return (gcp_project.project_id, region, cluster_name)
+
+
+def run_queued_job(job):
+    """
+    Run a job claimed from the durable queue, the GCP project and the operation are rebuilt from the job document.
+    """
+    try:
+        gcp_project = check_gcp_params_from_request(job['gcp'])
+        operation = JOB_OPERATIONS[job['operation']]
+    except (InternalException, KeyError) as e:
+        update_job_status(job['name'], 'FAILED', f"The job can't be run by this worker: {e}", expiry=job_archiver.expiry())
+        logger.error(f"Error loading the queued job: {e}")
+        return
+    run_job(job['name'], gcp_project, operation, **job['operation_params'])
+
+
+def run_job(job_id, gcp_project, operation, **operation_params):
+    """
+    Run the operation of a job and update the status of the job with the result. The operation runs with a
+    cancellation token, a cancelled job is saved as CANCELLED with the resources its operation left half-done.
+    The steps of the operation and the duration of the job are saved on the job document.
+    """
+    # a job cancelled while it was waiting in the queue is not run
+    if not update_job_status(job_id, 'RUNNING', expected_statuses=('PENDING', 'QUEUED', 'RUNNING')):
+        # a claimed job may have been cancelled before the worker started it
+        update_job_status(job_id, 'CANCELLED', "The job has been cancelled before it started", expected_statuses=('CANCELLING',), expiry=job_archiver.expiry())
+        logger.info(f"Job {job_id} cancelled before it started")
+        return
+    token = CancellationToken(check=lambda: get_job(job_id)['status'] == 'CANCELLING', check_interval=CANCEL_CHECK_INTERVAL)
+    with running_tokens_lock:
+        running_tokens[job_id] = token
+    trace = StepTrace(store=lambda steps: update_job_steps(job_id, steps))
+    started_at = datetime.datetime.utcnow().isoformat()
+    start = time.time()
+    # start and end time of the job, saved with its final status
+    timing = lambda: {'started_at': started_at, 'ended_at': datetime.datetime.utcnow().isoformat(), 'duration': round(time.time() - start, 3)}
+    try:
+        with cancellable(token), traced(trace):
+            operation(gcp_project, **operation_params)
+        # the final status is only saved if no other writer finished the job meanwhile
+        update_job_status(job_id, 'COMPLETED', expected_statuses=('RUNNING', 'CANCELLING'), fields=timing(), expiry=job_archiver.expiry())
+    except JobCancelledException as e:
+        update_job_status(job_id, 'CANCELLED', e.message, expected_statuses=('RUNNING', 'CANCELLING'),
+            fields=dict(timing(), half_done_resources=token.resources), expiry=job_archiver.expiry())
+        logger.warning(f"Job cancelled, half-done resources: {token.resources}")
+    except InternalException as e:
+        update_job_status(job_id, 'FAILED', e.message, expected_statuses=('RUNNING', 'CANCELLING'), fields=timing(), expiry=job_archiver.expiry())
+        # log the error
+        logger.error(f"Internal Error: {e}")
+    except Exception as e:
+        update_job_status(job_id, 'FAILED', expected_statuses=('RUNNING', 'CANCELLING'), fields=timing(), expiry=job_archiver.expiry())
+        # log the error
+        logger.error(f"Error: {e}")
+    finally:
+        with running_tokens_lock:
+            running_tokens.pop(job_id, None)
+
+
+def cancel_job(job_id):
+    """
+    Cancel a job. A job that didn't start is cancelled right away, a running job is marked CANCELLING and its
+    operation stops at its next wait loop: right away if this process runs it, within CANCEL_CHECK_INTERVAL otherwise.
+    Returns:
+        str: the new status of the job, None if the job is already finished
+    """
+    if update_job_status(job_id, 'CANCELLED', "The job has been cancelled before it started",
+            expected_statuses=('PENDING', 'QUEUED'), expiry=job_archiver.expiry()):
+        return 'CANCELLED'
+    if update_job_status(job_id, 'CANCELLING', expected_statuses=('RUNNING', 'CANCELLING')):
+        with running_tokens_lock:
+            token = running_tokens.get(job_id)
+        if token:
+            token.cancel()
+        return 'CANCELLING'
+    return None
+
+
+
+def create_cluster_operation(gcp_project, cluster_json):
+    """
+    Save the cluster definition and create the cluster, the steps completed by a previous failed run are resumed.
+    """
+    cluster = parse_cluster_def_from_json(cluster_json)
+    checkpoint = load_cluster_checkpoint(cluster.name, 'create_cluster', cluster_json)
+    database.insert('clusters', cluster.name, dict(cluster_json, checkpoint=checkpoint_document('create_cluster', cluster_json, checkpoint.outputs)))
+    create_cluster(gcp_project, cluster, checkpoint)
+    clear_cluster_checkpoint(cluster.name)
+
+
+def update_cluster_operation(gcp_project, cluster_json, migrate):
+    """
+    Save the new cluster definition and update the cluster, the instances are migrated if `migrate` is set.
+    The steps completed by a previous failed run are resumed.
+    """
+    cluster = parse_cluster_def_from_json(cluster_json)
+    cluster_update_type = ClusterUpdateType.UPDATE_AND_MIGRATE if migrate else ClusterUpdateType.UPDATE_NO_MIGRATE
+    operation_name = f"update_cluster:{cluster_update_type.name}"
+    checkpoint = load_cluster_checkpoint(cluster.name, operation_name, cluster_json)
+    database.update('clusters', cluster.name, dict(cluster_json, checkpoint=checkpoint_document(operation_name, cluster_json, checkpoint.outputs)))
+    update_cluster(gcp_project, cluster, cluster_update_type, checkpoint)
+    clear_cluster_checkpoint(cluster.name)
+
+
+def checkpoint_document(operation_name, cluster_json, outputs):
+    """
+    Build the checkpoint stored on the cluster document. The fingerprint identifies the cluster definition,
+    a checkpoint is only resumed by the same operation on the same definition.
+    """
+    fingerprint = hashlib.sha256(json.dumps(cluster_json, sort_keys=True).encode()).hexdigest()
+    return {'operation': operation_name, 'fingerprint': fingerprint, 'outputs': outputs}
+
+
+def load_cluster_checkpoint(cluster_name, operation_name, cluster_json):
+    """
+    Load the checkpoint of the last failed run of an operation on a cluster, the completed steps of a matching
+    checkpoint are skipped. Every completed step is saved on the cluster document.
+    Returns:
+        StepCheckpoint: the checkpoint of the run
+    """
+    outputs = {}
+    try:
+        saved = database.get('clusters', cluster_name).get('checkpoint')
+    except DatabaseDocumentNotFoundException:
+        saved = None
+    expected = checkpoint_document(operation_name, cluster_json, None)
+    if saved and saved['operation'] == expected['operation'] and saved['fingerprint'] == expected['fingerprint']:
+        outputs = saved['outputs']
+        logger.info(f"Resuming {operation_name} of the cluster {cluster_name}, completed steps: {list(outputs.keys())}")
+
+    def store(step_outputs):
+        document = database.get('clusters', cluster_name)
+        document['checkpoint'] = checkpoint_document(operation_name, cluster_json, step_outputs)
+        database.update('clusters', cluster_name, document)
+
+    return StepCheckpoint(outputs, store)
+
+
+def clear_cluster_checkpoint(cluster_name):
+    """
+    Remove the checkpoint of a cluster once its operation succeeded.
+    """
+    document = database.get('clusters', cluster_name)
+    document.pop('checkpoint', None)
+    database.update('clusters', cluster_name, document)
+
+
+def create_instance_template_operation(gcp_project, instance_template_json):
+    """
+    Create an instance template from its json definition.
+    """
+    create_instance_template(gcp_project, parse_instance_template_from_json(instance_template_json))
+
+
+def update_instance_template_operation(gcp_project, instance_template_json):
+    """
+    Update an instance template from its json definition.
+    """
+    update_instance_template(gcp_project, parse_instance_template_from_json(instance_template_json))
+
+
+
+# operations that can be submitted as jobs, the durable queue stores the operation names
+JOB_OPERATIONS = {
+    operation.__name__: operation for operation in [
+        create_cluster_operation,
+        update_cluster_operation,
+        delete_cluster,
+        apply_migration,
+        create_instance_template_operation,
+        update_instance_template_operation,
+        delete_instance_template,
+        create_managed_instance_group,
+        update_managed_instance_group,
+        delete_managed_instance_group,
+        key_ring_create,
+        key_create,
+        create_gcp_bucket,
+        delete_gcp_bucket,
+        attach_disk_to_instance
+    ]
+}
+
+# priority classes of the operations, the deletes and the scaling operations run ahead of the creations of
+# templates, buckets and keys, the other operations are `normal`
+JOB_PRIORITIES = {
+    'delete_cluster': 'high',
+    'update_cluster_operation': 'high',
+    'update_managed_instance_group': 'high',
+    'delete_managed_instance_group': 'high',
+    'delete_instance_template': 'high',
+    'delete_gcp_bucket': 'high',
+    'create_instance_template_operation': 'low',
+    'update_instance_template_operation': 'low',
+    'create_gcp_bucket': 'low',
+    'key_ring_create': 'low',
+    'key_create': 'low'
+}
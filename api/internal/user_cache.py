@@ -0,0 +1,119 @@
+# Description: This module contains the UserCache class, an in-process cache of the users authenticated by `check_token`. A token seen recently is resolved from the cache
+# instead of being decoded and looked up in the database again. The cache is bounded (least recently used tokens are evicted first) and each entry expires after the TTL
+# or when its token expires, whichever comes first. The entries of a user are invalidated when the user is deleted or changes role.
+import hashlib
+import threading
+import time
+from cachetools import TLRUCache
+
+
+class UserCache():
+    # init method or constructor
+    def __init__(self, max_size=1024, ttl=60):
+        """
+        Parameters:
+            max_size (int): the maximum number of cached tokens, 0 disables the cache
+            ttl (int): the maximum number of seconds a user is served from the cache
+        """
+        self.lock = threading.Lock()
+        self.configure(max_size, ttl)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def init_app(self, app):
+        """
+        Configure the cache with the configuration of the flask application.
+        Parameters:
+            app: the Flask application instance.
+        """
+        self.configure(app.config.get('USER_CACHE_SIZE', 1024), app.config.get('USER_CACHE_TTL', 60))
+
+    def configure(self, max_size, ttl):
+        """
+        Change the size and the TTL of the cache, the cached users are dropped.
+        """
+        with self.lock:
+            self.max_size = max_size
+            self.ttl = ttl
+            # entries are (user, expiration time), an entry expires at the earliest of the TTL and of the expiration of its token
+            self.entries = TLRUCache(maxsize=max(max_size, 1), ttu=lambda key, value, now: min(now + ttl, value[1]), timer=time.time)
+            # keys of the cached tokens per user id, used to invalidate the tokens of a user
+            self.user_keys = {}
+
+    def get(self, token):
+        """
+        Get the user authenticated by a token.
+        Returns:
+            User: the cached user, None if the token isn't cached or its entry expired
+        """
+        if self.max_size <= 0:
+            return None
+        key = self.__key(token)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def put(self, token, user, expires_at):
+        """
+        Cache the user authenticated by a token.
+        Parameters:
+            token (str): the token
+            user (User): the user of the token
+            expires_at (float): the expiration time of the token, in seconds since the epoch
+        """
+        if self.max_size <= 0:
+            return
+        key = self.__key(token)
+        with self.lock:
+            self.entries[key] = (user, expires_at)
+            keys = self.user_keys.setdefault(user.id, set())
+            # forget the tokens of the user evicted or expired meanwhile
+            keys.intersection_update(self.entries.keys())
+            keys.add(key)
+
+    def invalidate_user(self, user_id):
+        """
+        Drop the cached tokens of a user, e.g. once deleted or after a change of role.
+        """
+        with self.lock:
+            for key in self.user_keys.pop(user_id, set()):
+                self.entries.pop(key, None)
+            self.invalidations += 1
+
+    def clear(self):
+        """
+        Drop all the cached tokens.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.user_keys = {}
+
+    def stats(self):
+        """
+        Get the counters of the cache.
+        Returns:
+            dict: the size of the cache, its settings and the hit, miss and invalidation counters
+        """
+        with self.lock:
+            self.entries.expire()
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else None,
+                'invalidations': self.invalidations
+            }
+
+    def __key(self, token):
+        """
+        Key of a token in the cache, the tokens themselves aren't kept in memory.
+        """
+        return hashlib.sha256(token.encode()).hexdigest()
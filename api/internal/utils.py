@@ -1,10 +1,14 @@
 # Description: Utility functions that are used in the application.
+import datetime
+import hashlib
 from functools import wraps
-from flask import request
-from utils.exceptions import UnAuthorizedException, InternalException
+from flask import request, current_app, g
+from utils.exceptions import UnAuthorizedException, InternalException, JobQueueFullException, DatabaseDocumentNotFoundException
 from loguru import logger
 from api.models.user import User
-from api.extensions import couchbase
+from api.extensions import database, user_cache
+from api.models.api_key import API_KEY_PREFIX
+from api.internal.api_keys import api_keys
 
 
 
@@ -34,21 +38,162 @@ def admin_required(f):
             return {
                 "error": "Unauthorized request. You don't have the role admin"
             }, 401
+        # the authenticated user or API key is kept for the other decorators of the route
+        g.principal = user
         return f(*args, **kwargs)
     return decorated_function
 
 # create the check_token function that check if the token is valid by interacting with the database on the user model
 def check_token(token):
+    """
+    Get the user authenticated by a token, the users of the tokens seen recently are served from the user cache.
+    The API keys are authenticated in memory and return an ApiKey, which has a role like a user.
+    Raises:
+        UnAuthorizedException: if the token is invalid or expired, or if its user doesn't exist anymore
+    """
+    if token.startswith(API_KEY_PREFIX):
+        return api_keys.authenticate(token, request_namespace())
+    user = user_cache.get(token)
+    if user is not None:
+        return user
     # decode the token
-    user = User.decode_auth_token(token)
-    if not user:
+    payload = User.decode_auth_payload(token)
+    if not payload:
         raise UnAuthorizedException("Invalid token")
-    role = user['role']
-    user_id = user['id']
+    user_id = payload['sub']['id']
     # get the user from the database
-    if not couchbase.check("users", user_id):
+    try:
+        user_dict = database.get("users", user_id)
+    except DatabaseDocumentNotFoundException:
         raise UnAuthorizedException("Invalid token")
-    user_dict = couchbase.get("users", user_id)
     user = User.from_dict(user_dict)
+    user_cache.put(token, user, payload['exp'])
     return user
 
+
+# get the namespace of the requested route, e.g. `clusters` for /api/v1/clusters/<cluster_name>
+def request_namespace():
+    prefix = current_app.blueprints[request.blueprint].url_prefix if request.blueprint else ''
+    return request.path[len(prefix):].strip('/').split('/')[0]
+
+
+# build the response of a route when the job executor refuses a new job
+def job_rejection_response(exception):
+    """
+    Build the response returned when a job can't be submitted to the executor: 429 when the queue is full and 503 when the executor is not running.
+    """
+    if isinstance(exception, JobQueueFullException):
+        return {
+            "error": exception.message
+        }, 429, {'Retry-After': str(current_app.config.get('JOB_EXECUTOR_RETRY_AFTER', 30))}
+    return {
+        "error": exception.message
+    }, 503
+
+
+# bucket of the idempotency records, kept apart from the jobs so that the job queries, the retention and the archiver only see jobs
+IDEMPOTENCY_BUCKET = 'idempotency'
+
+
+# create a decorator function that makes a mutating route idempotent with the `Idempotency-Key` header: the first request with a key runs the route and stores its response,
+# the next requests of the same user or API key with the same key on the same route get the stored response instead of starting a new job, until the key expires.
+# It must be applied below `admin_required`, which authenticates the caller.
+def idempotent(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return f(*args, **kwargs)
+        if len(key) > 255:
+            return {
+                "error": "The Idempotency-Key header can't be longer than 255 characters"
+            }, 400
+        # the keys are scoped to the caller and the route, the fingerprint detects a key reused with different parameters
+        document_id = "idempotency::" + hashlib.sha256(f"{request_principal()} {request.method} {request.path} {key}".encode()).hexdigest()
+        fingerprint = hashlib.sha256(request.query_string + b" " + request.get_data()).hexdigest()
+        expiry = datetime.timedelta(seconds=current_app.config.get('IDEMPOTENCY_KEY_TTL', 86400))
+        # the key is reserved atomically so that two concurrent retries can't both start a job
+        reserved = database.insert_if_absent(IDEMPOTENCY_BUCKET, document_id, {
+            'idempotency': True,
+            'state': 'in_progress',
+            'fingerprint': fingerprint
+        }, expiry)
+        if not reserved:
+            return idempotent_replay(document_id, fingerprint)
+        try:
+            result = f(*args, **kwargs)
+        except Exception as e:
+            release_idempotency_key(document_id)
+            raise e
+        body, status = (result[0], result[1]) if isinstance(result, tuple) else (result, 200)
+        if not 200 <= status < 300:
+            # the failed requests can be retried with the same key
+            release_idempotency_key(document_id)
+            return result
+        try:
+            database.mutate_in(IDEMPOTENCY_BUCKET, document_id, {'state': 'completed', 'body': body, 'http_status': status}, expiry=expiry)
+        except Exception as e:
+            # the job has started, the client gets its response even if the retries of the key will get a 409
+            logger.error(f"Error saving the response of the request with the Idempotency-Key: {e}")
+        # the key is stored with the job it started
+        if isinstance(body, dict) and body.get('name'):
+            try:
+                database.mutate_in('jobs', body['name'], {'idempotency_key': key})
+            except Exception as e:
+                logger.warning(f"Error saving the idempotency key of the job {body['name']}: {e}")
+        return result
+    decorated_function.__apidoc__ = dict(getattr(f, '__apidoc__', {}), params={
+        'Idempotency-Key': {
+            'in': 'header',
+            'type': 'string',
+            'description': 'Optional unique key of the request, a retried request with the same key returns the job of the first request instead of starting a new one'
+        }
+    })
+    return decorated_function
+
+
+# get the identity of the caller of the request
+def request_principal():
+    """
+    Identity of the user or API key authenticated by `admin_required`, used to scope the idempotency keys per caller.
+    """
+    principal = g.get('principal')
+    if principal is None:
+        return "anonymous"
+    return f"{type(principal).__name__}:{principal.id}"
+
+
+# build the response of a request whose idempotency key has already been used
+def idempotent_replay(document_id, fingerprint):
+    """
+    Build the response of a request with an already used `Idempotency-Key`: the stored response of the first request,
+    409 if the first request is still running, 422 if the key has been used with different parameters.
+    """
+    try:
+        record = database.get(IDEMPOTENCY_BUCKET, document_id)
+    except DatabaseDocumentNotFoundException:
+        # the key expired since the reservation failed
+        return {
+            "error": "The request with the same Idempotency-Key just expired, retry the request"
+        }, 409
+    if record['fingerprint'] != fingerprint:
+        return {
+            "error": "The Idempotency-Key has already been used with different parameters"
+        }, 422
+    if record['state'] != 'completed':
+        return {
+            "error": "A request with the same Idempotency-Key is in progress"
+        }, 409
+    logger.info("Replaying the response of a request with the same Idempotency-Key")
+    return record['body'], record['http_status'], {'Idempotent-Replayed': 'true'}
+
+
+# release the idempotency key of a failed request
+def release_idempotency_key(document_id):
+    """
+    Remove the reservation of an idempotency key so that the request can be retried with the same key.
+    """
+    try:
+        database.remove(IDEMPOTENCY_BUCKET, document_id)
+    except Exception as e:
+        logger.warning(f"Error releasing the idempotency key: {e}")
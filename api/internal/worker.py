@@ -0,0 +1,98 @@
+# Description: This module contains the JobWorker class, the main loop of a worker process. The worker claims the jobs of the durable queue when its executor has free workers, runs them on the executor and renews the leases of its running jobs with heartbeats.
+import os
+import socket
+import threading
+import uuid
+from loguru import logger
+from api.internal.threads import executor, job_queue, run_queued_job
+
+
+class JobWorker():
+    # init method or constructor
+    def __init__(self, concurrency, poll_interval):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        # unique id of the worker, stored as the owner of the leases
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        # ids of the jobs claimed by this worker and not finished yet
+        self.running_jobs = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        # the leases are renewed until the running jobs are finished
+        self.heartbeat_stopped = threading.Event()
+
+    def run(self):
+        """
+        Run the worker until `stop` is called.
+        """
+        executor.start(self.concurrency, self.concurrency)
+        heartbeat = threading.Thread(target=self.__heartbeat, name="job-heartbeat", daemon=True)
+        heartbeat.start()
+        logger.info(f"Worker {self.worker_id} started with {self.concurrency} concurrent jobs")
+        while not self.stopped.is_set():
+            free_slots = self.__free_slots()
+            if free_slots > 0:
+                try:
+                    self.__claim(free_slots)
+                except Exception as e:
+                    logger.error(f"Error claiming jobs: {e}")
+            self.stopped.wait(self.poll_interval)
+        logger.info(f"Worker {self.worker_id} stopping, waiting for the running jobs to finish")
+        executor.shutdown()
+        self.heartbeat_stopped.set()
+        logger.info(f"Worker {self.worker_id} stopped")
+
+    def stop(self):
+        """
+        Stop claiming jobs, the running jobs are finished before `run` returns.
+        """
+        self.stopped.set()
+
+    def __claim(self, limit):
+        """
+        Claim jobs from the durable queue and submit them to the executor.
+        """
+        jobs = job_queue.claim(self.worker_id, limit)
+        for job in jobs:
+            logger.info(f"Claimed job {job['name']} ({job['type']}), attempt {job['attempts']}")
+            with self.lock:
+                self.running_jobs.add(job['name'])
+            executor.submit(job['name'], self.__run, job, project=job.get('project-id'), priority=job.get('priority'))
+
+    def __run(self, job):
+        """
+        Run a claimed job and forget it once it is finished.
+        """
+        try:
+            run_queued_job(job)
+        finally:
+            with self.lock:
+                self.running_jobs.discard(job['name'])
+            try:
+                job_queue.release(job)
+            except Exception as e:
+                # the lock key is freed when its lease expires
+                logger.error(f"Error releasing the lock key of the job {job['name']}: {e}")
+
+    def __free_slots(self):
+        """
+        Number of jobs the executor can start right away.
+        """
+        with self.lock:
+            return self.concurrency - len(self.running_jobs)
+
+    def __heartbeat(self):
+        """
+        Renew the leases of the running jobs three times per lease duration.
+        """
+        while not self.heartbeat_stopped.wait(job_queue.lease_seconds / 3):
+            with self.lock:
+                job_ids = list(self.running_jobs)
+            if not job_ids:
+                continue
+            try:
+                lost = job_queue.heartbeat(self.worker_id, job_ids)
+                for job_id in lost:
+                    logger.warning(f"The lease of the job {job_id} has been lost, another worker may run it")
+            except Exception as e:
+                logger.error(f"Error renewing the job leases: {e}")
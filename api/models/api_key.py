@@ -0,0 +1,61 @@
+# Purpose: API Key Model
+# Description: This file contains the ApiKey model. An API key authenticates a service client without a user login: it has a role like a user and is limited to the
+# namespaces of its scopes. Only the HMAC digest of the secret of the key is stored, the key itself is returned once, when it is created.
+import datetime
+import uuid
+
+
+# prefix of the API keys, it tells them apart from the user tokens
+API_KEY_PREFIX = "cmk_"
+# scope granting all the namespaces
+ALL_SCOPES = "*"
+
+
+class ApiKey():
+    def __init__(self, name, role="user", scopes=None, digest=None, id=None, created_at=None, usage=None):
+        # generate id
+        self.id = id or uuid.uuid4().hex
+        self.name = name
+        self.role = role
+        self.scopes = list(scopes or [ALL_SCOPES])
+        self.digest = digest
+        self.created_at = created_at or datetime.datetime.utcnow().isoformat()
+        # number of requests and time of the last request, as stored in the database
+        self.usage = usage or {'requests': 0, 'last_used_at': None}
+
+    def to_dict(self):
+        return {
+            "api_key": True,
+            "id": self.id,
+            "name": self.name,
+            "role": self.role,
+            "scopes": self.scopes,
+            "digest": self.digest,
+            "created_at": self.created_at,
+            "usage": self.usage
+        }
+
+    @staticmethod
+    def from_dict(api_key_dict):
+        return ApiKey(
+            api_key_dict["name"],
+            api_key_dict["role"],
+            api_key_dict["scopes"],
+            api_key_dict["digest"],
+            api_key_dict["id"],
+            api_key_dict["created_at"],
+            api_key_dict.get("usage")
+        )
+
+    def allows(self, namespace):
+        """
+        Check if the scopes of the key grant access to the routes of a namespace.
+        """
+        return ALL_SCOPES in self.scopes or namespace in self.scopes
+
+    @staticmethod
+    def document_key(key_id):
+        """
+        Key of the document of an API key, in the users bucket.
+        """
+        return "api_key::" + key_id
@@ -1,6 +1,6 @@
 # Purpose: User Model
 # Description: This file contains the User model. The User model is used to store user information in the database.
-from api.extensions import bcrypt
+from utils.password_hasher import password_hasher
 from flask import current_app as app
 import datetime
 from loguru import logger
@@ -9,18 +9,26 @@ import uuid
 
 class User():
     def __init__(self, username, password, role="user", id=None):
+        """
+        Create a new user, the clear text password is hashed with bcrypt by the password hasher.
+        Use `User.from_dict` to load a stored user, its password is already hashed.
+        """
         # generate id 
         if id:
             self.id = id
         else:
             self.id = str(uuid.uuid4())  
         self.username = username
-        self.password = bcrypt.generate_password_hash(
-            password, app.config.get('BCRYPT_LOG_ROUNDS')
-        ).decode()
+        self.set_password(password)
         self.registered_on = datetime.datetime.now()
         self.role = role
 
+    def set_password(self, password):
+        """
+        Hash and set a new clear text password, on registration or on a change of password.
+        """
+        self.password = password_hasher.hash(password)
+
     def to_dict(self):
         return {
             "id": self.id,
@@ -32,15 +40,30 @@ class User():
     
     @staticmethod
     def from_dict(user_dict):
-        return User(
-            user_dict["username"],
-            user_dict["password"],
-            user_dict["role"],
-            user_dict["id"]
-        )
+        """
+        Load a stored user, the stored password hash is kept as is: no bcrypt hash is computed.
+        """
+        # the constructor is skipped since it hashes the password
+        user = User.__new__(User)
+        user.id = user_dict["id"]
+        user.username = user_dict["username"]
+        user.password = user_dict["password"]
+        registered_on = user_dict.get("registered_on")
+        user.registered_on = datetime.datetime.fromisoformat(registered_on) if registered_on else datetime.datetime.now()
+        user.role = user_dict["role"]
+        return user
 
     def check_password(self, password):
-        return bcrypt.check_password_hash(self.password, password)
+        """
+        Check a clear text password against the password hash of the user.
+        """
+        return password_hasher.verify(self.password, password)
+
+    def needs_rehash(self):
+        """
+        Check if the password hash of the user has been computed with another cost factor than the configured one.
+        """
+        return password_hasher.needs_rehash(self.password)
 
     def encode_auth_token(self, user_id, role):
         """
@@ -69,9 +92,18 @@ class User():
         :param auth_token:
         :return: integer|string
         """
+        payload = User.decode_auth_payload(auth_token)
+        return payload['sub'] if payload else None
+
+    @staticmethod
+    def decode_auth_payload(auth_token):
+        """
+        Validates the auth token and returns all its claims, including its expiration time `exp`
+        :param auth_token:
+        :return: dict|None
+        """
         try:
-            payload = jwt.decode(auth_token, app.config.get('SECRET_KEY')[0], algorithms='HS256')
-            return payload['sub']
+            return jwt.decode(auth_token, app.config.get('SECRET_KEY')[0], algorithms='HS256')
         except jwt.ExpiredSignatureError:
             logger.error('Signature expired. Please log in again.')
             return None
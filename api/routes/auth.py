@@ -6,17 +6,20 @@ import os
 import uuid
 import threading
 from flask import (
-  flash, g, redirect, render_template, request, session, url_for, jsonify
+  flash, g, redirect, render_template, request, session, url_for, jsonify, current_app
 )
 from utils.parse_requests import parse_cluster_def_from_json
 from loguru import logger
 from utils.shared import check_gcp_params_from_request
-from utils.exceptions import InvalidJsonException, UnAuthorizedException, UserWithUsernameAlreadyExistsException, UserAlreadyExistsException, UserDoesNotExistException, InvalidPasswordException
+from utils.exceptions import InvalidJsonException, UnAuthorizedException, UserWithUsernameAlreadyExistsException, UserAlreadyExistsException, UserDoesNotExistException, InvalidPasswordException, InvalidRoleException, PasswordHasherBusyException, ApiKeysDisabledException, DatabaseDocumentNotFoundException
 from utils.env import update_service_account_oauth_token
 from flask_restx import Resource, Api, Namespace, fields
 from api.models.user import User
 from api.internal.utils import admin_required
-from api.internal.auth_controller import register_user, login_user
+from api.internal.auth_controller import register_user, login_user, delete_user, update_user_role
+from api.extensions import user_cache
+from api.internal.api_keys import api_keys
+from api.routes.cluster import auth_token_parser
 # create auth namespace
 api = Namespace('auth', description='Authentications related operations')
 
@@ -34,6 +37,21 @@ login_request = api.model('LoginRequest', {
 oauth_token_update_request = api.model('OAuthToken', {
     'token': fields.String(required=True, description="The Google Cloud Platform OAuth token")
 })
+role_update_request = api.model('RoleUpdateRequest', {
+    'role': fields.String(required=True, description='The new role of the user')
+})
+api_key_request = api.model('ApiKeyRequest', {
+    'name': fields.String(required=True, description='The name of the API key, e.g. the service using it'),
+    'role': fields.String(required=False, default='user', description='The role of the API key'),
+    'scopes': fields.List(fields.String, required=False, default=['*'], description='The namespaces the API key can access (clusters, jobs...), `*` for all of them')
+})
+
+# build the response of a login or a registration rejected because the password hashing pool is full
+def password_hasher_busy_response(exception):
+    logger.warning(exception.message)
+    return {
+        "message": exception.message
+    }, 503, {'Retry-After': str(max(1, int(current_app.config.get('PASSWORD_HASH_QUEUE_TIMEOUT', 5))))}
 
 
 @api.route('/register')
@@ -44,6 +62,7 @@ class AuthRegister(Resource):
     @api.expect(registration_request, validate=True)
     @api.response(200, 'User registered')
     @api.response(400, 'Bad request')
+    @api.response(503, 'Too many passwords being hashed, retry later')
     @api.response(500, 'Error registering the user')
     def post(self):
         """
@@ -55,13 +74,13 @@ class AuthRegister(Resource):
         # check if the json data is valid
         if not data:
             raise InvalidJsonException()
-        # create a new user
-        user = User(
-            data['username'],
-            data['password'],
-            data['role']
-        )
         try: 
+            # create a new user
+            user = User(
+                data['username'],
+                data['password'],
+                data['role']
+            )
             token = register_user(user)
             return {
                 "message": "User registered",
@@ -72,6 +91,8 @@ class AuthRegister(Resource):
             return {
                 "message": "User already exists"
             }, 400
+        except PasswordHasherBusyException as e:
+            return password_hasher_busy_response(e)
         except Exception as e:
             logger.error(e)
             return {
@@ -85,6 +106,7 @@ class AuthLogin(Resource):
     @api.expect(login_request, validate=True)
     @api.response(200, 'User logged in')
     @api.response(400, 'Bad request')
+    @api.response(503, 'Too many passwords being hashed, retry later')
     @api.response(500, 'Error logging in the user')
     def post(self):
         """
@@ -108,6 +130,8 @@ class AuthLogin(Resource):
             return {
                 "message": "Incorrect password"
             }, 400
+        except PasswordHasherBusyException as e:
+            return password_hasher_busy_response(e)
         except Exception as e:
             logger.error(e)
             return {
@@ -146,3 +170,141 @@ class OauthTokens(Resource):
         return {
             "message": "OAuth token updated successfully",
         }, 200
+
+
+# users routes
+@api.route('/users/<string:user_id>')
+class AuthUser(Resource):
+    @api.doc('delete a user', description="API route to delete a user. The tokens already issued to the user are rejected right away.")
+    @api.expect(auth_token_parser, validate=True)
+    @api.response(200, 'User deleted')
+    @api.response(404, 'User does not exist')
+    @api.response(401, 'Unauthorized request')
+    @admin_required
+    def delete(self, user_id):
+        """
+        Delete a user
+        """
+        try:
+            delete_user(user_id)
+        except UserDoesNotExistException as e:
+            logger.error(e)
+            return {
+                "message": "User does not exist"
+            }, 404
+        return {
+            "message": "User deleted"
+        }, 200
+
+
+@api.route('/users/<string:user_id>/role')
+class AuthUserRole(Resource):
+    @api.doc('change the role of a user', description="API route to change the role of a user. The `role` parameter is the new role of the user, `admin` or `user`, it applies to the tokens already issued.")
+    @api.expect(auth_token_parser, role_update_request, validate=True)
+    @api.response(200, 'Role updated')
+    @api.response(400, 'Invalid role')
+    @api.response(404, 'User does not exist')
+    @api.response(401, 'Unauthorized request')
+    @admin_required
+    def put(self, user_id):
+        """
+        Change the role of a user
+        """
+        data = request.get_json()
+        if not data:
+            raise InvalidJsonException()
+        try:
+            update_user_role(user_id, data['role'])
+        except InvalidRoleException as e:
+            logger.error(e)
+            return {
+                "message": e.message
+            }, 400
+        except UserDoesNotExistException as e:
+            logger.error(e)
+            return {
+                "message": "User does not exist"
+            }, 404
+        return {
+            "message": "Role updated"
+        }, 200
+
+
+# user cache statistics
+@api.route('/cache')
+class AuthCache(Resource):
+    @api.doc('get the statistics of the user cache', description="API route to get the size and the hit, miss and invalidation counters of the cache of the authenticated users.")
+    @api.expect(auth_token_parser, validate=True)
+    @api.response(200, 'Success')
+    @api.response(401, 'Unauthorized request')
+    @admin_required
+    def get(self):
+        """
+        Get the statistics of the user cache
+        """
+        return user_cache.stats(), 200
+
+
+# API keys routes
+@api.route('/api-keys')
+class AuthApiKeys(Resource):
+    @api.doc('create an API key', description="API route to create an API key for a service client. The `name` parameter is the name of the key. The `role` parameter is the role of the key. The `scopes` parameter lists the namespaces the key can access. The key is returned once, only its HMAC digest is stored.")
+    @api.expect(auth_token_parser, api_key_request, validate=True)
+    @api.response(200, 'API key created')
+    @api.response(401, 'Unauthorized request')
+    @api.response(503, 'API keys are disabled')
+    @admin_required
+    def post(self):
+        """
+        Create an API key, it is sent in the Authorization header like a token
+        """
+        data = request.get_json()
+        if not data:
+            raise InvalidJsonException()
+        try:
+            api_key, key = api_keys.create(data['name'], data.get('role', 'user'), data.get('scopes'))
+        except ApiKeysDisabledException as e:
+            logger.error(e.message)
+            return {
+                "message": e.message
+            }, 503
+        return {
+            "message": "API key created",
+            "id": api_key.id,
+            "key": key
+        }, 200
+
+    @api.doc('list the API keys', description="API route to list the API keys with their usage counters: the number of requests and the time of the last request.")
+    @api.expect(auth_token_parser, validate=True)
+    @api.response(200, 'Success')
+    @api.response(401, 'Unauthorized request')
+    @admin_required
+    def get(self):
+        """
+        List the API keys and their usage
+        """
+        return api_keys.list(), 200
+
+
+@api.route('/api-keys/<string:key_id>')
+class AuthApiKey(Resource):
+    @api.doc('revoke an API key', description="API route to revoke an API key. The other servers reject the key after their next refresh of the keys.")
+    @api.expect(auth_token_parser, validate=True)
+    @api.response(200, 'API key revoked')
+    @api.response(404, 'API key does not exist')
+    @api.response(401, 'Unauthorized request')
+    @admin_required
+    def delete(self, key_id):
+        """
+        Revoke an API key
+        """
+        try:
+            api_keys.revoke(key_id)
+        except DatabaseDocumentNotFoundException as e:
+            logger.error(e.message)
+            return {
+                "message": "API key does not exist"
+            }, 404
+        return {
+            "message": "API key revoked"
+        }, 200
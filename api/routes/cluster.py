@@ -10,14 +10,15 @@ from flask import (
 from utils.parse_requests import parse_cluster_def_from_json
 from utils.shared import check_gcp_params_from_request
 from loguru import logger
-from utils.exceptions import InvalidJsonException, UnAuthorizedException, InternalException  
+from utils.exceptions import InvalidJsonException, UnAuthorizedException, InternalException, JobQueueFullException, JobExecutorUnavailableException
 from shared.core.create_cluster import create_cluster
 from shared.core.update_cluster import update_cluster
 from shared.entities.cluster import ClusterUpdateType
 from flask_restx import Resource, Api, Namespace, fields
-from api.internal.jobs_controller import add_job
-from api.internal.threads import CreateClusterThread, UpdateClusterThread, MigrateClusterThread, DeleteClusterThread
-from api.internal.utils import admin_required
+from api.internal.threads import submit_job, cluster_lock_key, create_cluster_operation, update_cluster_operation
+from shared.core.apply_migration_cluster import apply_migration
+from shared.core.delete_cluster import delete_cluster
+from api.internal.utils import admin_required, job_rejection_response, idempotent
 
 
 
@@ -100,7 +101,10 @@ class ClusterList(Resource):
     @api.response(400, 'Error parsing the json object')
     @api.response(401, 'Unauthorized request')
     @api.response(500, 'Error creating the cluster')
+    @api.response(429, 'Job queue is full')
+    @api.response(503, 'Job executor unavailable')
     @admin_required
+    @idempotent
     def post(self):
         """
         API route to create a cluster, it receives the cluster parameters in JSON format and launch the cluster creation operation in the background. The route returns a job to check the status of the operation.
@@ -126,19 +130,15 @@ class ClusterList(Resource):
 
             # create cluster
             job_id = str(uuid.uuid4())
-            thread = CreateClusterThread(job_id, gcp_project, cluster, data)
-            thread.start()
-            add_job(job_id, cluster.name, 'Cluster Creation', 'PENDING', gcp_project.project_id)
-            return {
-                'name': job_id,
-                'cluster_name': cluster.name,
-                'type': 'Cluster Creation',
-                'project-id': gcp_project.project_id, 
-                'status': 'PENDING'
-            }, 201
+            job = submit_job(job_id, cluster.name, 'Cluster Creation', gcp_project, create_cluster_operation,
+                lock_key=cluster_lock_key(gcp_project, cluster.region, cluster.name), cluster_json=data)
+            return job, 201
         except InvalidJsonException as e:
             logger.error(f"Error parsing the json object: {e}")
             return {'error': "Error parsing the json object"}, 400
+        except (JobQueueFullException, JobExecutorUnavailableException) as e:
+            logger.warning(f"Job rejected: {e.message}")
+            return job_rejection_response(e)
         except Exception as e:
             logger.error(f"Error creating the cluster: {e}")
             return {'error': "Error creating the cluster"}, 500
@@ -154,7 +154,10 @@ class Cluster(Resource):
     @api.response(400, 'Error parsing the json object')
     @api.response(401, 'Unauthorized request')
     @api.response(500, 'Error updating the cluster')
+    @api.response(429, 'Job queue is full')
+    @api.response(503, 'Job executor unavailable')
     @admin_required
+    @idempotent
     def put(self, cluster_name):
         """
         API route to update a cluster, it receives the cluster parameters in JSON format and launch the cluster update operation in the background. The route returns a job to check the status of the operation, NOTE: The cluster update can either be in the rolling mode or no migration mode depending on the parameter `migrate`
@@ -177,24 +180,19 @@ class Cluster(Resource):
         try:
             cluster = parse_cluster_def_from_json(data)
             migrate = cluster_update_parser.parse_args()['migrate']
-            cluster_update_type = ClusterUpdateType.UPDATE_AND_MIGRATE if migrate else ClusterUpdateType.UPDATE_NO_MIGRATE
             logger.info(f"Parameters parsed, cluster is {cluster}")
 
             # update cluster
             job_id = str(uuid.uuid4())
-            thread = UpdateClusterThread(job_id, gcp_project, cluster, cluster_update_type, data)
-            thread.start()
-            add_job(job_id, cluster.name, 'Cluster Update', 'PENDING', gcp_project.project_id)
-            return {
-                'name': job_id,
-                'cluster_name': cluster.name,
-                'type': 'Cluster Update',
-                'project-id': gcp_project.project_id, 
-                'status': 'PENDING'
-            }, 201
+            job = submit_job(job_id, cluster.name, 'Cluster Update', gcp_project, update_cluster_operation,
+                lock_key=cluster_lock_key(gcp_project, cluster.region, cluster.name), cluster_json=data, migrate=migrate)
+            return job, 201
         except InvalidJsonException as e:
             logger.error(f"Error parsing the json object: {e}")
             return {'error': "Error parsing the json object"}, 400
+        except (JobQueueFullException, JobExecutorUnavailableException) as e:
+            logger.warning(f"Job rejected: {e.message}")
+            return job_rejection_response(e)
         except Exception as e:
             logger.error(f"Error updating the cluster: {e}")
             return {'error': "Error updating the cluster"}, 500
@@ -205,7 +203,10 @@ class Cluster(Resource):
     @api.response(201, 'Cluster deleted')
     @api.response(401, 'Unauthorized request')
     @api.response(500, 'Error deleting the cluster')
+    @api.response(429, 'Job queue is full')
+    @api.response(503, 'Job executor unavailable')
     @admin_required
+    @idempotent
     def delete(self, cluster_name):
         """
         API route to delete a cluster. The route returns a job to check the status of the operation
@@ -225,16 +226,13 @@ class Cluster(Resource):
         region = cluster_delete_parser.parse_args()['region']
         # delete cluster
         job_id = str(uuid.uuid4())
-        thread = DeleteClusterThread(job_id, gcp_project, cluster_name, region)
-        thread.start()
-        add_job(job_id, cluster_name, 'Cluster Deletion', 'PENDING', gcp_project.project_id)
-        return {
-            'name': job_id,
-            'cluster_name': cluster_name,
-            'type': 'Cluster Deletion',
-            'project-id': gcp_project.project_id, 
-            'status': 'PENDING'
-        }, 201
+        try:
+            job = submit_job(job_id, cluster_name, 'Cluster Deletion', gcp_project, delete_cluster,
+                lock_key=cluster_lock_key(gcp_project, region, cluster_name), cluster_name=cluster_name, region=region)
+        except (JobQueueFullException, JobExecutorUnavailableException) as e:
+            logger.warning(f"Job rejected: {e.message}")
+            return job_rejection_response(e)
+        return job, 201
 
 
 
@@ -250,7 +248,10 @@ class Cluster(Resource):
     @api.response(201, 'Cluster migrated')
     @api.response(401, 'Unauthorized request')
     @api.response(500, 'Error updating the cluster')
+    @api.response(429, 'Job queue is full')
+    @api.response(503, 'Job executor unavailable')
     @admin_required
+    @idempotent
     def post(self, cluster_name):
         """
         API route to migrate the cluster to the last update created. It returns a job to check the status of the operation
@@ -270,16 +271,12 @@ class Cluster(Resource):
             cluster_region = cluster_migration_parser.parse_args()['cluster_region']
             # update cluster
             job_id = str(uuid.uuid4())
-            thread = MigrateClusterThread(job_id, gcp_project, cluster_name, cluster_region)
-            thread.start()
-            add_job(job_id, cluster_name, 'Cluster Migrate', 'PENDING', gcp_project.project_id)
-            return {
-                'name': job_id,
-                'cluster_name': cluster_name,
-                'type': 'Cluster Migrate',
-                'project-id': gcp_project.project_id, 
-                'status': 'PENDING'
-            }, 201
+            job = submit_job(job_id, cluster_name, 'Cluster Migrate', gcp_project, apply_migration,
+                lock_key=cluster_lock_key(gcp_project, cluster_region, cluster_name), cluster_name=cluster_name, cluster_region=cluster_region)
+            return job, 201
+        except (JobQueueFullException, JobExecutorUnavailableException) as e:
+            logger.warning(f"Job rejected: {e.message}")
+            return job_rejection_response(e)
         except Exception as e:
             logger.error(f"Error updating the cluster: {e}")
             return {'error': "Error updating the cluster"}, 500
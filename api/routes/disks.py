@@ -8,13 +8,12 @@ from flask import (
 from utils.parse_requests import parse_cluster_def_from_json
 from loguru import logger
 from utils.shared import check_gcp_params_from_request
-from utils.exceptions import InvalidJsonException, UnAuthorizedException, InternalException
+from utils.exceptions import InvalidJsonException, UnAuthorizedException, InternalException, JobQueueFullException, JobExecutorUnavailableException
 from flask_restx import Resource, Api, Namespace, fields
-from api.internal.jobs_controller import check_job, get_job, update_job_status, get_job_list, add_job
-from api.internal.utils import admin_required
+from api.internal.utils import admin_required, job_rejection_response, idempotent
 from api.routes.cluster import gcp_parser, auth_token_parser
 from shared.core.attach_disk import attach_disk_to_instance
-from api.internal.threads import AsyncOperationThread
+from api.internal.threads import submit_job
 
 # create job namespace 
 api = Namespace('disks', description='Disks operations')
@@ -52,7 +51,10 @@ class AttachDiskToInstance(Resource):
     @api.response(200, 'Disk attached successfully')
     @api.response(400, 'Invalid request')
     @api.response(401, 'Unauthorized')
+    @api.response(429, 'Job queue is full')
+    @api.response(503, 'Job executor unavailable')
     @admin_required
+    @idempotent
     def post(self):
         """
         Attach a disk to an instance
@@ -76,7 +78,7 @@ class AttachDiskToInstance(Resource):
                 raise InvalidJsonException('Invalid json object')
 
             job_id = str(uuid.uuid4()) 
-            thread = AsyncOperationThread(job_id, gcp_project, operation=attach_disk_to_instance,
+            submit_job(job_id, attach_disk_instance["instance_name"], 'Attach Disk to Instance', gcp_project, attach_disk_to_instance,
                 zone = attach_disk_instance['zone'],
                 disk_name = attach_disk_instance['disk_name'],
                 instance_name = attach_disk_instance['instance_name'],
@@ -86,8 +88,6 @@ class AttachDiskToInstance(Resource):
                 image_project = attach_disk_instance['image_project'],
                 auto_delete = attach_disk_instance['auto_delete']
             )
-            thread.start()
-            add_job(job_id, attach_disk_instance["instance_name"], 'Attach Disk to Instance', 'PENDING', gcp_project.project_id)
             return {
                 'name': job_id,
                 'instance-name': attach_disk_instance['instance_name'],
@@ -95,6 +95,9 @@ class AttachDiskToInstance(Resource):
                 'project-id': gcp_project.project_id, 
                 'status': 'PENDING'
             }, 201
+        except (JobQueueFullException, JobExecutorUnavailableException) as e:
+            logger.warning(f"Job rejected: {e.message}")
+            return job_rejection_response(e)
         except Exception as e:
             logger.error(e)
             return {'error': "Error attaching disk"}, 500
@@ -2,16 +2,21 @@
 import functools
 import uuid
 import threading
+import json
+import datetime
 from flask import (
-  flash, g, redirect, render_template, request, session, url_for, jsonify
+  flash, g, redirect, render_template, request, session, url_for, jsonify, Response, stream_with_context, current_app
 )
 from utils.parse_requests import parse_cluster_def_from_json
 from loguru import logger
 from utils.shared import check_gcp_params_from_request
-from utils.exceptions import InvalidJsonException, UnAuthorizedException, InternalException
+from utils.exceptions import InvalidJsonException, UnAuthorizedException, InternalException, InvalidCursorException
 from flask_restx import Resource, Api, Namespace, fields
-from api.internal.jobs_controller import check_job, get_job, update_job_status, get_job_list
+from api.internal.jobs_controller import check_job, get_job, update_job_status, get_job_list, get_step_stats, JOB_LIST_FILTERS
 from api.internal.utils import admin_required
+from api.internal.threads import executor, job_queue, job_archiver, cancel_job
+from utils.operation_waiter import operation_waiter
+from api.extensions import job_events
 from api.routes.cluster import gcp_parser, auth_token_parser
 
 # create job namespace 
@@ -25,6 +30,11 @@ job_model = api.model('Job', {
     'type': fields.String(required=True, description='The type of the job'),
     'status': fields.String(required=True, description='The status of the job'),
     'project-id': fields.String(required=True, description='The project id of the job'),
+    'queue_position': fields.Integer(required=False, description='The position of a QUEUED job behind the jobs of the same cluster'),
+    'status_history': fields.List(fields.Raw, required=False, description='The statuses of the job with the time they were set, oldest first'),
+    'half_done_resources': fields.List(fields.Raw, required=False, description='The resources left half-done by a CANCELLED job'),
+    'steps': fields.List(fields.Raw, required=False, description='The steps of the job with their start and end time, duration, GCP operation ids and retries'),
+    'duration': fields.Float(required=False, description='The duration of the job in seconds'),
 })
 
 
@@ -36,14 +46,17 @@ job_list_parser.add_argument('status', type=str, help='The status of the job', l
 job_list_parser.add_argument('type', type=str, help='The type of the job', location='args')
 job_list_parser.add_argument('cluster_name', type=str, help='The cluster name of the job', location='args')
 job_list_parser.add_argument('project-id', type=str, help='The project id of the job', location='args')
+job_list_parser.add_argument('limit', type=int, default=100, help='The maximum number of jobs returned, between 1 and 1000', location='args')
+job_list_parser.add_argument('cursor', type=str, help='The cursor of the next page returned in the `X-Next-Cursor` header of the previous page', location='args')
 # job list resource 
 @api.route('/')
 class JobList(Resource):
     
     # get job list route
-    @api.doc('get_job_list', description="API route to get the list of jobs and their status. The `status` parameter can be used to filter the jobs by status. The `type` parameter can be used to filter the jobs by type. The `cluster_name` parameter can be used to filter the jobs by cluster name.")
+    @api.doc('get_job_list', description="API route to get the list of jobs and their status, the newest jobs first. The `status` parameter can be used to filter the jobs by status. The `type` parameter can be used to filter the jobs by type. The `cluster_name` parameter can be used to filter the jobs by cluster name. The list is paginated: at most `limit` jobs are returned and the `X-Next-Cursor` header holds the `cursor` of the next page.")
     @api.expect(job_list_parser, auth_token_parser, validate=True)
     @api.response(200, 'Job list found')
+    @api.response(400, 'Invalid limit or cursor')
     @api.response(401, 'Unauthorized request')
     @api.response(500, 'Error getting the job list')
     @admin_required
@@ -51,25 +64,103 @@ class JobList(Resource):
         """
         API route to get the list of jobs and their status. The `status` parameter can be used to filter the jobs by status. The `type` parameter can be used to filter the jobs by type. The `cluster_name` parameter can be used to filter the jobs by cluster name.
         """
-        jobs_list = get_job_list()
         args = job_list_parser.parse_args()
-        status = args.get('status')
-        job_type = args.get('type')
-        cluster_name = args.get('cluster_name')
-        project_id = args.get('project-id')
-        # filter list by status
-        if status:
-            jobs_list = list(filter(lambda job: job['status'] == status, jobs_list))
-        # filter list by type
-        if job_type:
-            jobs_list = list(filter(lambda job: job['type'] == job_type, jobs_list))
-        # filter list by cluster name
-        if cluster_name:
-            jobs_list = list(filter(lambda job: job['cluster_name'] == cluster_name, jobs_list))
-        # filter list by project 
-        if project_id:
-            jobs_list = list(filter(lambda job: job['project-id'] == project_id, jobs_list))
-        return jobs_list, 200
+        limit = args.get('limit')
+        if limit < 1 or limit > 1000:
+            return {'error': 'The limit must be between 1 and 1000'}, 400
+        filters = {name: args.get(name) for name in JOB_LIST_FILTERS}
+        try:
+            jobs_list, next_cursor = get_job_list(filters, limit, args.get('cursor'))
+        except InvalidCursorException as e:
+            return {'error': e.message}, 400
+        headers = {'X-Next-Cursor': next_cursor} if next_cursor else {}
+        return jobs_list, 200, headers
+
+
+@api.route('/queue')
+class JobQueue(Resource):
+
+    # get the state of the job executor
+    @api.doc('get_job_queue', description="API route to get the state of the job executor: the number of workers, the running jobs and the depth of the queue. The `scheduler` field details the running and queued jobs per project and priority class, the `operations` field the GCP operations polled by the operation waiter of the server. With the durable queue, the number of pending and running jobs of all the workers.")
+    @api.expect(auth_token_parser, validate=True)
+    @api.response(200, 'Job queue state')
+    @api.response(401, 'Unauthorized request')
+    @admin_required
+    def get(self):
+        """
+        API route to get the state of the job executor: the number of workers, the running jobs and the depth of the queue.
+        """
+        stats = job_queue.stats() if job_queue.enabled else executor.stats()
+        # GCP operations awaited by the jobs of this process
+        stats['operations'] = operation_waiter.stats()
+        return stats, 200
+
+
+step_stats_parser = api.parser()
+step_stats_parser.add_argument('type', type=str, help='Only aggregate the jobs of this type', location='args')
+step_stats_parser.add_argument('days', type=int, default=7, help='Only aggregate the jobs created during the last days', location='args')
+@api.route('/steps/stats')
+class JobStepStats(Resource):
+
+    # get the duration percentiles of the steps
+    @api.doc('get_job_step_stats', description="API route to get the p50, p95 and p99 durations in seconds of the completed jobs and of each of their steps, per job type. The `type` parameter limits the aggregation to a job type and `days` to the jobs created during the last days.")
+    @api.expect(step_stats_parser, auth_token_parser, validate=True)
+    @api.response(200, 'Step duration percentiles')
+    @api.response(401, 'Unauthorized request')
+    @api.response(500, 'Error computing the step durations')
+    @admin_required
+    def get(self):
+        """
+        API route to get the duration percentiles of the jobs and of their steps, per job type.
+        """
+        args = step_stats_parser.parse_args()
+        since = (datetime.datetime.utcnow() - datetime.timedelta(days=args.get('days'))).isoformat()
+        try:
+            return get_step_stats(args.get('type'), since), 200
+        except Exception as e:
+            logger.error(f"Error computing the step durations: {e}")
+            return {'error': 'Error computing the step durations'}, 500
+
+
+@api.route('/retention')
+class JobRetention(Resource):
+
+    # get the state of the retention policy
+    @api.doc('get_job_retention', description="API route to get the number and size of the job documents, the retention settings and the number of jobs processed by the archiver.")
+    @api.expect(auth_token_parser, validate=True)
+    @api.response(200, 'Job retention state')
+    @api.response(401, 'Unauthorized request')
+    @api.response(500, 'Error getting the job retention state')
+    @admin_required
+    def get(self):
+        """
+        API route to get the size of the jobs bucket and the counters of the archiver.
+        """
+        try:
+            return job_archiver.stats(), 200
+        except Exception as e:
+            logger.error(f"Error getting the job retention state: {e}")
+            return {'error': 'Error getting the job retention state'}, 500
+
+    # run the archiver
+    @api.doc('run_job_archiver', description="API route to compact one batch of old finished jobs right away instead of waiting for the next run of the archiver.")
+    @api.expect(auth_token_parser, validate=True)
+    @api.response(200, 'Archiver run')
+    @api.response(400, 'The archiver is disabled')
+    @api.response(401, 'Unauthorized request')
+    @api.response(500, 'Error running the archiver')
+    @admin_required
+    def post(self):
+        """
+        API route to run the archiver once.
+        """
+        if not job_archiver.target:
+            return {'error': 'The job archiver is disabled, set JOB_ARCHIVE_TARGET to enable it'}, 400
+        try:
+            return job_archiver.run_once(), 200
+        except Exception as e:
+            logger.error(f"Error running the job archiver: {e}")
+            return {'error': 'Error running the job archiver'}, 500
 
 
 @api.route('/<string:job_id>')
@@ -94,3 +185,106 @@ class Job(Resource):
         else:
             return {'error': 'Job not found'}, 404
 
+    # cancel job route
+    @api.doc('delete_job', description="API route to cancel a job, same as `POST /jobs/<job_id>/cancel`.")
+    @api.expect(auth_token_parser, validate=True)
+    @api.response(202, 'Job cancellation requested')
+    @api.response(401, 'Unauthorized request')
+    @api.response(404, 'Job not found')
+    @api.response(409, 'Job already finished')
+    @admin_required
+    def delete(self, job_id):
+        """
+        API route to cancel a job.
+        """
+        return cancel_job_response(job_id)
+
+
+@api.route('/<string:job_id>/cancel')
+class JobCancel(Resource):
+
+    # cancel job route
+    @api.doc('cancel_job', description="API route to cancel a job. A job that didn't start yet is `CANCELLED` right away. A running job is `CANCELLING` until its operation reaches its next wait loop (GCP operation, managed instance group stability, startup script polling), it is then `CANCELLED` and the resources it left half-done are listed in `half_done_resources`.")
+    @api.expect(auth_token_parser, validate=True)
+    @api.response(202, 'Job cancellation requested')
+    @api.response(401, 'Unauthorized request')
+    @api.response(404, 'Job not found')
+    @api.response(409, 'Job already finished')
+    @admin_required
+    def post(self, job_id):
+        """
+        API route to cancel a job.
+        """
+        return cancel_job_response(job_id)
+
+
+def cancel_job_response(job_id):
+    """
+    Cancel a job and build the response of the cancel routes.
+    """
+    if not check_job(job_id):
+        return {'error': 'Job not found'}, 404
+    try:
+        status = cancel_job(job_id)
+    except InternalException as e:
+        logger.error(f"Error cancelling the job {job_id}: {e.message}")
+        return {'error': e.message}, 500
+    if status is None:
+        return {'error': 'The job is already finished'}, 409
+    return {'name': job_id, 'status': status}, 202
+
+
+
+job_events_parser = api.parser()
+job_events_parser.add_argument('Last-Event-ID', type=int, location='headers', help='The id of the last event received, the stream resumes after it')
+job_events_parser.add_argument('last_event_id', type=int, location='args', help='Same as the `Last-Event-ID` header, for the clients that can\'t set headers when reconnecting')
+@api.route('/<string:job_id>/events')
+class JobEvents(Resource):
+
+    # stream the events of a job
+    @api.doc('get_job_events', description="API route streaming the events of a job as Server-Sent Events: `status` transitions, `step` starts and finishes and `log` lines. The stream ends after the final status of the job. A client reconnecting with the `Last-Event-ID` header receives the events published after that id.")
+    @api.expect(job_events_parser, auth_token_parser, validate=True)
+    @api.response(200, 'Event stream of the job')
+    @api.response(401, 'Unauthorized request')
+    @api.response(404, 'Job not found')
+    @admin_required
+    def get(self, job_id):
+        """
+        API route streaming the events of a job as Server-Sent Events until the job is finished.
+        """
+        if not check_job(job_id):
+            return {'error': 'Job not found'}, 404
+        args = job_events_parser.parse_args()
+        last_event_id = args.get('Last-Event-ID') or args.get('last_event_id') or 0
+        keepalive = current_app.config.get('JOB_EVENTS_KEEPALIVE', 15)
+        # the jobs run by the worker processes or by another server are followed by reading their document
+        poll_interval = current_app.config.get('JOB_EVENTS_POLL_INTERVAL', 2) if job_queue.enabled or not job_events.tracks(job_id) else None
+        return Response(stream_with_context(job_event_stream(job_id, last_event_id, keepalive, poll_interval)), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            # disable the buffering of the reverse proxies
+            'X-Accel-Buffering': 'no'
+        })
+
+
+def job_event_stream(job_id, last_event_id, keepalive, poll_interval=None):
+    """
+    Generate the Server-Sent Events of a job.
+    Parameters:
+        job_id (str): the id of the job
+        last_event_id (int): the id of the last event received by the client
+        keepalive (int): the seconds between two keep-alive comments
+        poll_interval (int): the seconds between two reads of the job document, None when the job is run by this process
+    """
+    # tell the client how long to wait before reconnecting
+    yield "retry: 3000\n\n"
+    while True:
+        if poll_interval:
+            job_events.publish_status(job_id, get_job(job_id))
+        events, finished = job_events.wait(job_id, last_event_id, poll_interval or keepalive)
+        for event in events:
+            last_event_id = event['id']
+            yield f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+        if finished:
+            return
+        if not events:
+            yield ": keep-alive\n\n"
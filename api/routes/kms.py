@@ -8,13 +8,11 @@ from flask import (
 from utils.parse_requests import parse_instance_template_from_json
 from utils.shared import check_gcp_params_from_request
 from loguru import logger
-from utils.exceptions import InvalidJsonException, UnAuthorizedException, InternalException  
+from utils.exceptions import InvalidJsonException, UnAuthorizedException, InternalException, JobQueueFullException, JobExecutorUnavailableException
 from flask_restx import Resource, Api, Namespace, fields
-from api.internal.jobs_controller import add_job
-from api.internal.cache import add_job
-from api.internal.threads import AsyncOperationThread
+from api.internal.threads import submit_job
 from shared.core.kms_operations import key_ring_create, key_create
-from api.internal.utils import admin_required
+from api.internal.utils import admin_required, job_rejection_response, idempotent
 
 api = Namespace('kms', description='Key Management Service operations')
 
@@ -55,7 +53,10 @@ class KeyRingList(Resource):
     @api.response(400, 'Error missing parameters')
     @api.response(401, 'Unauthorized request')
     @api.response(500, 'Error creating the key ring')
+    @api.response(429, 'Job queue is full')
+    @api.response(503, 'Job executor unavailable')
     @admin_required
+    @idempotent
     def post(self):
         """
         API route to create a Key Ring, it launches key ring creation operation in the background. The route returns a job to check the status of the operation
@@ -79,9 +80,7 @@ class KeyRingList(Resource):
                 raise InvalidJsonException('Invalid json object')
 
             job_id = str(uuid.uuid4()) 
-            thread = AsyncOperationThread(job_id, gcp_project, operation=key_ring_create, key_ring_params=key_ring)
-            thread.start()
-            add_job(job_id, key_ring['name'], 'Key Ring Creation', 'PENDING', gcp_project.project_id)
+            submit_job(job_id, key_ring['name'], 'Key Ring Creation', gcp_project, key_ring_create, key_ring_params=key_ring)
             return {
                 'name': job_id,
                 'Key Ring Name': key_ring['name'],
@@ -89,6 +88,9 @@ class KeyRingList(Resource):
                 'project-id': gcp_project.project_id, 
                 'status': 'PENDING'
             }, 201
+        except (JobQueueFullException, JobExecutorUnavailableException) as e:
+            logger.warning(f"Job rejected: {e.message}")
+            return job_rejection_response(e)
         except Exception as e:
             logger.error(e)
             return {'error': "Error creating the key ring"}, 500
@@ -102,7 +104,10 @@ class AsymetricKeyList(Resource):
     @api.response(400, 'Error missing parameters')
     @api.response(401, 'Unauthorized request')
     @api.response(500, 'Error creating the Asymetric Key')
+    @api.response(429, 'Job queue is full')
+    @api.response(503, 'Job executor unavailable')
     @admin_required
+    @idempotent
     def post(self):
         """
         API route to create an Asymetric Key, it launches Asymetric Key creation operation in the background. The route returns a job to check the status of the operation
@@ -125,9 +130,7 @@ class AsymetricKeyList(Resource):
             if not key_params:
                 raise InvalidJsonException('Invalid json object')
             job_id = str(uuid.uuid4()) 
-            thread = AsyncOperationThread(job_id, gcp_project, operation=key_create, key_params=key_params)
-            thread.start()
-            add_job(job_id, key_params['name'], 'Asymetric Key Creation', 'PENDING', gcp_project.project-id)
+            submit_job(job_id, key_params['name'], 'Asymetric Key Creation', gcp_project, key_create, key_params=key_params)
             return {
                 'name': job_id,
                 'Key Name': key_params['name'],
@@ -135,6 +138,9 @@ class AsymetricKeyList(Resource):
                 'project-id': gcp_project.project_id, 
                 'status': 'PENDING'
             }, 201
+        except (JobQueueFullException, JobExecutorUnavailableException) as e:
+            logger.warning(f"Job rejected: {e.message}")
+            return job_rejection_response(e)
         except Exception as e:
             logger.error(f"Error creating the key: {e}") 
             return {'error': "Error creating the key"}, 500
@@ -8,12 +8,11 @@ from flask import (
 from utils.parse_requests import parse_instance_template_from_json
 from utils.shared import check_gcp_params_from_request
 from loguru import logger
-from utils.exceptions import InvalidJsonException, UnAuthorizedException, InternalException  
+from utils.exceptions import InvalidJsonException, UnAuthorizedException, InternalException, JobQueueFullException, JobExecutorUnavailableException
 from flask_restx import Resource, Api, Namespace, fields
-from api.internal.jobs_controller import add_job
-from api.internal.threads import AsyncOperationThread
+from api.internal.threads import submit_job, cluster_lock_key
 from shared.core.managed_instance_group_operations import create_managed_instance_group, update_managed_instance_group, delete_managed_instance_group
-from api.internal.utils import admin_required
+from api.internal.utils import admin_required, job_rejection_response, idempotent
 
 
 
@@ -52,7 +51,10 @@ class managedInstanceGroupList(Resource):
     @api.response(400, 'Error parsing the json object')
     @api.response(401, 'Unauthorized request')
     @api.response(500, 'Error creating the managed instance group')
+    @api.response(429, 'Job queue is full')
+    @api.response(503, 'Job executor unavailable')
     @admin_required
+    @idempotent
     def post(self):
         """
         API route to create a Managed Instance Group, it receives the parameters in JSON format and launch the managed instance group creation operation in the background. The route returns a job to check the status of the operation
@@ -89,19 +91,22 @@ class managedInstanceGroupList(Resource):
             
             # run the async operation
             job_id = str(uuid.uuid4())
-            thread = AsyncOperationThread(job_id, gcp_project, operation=create_managed_instance_group, managed_instance_group_params=managed_instance_group_params)
-            thread.start()
-            add_job(job_id, managed_instance_group_params['name'], 'Managed Instance Group Creation', 'PENDING', gcp_project.project_id)
+            # the managed instance group of a cluster has the name of the cluster, its jobs are serialized with the cluster jobs
+            job = submit_job(job_id, managed_instance_group_params['name'], 'Managed Instance Group Creation', gcp_project, create_managed_instance_group,
+                lock_key=cluster_lock_key(gcp_project, managed_instance_group_params['region'], managed_instance_group_params['name']), managed_instance_group_params=managed_instance_group_params)
             return {
                 'name': job_id,
                 'Managed Instance Group Name': managed_instance_group_params['name'],
                 'type': 'Managed Instance Group Creation',
                 'project-id': gcp_project.project_id, 
-                'status': 'PENDING'
+                'status': job['status']
             }, 201
         except InvalidJsonException as e:
             logger.error(f"Error parsing the json object: {e}")
             return {'error': "Error parsing the json object"}, 400
+        except (JobQueueFullException, JobExecutorUnavailableException) as e:
+            logger.warning(f"Job rejected: {e.message}")
+            return job_rejection_response(e)
         except Exception as e:
             logger.error(f"Error creating the managed instance group: {e}")
             return {'error': "Error creating the managed instance group"}, 500
@@ -115,7 +120,10 @@ class ManagedInstanceGroup(Resource):
     @api.response(400, 'Error parsing the json object')
     @api.response(401, 'Unauthorized request')
     @api.response(500, 'Error updating the managed instance group')
+    @api.response(429, 'Job queue is full')
+    @api.response(503, 'Job executor unavailable')
     @admin_required
+    @idempotent
     def put(self, managed_instance_group_name):
         """
         API route to update a Managed Instance Group, it receives the parameters in JSON format and launch the managed instance group update operation in the background. The route returns a job to check the status of the operation
@@ -154,19 +162,22 @@ class ManagedInstanceGroup(Resource):
             
             # run the async operation
             job_id = str(uuid.uuid4())
-            thread = AsyncOperationThread(job_id, gcp_project, operation=update_managed_instance_group, managed_instance_group_params=managed_instance_group_params)
-            thread.start()
-            add_job(job_id, managed_instance_group_params['name'], 'Managed Instance Group Update', 'PENDING', gcp_project.project_id)
+            # the managed instance group of a cluster has the name of the cluster, its jobs are serialized with the cluster jobs
+            job = submit_job(job_id, managed_instance_group_params['name'], 'Managed Instance Group Update', gcp_project, update_managed_instance_group,
+                lock_key=cluster_lock_key(gcp_project, managed_instance_group_params['region'], managed_instance_group_params['name']), managed_instance_group_params=managed_instance_group_params)
             return {
                 'name': job_id,
                 'Managed Instance Group Name': managed_instance_group_params['name'],
                 'type': 'Managed Instance Group Update',
                 'project-id': gcp_project.project_id, 
-                'status': 'PENDING'
+                'status': job['status']
             }, 201
         except InvalidJsonException as e:
             logger.error(f"Error parsing the json object: {e}")
             return {'error': "Error parsing the json object"}, 400
+        except (JobQueueFullException, JobExecutorUnavailableException) as e:
+            logger.warning(f"Job rejected: {e.message}")
+            return job_rejection_response(e)
         except Exception as e:
             logger.error(f"Error updating the managed instance group: {e}")
             return {'error': "Error updating the managed instance group"}, 500
@@ -176,7 +187,10 @@ class ManagedInstanceGroup(Resource):
     @api.response(201, 'Managed Instance Group deleted')
     @api.response(401, 'Unauthorized request')
     @api.response(500, 'Error deleting the managed instance group')
+    @api.response(429, 'Job queue is full')
+    @api.response(503, 'Job executor unavailable')
     @admin_required
+    @idempotent
     def delete(self, managed_instance_group_name):
         """
         API route to delete a Managed Instance Group, it receives the parameters in JSON format and launch the managed instance group deletion operation in the background. The route returns a job to check the status of the operation
@@ -204,19 +218,22 @@ class ManagedInstanceGroup(Resource):
             
             # run the async operation
             job_id = str(uuid.uuid4())
-            thread = AsyncOperationThread(job_id, gcp_project, operation=delete_managed_instance_group, managed_instance_group_params=managed_instance_group_params)
-            thread.start()
-            add_job(job_id, managed_instance_group_params['name'], 'Managed Instance Group Deletion', 'PENDING', gcp_project.project_id)
+            # the managed instance group of a cluster has the name of the cluster, its jobs are serialized with the cluster jobs
+            job = submit_job(job_id, managed_instance_group_params['name'], 'Managed Instance Group Deletion', gcp_project, delete_managed_instance_group,
+                lock_key=cluster_lock_key(gcp_project, managed_instance_group_params['region'], managed_instance_group_params['name']), managed_instance_group_params=managed_instance_group_params)
             return {
                 'name': job_id,
                 'Managed Instance Group Name': managed_instance_group_params['name'],
                 'project-id': gcp_project.project_id, 
                 'type': 'Managed Instance Group Deletion',
-                'status': 'PENDING'
+                'status': job['status']
             }, 201
         except InvalidJsonException as e:
             logger.error(f"Error parsing the json object: {e}")
             return {'error': "Error parsing the json object"}, 400
+        except (JobQueueFullException, JobExecutorUnavailableException) as e:
+            logger.warning(f"Job rejected: {e.message}")
+            return job_rejection_response(e)
         except Exception as e:
             logger.error(f"Error deleting the managed instance group: {e}")
             return {'error': "Error deleting the managed instance group"}, 500
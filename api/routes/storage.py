@@ -8,12 +8,11 @@ from flask import (
 from utils.parse_requests import parse_instance_template_from_json
 from utils.shared import check_gcp_params_from_request
 from loguru import logger
-from utils.exceptions import InvalidJsonException, UnAuthorizedException, InternalException  
+from utils.exceptions import InvalidJsonException, UnAuthorizedException, InternalException, JobQueueFullException, JobExecutorUnavailableException
 from flask_restx import Resource, Api, Namespace, fields
-from api.internal.jobs_controller import add_job
-from api.internal.threads import AsyncOperationThread
+from api.internal.threads import submit_job
 from shared.core.storage_operations import create_gcp_bucket, delete_gcp_bucket 
-from api.internal.utils import admin_required
+from api.internal.utils import admin_required, job_rejection_response, idempotent
 
 
 api = Namespace('storage', description='GCP Storage operations')
@@ -47,7 +46,10 @@ class BucketList(Resource):
     @api.response(400, 'Error missing parameters')
     @api.response(401, 'Unauthorized request')
     @api.response(500, 'Error creating the bucket')
+    @api.response(429, 'Job queue is full')
+    @api.response(503, 'Job executor unavailable')
     @admin_required
+    @idempotent
     def post(self):
         """
         API route to create a Bucket, it launches bucket creation operation in the background. The route returns a job to check the status of the operation
@@ -68,9 +70,7 @@ class BucketList(Resource):
         try:
             bucket_params = request.get_json()
             job_id = str(uuid.uuid4()) 
-            add_job(job_id, bucket_params['name'], 'GCP Storage Bucket Creation', 'PENDING', gcp_project.project_id)
-            thread = AsyncOperationThread(job_id, gcp_project, operation=create_gcp_bucket, bucket_params=bucket_params)
-            thread.start()
+            submit_job(job_id, bucket_params['name'], 'GCP Storage Bucket Creation', gcp_project, create_gcp_bucket, bucket_params=bucket_params)
             return {
                 'name': job_id,
                 'Bucket Name': bucket_params['name'],
@@ -78,6 +78,9 @@ class BucketList(Resource):
                 'project-id': gcp_project.project_id, 
                 'status': 'PENDING'
             }, 201
+        except (JobQueueFullException, JobExecutorUnavailableException) as e:
+            logger.warning(f"Job rejected: {e.message}")
+            return job_rejection_response(e)
         except Exception as e:
             logger.error(e)
             return {'message': 'Internal error'}, 500
@@ -91,7 +94,10 @@ class Bucket(Resource):
     @api.response(400, 'Error missing parameters')
     @api.response(401, 'Unauthorized request')
     @api.response(500, 'Error deleting the bucket')
+    @api.response(429, 'Job queue is full')
+    @api.response(503, 'Job executor unavailable')
     @admin_required
+    @idempotent
     def delete(self, bucket_name):
         """
         API route to delete a Bucket, it launches bucket deletion operation in the background. The route returns a job to check the status of the operation
@@ -111,9 +117,7 @@ class Bucket(Resource):
         try:
             bucket_params = {'name': bucket_name}
             job_id = str(uuid.uuid4()) 
-            add_job(job_id, bucket_name, 'GCP Storage Bucket Delete', 'PENDING', gcp_project.project_id)
-            thread = AsyncOperationThread(job_id, gcp_project, operation=delete_gcp_bucket, bucket_params=bucket_params)
-            thread.start()
+            submit_job(job_id, bucket_name, 'GCP Storage Bucket Delete', gcp_project, delete_gcp_bucket, bucket_params=bucket_params)
             return {
                 'name': job_id,
                 'Bucket Name': bucket_name,
@@ -121,6 +125,9 @@ class Bucket(Resource):
                 'project-id': gcp_project.project_id, 
                 'status': 'PENDING'
             }, 201
+        except (JobQueueFullException, JobExecutorUnavailableException) as e:
+            logger.warning(f"Job rejected: {e.message}")
+            return job_rejection_response(e)
         except Exception as e:
             logger.error(e)
             return {'message': 'Internal error'}, 500
@@ -8,12 +8,11 @@ from flask import (
 from utils.parse_requests import parse_instance_template_from_json
 from utils.shared import check_gcp_params_from_request
 from loguru import logger
-from utils.exceptions import InvalidJsonException, UnAuthorizedException, InternalException  
+from utils.exceptions import InvalidJsonException, UnAuthorizedException, InternalException, JobQueueFullException, JobExecutorUnavailableException
 from flask_restx import Resource, Api, Namespace, fields
-from api.internal.jobs_controller import add_job
-from api.internal.threads import AsyncOperationThread
-from shared.core.instance_template_operations import create_instance_template, update_instance_template, delete_instance_template
-from api.internal.utils import admin_required
+from api.internal.threads import submit_job, create_instance_template_operation, update_instance_template_operation
+from shared.core.instance_template_operations import delete_instance_template
+from api.internal.utils import admin_required, job_rejection_response, idempotent
 
 
 
@@ -65,7 +64,10 @@ class InstanceTemplateList(Resource):
     @api.response(400, 'Error parsing the json object')
     @api.response(401, 'Unauthorized request')
     @api.response(500, 'Error creating the instance template')
+    @api.response(429, 'Job queue is full')
+    @api.response(503, 'Job executor unavailable')
     @admin_required
+    @idempotent
     def post(self):
         """
         API route to create an Instance Template, it receives the parameters in JSON format and launch the instance template creation operation in the background. The route returns a job to check the status of the operation
@@ -89,9 +91,7 @@ class InstanceTemplateList(Resource):
             
             # run the async operation
             job_id = str(uuid.uuid4())
-            thread = AsyncOperationThread(job_id, gcp_project, operation=create_instance_template, instance_template_params=template)
-            thread.start()
-            add_job(job_id, template.name, 'Instance Template Creation', 'PENDING', gcp_project.project_id)
+            submit_job(job_id, template.name, 'Instance Template Creation', gcp_project, create_instance_template_operation, instance_template_json=data)
             return {
                 'name': job_id,
                 'instance_template_name': template.name,
@@ -102,6 +102,9 @@ class InstanceTemplateList(Resource):
         except InvalidJsonException as e:
             logger.error(f"Error parsing the json object: {e}")
             return {'error': "Error parsing the json object"}, 400
+        except (JobQueueFullException, JobExecutorUnavailableException) as e:
+            logger.warning(f"Job rejected: {e.message}")
+            return job_rejection_response(e)
         except Exception as e:
             logger.error(f"Error creating the instance template: {e}")
             return {'error': "Error creating the instance template"}, 500
@@ -115,7 +118,10 @@ class InstanceTemplate(Resource):
     @api.response(400, 'Error parsing the json object')
     @api.response(401, 'Unauthorized request')
     @api.response(500, 'Error updating the instance template')
+    @api.response(429, 'Job queue is full')
+    @api.response(503, 'Job executor unavailable')
     @admin_required
+    @idempotent
     def put(self, template_name):
         """
         API route to update an Instance Template, it receives the parameters in JSON format and launch the instance template update operation in the background. The route returns a job to check the status of the operation
@@ -139,9 +145,7 @@ class InstanceTemplate(Resource):
             
             # run the async operation
             job_id = str(uuid.uuid4())
-            thread = AsyncOperationThread(job_id, gcp_project, operation=update_instance_template, instance_template_params=template)
-            thread.start()
-            add_job(job_id, template.name, 'Instance Template Update', 'PENDING', gcp_project.project_id)
+            submit_job(job_id, template.name, 'Instance Template Update', gcp_project, update_instance_template_operation, instance_template_json=data)
             return {
                 'name': job_id,
                 'instance_template_name': template.name,
@@ -152,6 +156,9 @@ class InstanceTemplate(Resource):
         except InvalidJsonException as e:
             logger.error(f"Error parsing the json object: {e}")
             return {'error': "Error parsing the json object"}, 400
+        except (JobQueueFullException, JobExecutorUnavailableException) as e:
+            logger.warning(f"Job rejected: {e.message}")
+            return job_rejection_response(e)
         except Exception as e:
             logger.error(f"Error updating the instance template: {e}")
             return {'error': "Error updating the instance template"}, 500
@@ -160,7 +167,10 @@ class InstanceTemplate(Resource):
     @api.expect(gcp_parser, auth_token_parser, validate=True)
     @api.response(201, 'Instance Template deleted')
     @api.response(500, 'Error deleting the instance template')
+    @api.response(429, 'Job queue is full')
+    @api.response(503, 'Job executor unavailable')
     @admin_required
+    @idempotent
     def delete(self, template_name):
         gcp_args = gcp_parser.parse_args()
         gcp_project = None
@@ -175,15 +185,17 @@ class InstanceTemplate(Resource):
         try:
             # run the async operation
             job_id = str(uuid.uuid4())
-            thread = AsyncOperationThread(job_id, gcp_project, operation=delete_instance_template, instance_template_name=template_name)
-            thread.start()
-            add_job(job_id, template_name, 'Instance Template Deletion', 'PENDING')
+            submit_job(job_id, template_name, 'Instance Template Deletion', gcp_project, delete_instance_template, instance_template_name=template_name)
             return {
                 'name': job_id,
                 'instance_template_name': template_name,
                 'type': 'Instance Template Deletion',
+                'project-id': gcp_project.project_id, 
                 'status': 'PENDING'
             }, 201
+        except (JobQueueFullException, JobExecutorUnavailableException) as e:
+            logger.warning(f"Job rejected: {e.message}")
+            return job_rejection_response(e)
         except Exception as e:
             logger.error(f"Error deleting the instance template: {e}")
             return {'error': "Error deleting the instance template"}, 500
@@ -0,0 +1,76 @@
+"""
+This script measures the CPU time spent to authenticate a request, from the token to the User, with the in-memory database and the user cache disabled.
+The previous behaviour built the User with its constructor, hashing the stored password hash again with bcrypt on every request.
+Usage:
+    python -m benchmarks.auth_path --iterations 200 --rounds 12
+"""
+import argparse
+import statistics
+import time
+from flask import Flask
+from api.config import Config
+from api.extensions import database, user_cache
+from utils.password_hasher import password_hasher
+from api.models.user import User
+from api.internal.utils import check_token
+
+
+def measure(function, iterations):
+    """
+    Call a function `iterations` times.
+    Returns:
+        list: the CPU time of each call in milliseconds
+    """
+    durations = []
+    for _ in range(iterations):
+        started_at = time.process_time()
+        function()
+        durations.append((time.process_time() - started_at) * 1000)
+    return durations
+
+
+def report(name, durations):
+    """
+    Print the mean and the percentiles of the durations.
+    """
+    durations = sorted(durations)
+    p99 = durations[min(len(durations) - 1, int(len(durations) * 0.99))]
+    print(f"{name:<24} mean {statistics.mean(durations):.3f} ms  p50 {statistics.median(durations):.3f} ms  p99 {p99:.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU time per authenticated request with and without the bcrypt hash of User.from_dict")
+    parser.add_argument('--iterations', type=int, default=200, help='the number of authentications per variant')
+    parser.add_argument('--rounds', type=int, default=Config.BCRYPT_LOG_ROUNDS, help='the bcrypt cost of the password hashes')
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    # the passwords are hashed inline so that their CPU time is measured
+    password_hasher.configure(args.rounds, 0, 0, 0)
+    database.select('memory')
+    # every request goes through the database, as on a cache miss
+    user_cache.configure(0, 0)
+
+    with app.app_context():
+        user = User("benchmark", "benchmark-password", "admin")
+        user_dict = user.to_dict()
+        database.upsert("users", user.id, user_dict)
+        token = user.encode_auth_token(user.id, user.role)
+
+        # previous behaviour: the stored user is built with the constructor, which hashes the stored hash
+        def rehashing():
+            payload = User.decode_auth_payload(token)
+            stored = database.get("users", payload['sub']['id'])
+            User(stored["username"], stored["password"], stored["role"], stored["id"])
+
+        # the stored user is loaded as is
+        def loading():
+            check_token(token)
+
+        report("from_dict with rehash", measure(rehashing, args.iterations))
+        report("from_dict without hash", measure(loading, args.iterations))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+This script measures the latency of a key-value read with and without the cached bucket handles of the CouchbaseCluster wrapper.
+It needs the same COUCHBASE_* environment variables as the REST API server and an existing document.
+Usage:
+    python -m benchmarks.couchbase_handles --bucket users --key <document key> --iterations 1000
+"""
+import argparse
+import statistics
+import time
+from api.internal.couchbase import CouchbaseCluster
+
+
+def measure(function, iterations):
+    """
+    Call a function `iterations` times.
+    Returns:
+        list: the duration of each call in milliseconds
+    """
+    durations = []
+    for _ in range(iterations):
+        started_at = time.perf_counter()
+        function()
+        durations.append((time.perf_counter() - started_at) * 1000)
+    return durations
+
+
+def report(name, durations):
+    """
+    Print the mean and the percentiles of the durations.
+    """
+    durations = sorted(durations)
+    p99 = durations[min(len(durations) - 1, int(len(durations) * 0.99))]
+    print(f"{name:<16} mean {statistics.mean(durations):.3f} ms  p50 {statistics.median(durations):.3f} ms  p99 {p99:.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-call latency of a Couchbase get with and without cached bucket handles")
+    parser.add_argument('--bucket', default='users', help='the bucket of the document')
+    parser.add_argument('--key', required=True, help='the key of an existing document')
+    parser.add_argument('--iterations', type=int, default=1000, help='the number of reads per variant')
+    args = parser.parse_args()
+
+    couchbase = CouchbaseCluster()
+    couchbase.init_couchbase()
+
+    # previous behaviour: the bucket and its collection are opened on every call
+    def uncached():
+        couchbase.cluster.bucket(args.bucket).default_collection().get(args.key)
+
+    # the collection handle is opened once by the wrapper
+    def cached():
+        couchbase.get(args.bucket, args.key)
+
+    # warm up the connections of the SDK before measuring
+    measure(cached, 10)
+    report("uncached handles", measure(uncached, args.iterations))
+    report("cached handles", measure(cached, args.iterations))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,21 @@
+"""
+This module allows to create the indexes of the database used by the REST API servers and the workers, and to migrate the documents written by older versions.
+"""
+from loguru import logger
+from api.extensions import database
+from api.internal.indexes import bootstrap_indexes
+from api.internal.auth_controller import backfill_username_keys
+from api.internal.jobs_controller import backfill_job_created_at
+
+
+def migrate_db(args):
+    """
+    Create the secondary indexes of the buckets, the existing indexes are left untouched, then write the username key documents missing
+    and the creation time of the jobs created before it was recorded.
+    """
+    logger.info("Welcome to the migrate-db sub command ")
+    database.connect()
+    bootstrap_indexes(args.primary_indexes)
+    logger.info("The indexes of the database are up to date")
+    backfill_username_keys()
+    logger.info(f"{backfill_job_created_at()} jobs given a creation time")
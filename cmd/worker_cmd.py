@@ -0,0 +1,27 @@
+"""
+This module allows to start a worker process that runs the jobs of the durable job queue. 
+"""
+import signal
+from loguru import logger
+from api.extensions import database
+from api.internal.threads import job_queue, job_archiver
+from api.config import Config
+from api.internal.worker import JobWorker
+
+
+def start_worker(args):
+    """
+    Start a worker process that claims and runs the jobs submitted to the REST API servers.
+    """
+    logger.info("Welcome to the worker sub command ")
+    # connect to the database that holds the job queue
+    database.connect()
+    job_queue.configure(True, int(args.lease_seconds), int(args.max_attempts))
+    # the finished jobs get the same time to live as with the servers, the archiver only runs in the servers
+    job_archiver.configure(Config.JOB_RETENTION_SECONDS)
+
+    worker = JobWorker(int(args.concurrency), float(args.poll_interval))
+    # stop claiming jobs on termination, the running jobs are finished first
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: worker.stop())
+    worker.run()
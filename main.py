@@ -16,6 +16,8 @@ Commands:
     create: create a new Couchbase cluster on the Google Cloud Platform. 
     update: update an existing Couchbase cluster on the Google Cloud Platform.
     server: start a web server to manage the Couchbase cluster.
+    worker: start a worker process that runs the jobs submitted to the web servers through the durable job queue.
+    migrate-db: create the indexes of the database.
 """
 
 
@@ -25,6 +27,8 @@ from utils.env import load_environment_variables
 from cmd.create_cmd import create_cluster
 from cmd.update_cmd import update_cluster
 from cmd.server_cmd import start_server
+from cmd.worker_cmd import start_worker
+from cmd.migrate_cmd import migrate_db
 from loguru import logger
 import sys
 
@@ -60,6 +64,10 @@ def main():
         update_cluster(arguments)
     elif arguments.command == "server":
         start_server(arguments)
+    elif arguments.command == "worker":
+        start_worker(arguments)
+    elif arguments.command == "migrate-db":
+        migrate_db(arguments)
 
         
 
@@ -4,6 +4,7 @@ import os
 from loguru import logger
 from shared.lib.regional_managed_instance import create_region_managed_instance_group, list_region_instances, region_adding_instances, get_region_managed_instance_group, region_scaling_mig, update_region_managed_instance_group,create_region_instance_group_managers_client, apply_updates_to_instances
 from utils.exceptions import GCPManagedInstanceGroupNotFoundException
+from shared.core.steps import step
 
 
 def apply_migration(project, cluster_name, cluster_region):
@@ -18,7 +19,8 @@ def apply_migration(project, cluster_name, cluster_region):
     """
     # check managed instance group 
     logger.info(f"Checking if managed instance group {cluster_name} exists ...")
-    mig = get_region_managed_instance_group(project, cluster_region, cluster_name)
+    with step("managed_instance_group", cluster_name):
+        mig = get_region_managed_instance_group(project, cluster_region, cluster_name)
     if mig is None: 
         logger.info(f"Managed instance group {cluster_name} does not exist")
         logger.info("You will need to create a new instance group")
@@ -28,7 +30,8 @@ def apply_migration(project, cluster_name, cluster_region):
 
         # update managed instance group 
         logger.info("Updating managed instance group ...")
-        migrate_mig(project, cluster_region, mig)
+        with step("rolling_update", cluster_name):
+            migrate_mig(project, cluster_region, mig)
     logger.success(f"Cluster {cluster_name} migrated successfully")
 
 
@@ -0,0 +1,105 @@
+# Description: This file contains the asyncio execution mode of the cluster lifecycle functions (create, update, migrate, delete, scale).
+# The lifecycle functions are synchronous, each coroutine is a thin wrapper offloading its function to a worker thread of the event loop with the context
+# of the caller (cancellation token, step trace), the waits on the GCP operations are still multiplexed by the shared operation waiter thread.
+# A worker thread can't be interrupted: when the task of a coroutine is cancelled, its cancellation token is cancelled, the function stops at its
+# next wait loop and the resources it left half-done are recorded on the token of the caller. `run_concurrently` bounds the number of lifecycles in flight.
+import asyncio
+from utils.cancellation import CancellationToken, cancellable, current_token
+from shared.core.create_cluster import create_cluster
+from shared.core.update_cluster import update_cluster
+from shared.core.apply_migration_cluster import apply_migration
+from shared.core.delete_cluster import delete_cluster
+from shared.core.managed_instance_group_operations import update_managed_instance_group
+from shared.entities.cluster import ClusterUpdateType
+
+
+async def offload(function, *args):
+    """
+    Run a lifecycle function on a worker thread of the event loop, the cancellation of the task cancels the function at its next wait loop.
+    Parameters:
+        function (callable): the synchronous lifecycle function
+        args: the arguments of the function
+    Returns:
+        Whatever the function returns.
+    Raises:
+        asyncio.CancelledError: if the task is cancelled, the function is left stopping on its worker thread
+    """
+    parent = current_token.get()
+    # the token of the caller, e.g. the job running the coroutines, also cancels the function
+    token = CancellationToken(check=parent.is_cancelled if parent else None, check_interval=1)
+
+    def run():
+        try:
+            with cancellable(token):
+                return function(*args)
+        finally:
+            # the resources left half-done are reported to the caller, even once the task has been cancelled
+            if parent:
+                for resource in token.resources:
+                    parent.record_resource(resource['resource'], resource['state'])
+
+    try:
+        return await asyncio.to_thread(run)
+    except asyncio.CancelledError:
+        token.cancel("The task has been cancelled")
+        raise
+
+
+async def create_cluster_async(project, cluster, checkpoint=None):
+    """
+    Asyncio variant of create_cluster.
+    """
+    return await offload(create_cluster, project, cluster, checkpoint)
+
+
+async def update_cluster_async(project, cluster, update_type: ClusterUpdateType, checkpoint=None):
+    """
+    Asyncio variant of update_cluster.
+    """
+    return await offload(update_cluster, project, cluster, update_type, checkpoint)
+
+
+async def apply_migration_async(project, cluster_name, cluster_region):
+    """
+    Asyncio variant of apply_migration.
+    """
+    return await offload(apply_migration, project, cluster_name, cluster_region)
+
+
+async def delete_cluster_async(project, cluster_name, region):
+    """
+    Asyncio variant of delete_cluster.
+    """
+    return await offload(delete_cluster, project, cluster_name, region)
+
+
+async def scale_cluster_async(project, managed_instance_group_params):
+    """
+    Asyncio variant of update_managed_instance_group, used to resize the managed instance group of a cluster.
+    """
+    return await offload(update_managed_instance_group, project, managed_instance_group_params)
+
+
+async def run_concurrently(calls, max_concurrency=10):
+    """
+    Run lifecycle coroutines concurrently, at most `max_concurrency` at the same time.
+    Parameters:
+        calls (list): the coroutines to run, e.g. [create_cluster_async(project, cluster) for cluster in clusters]
+        max_concurrency (int): the maximum number of lifecycles in flight
+    Returns:
+        list: the result or the exception of each call, in the order of `calls`
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def bounded(call):
+        async with semaphore:
+            return await call
+
+    return await asyncio.gather(*(bounded(call) for call in calls), return_exceptions=True)
+
+
+def run(coroutine):
+    """
+    Run a lifecycle coroutine from synchronous code, e.g. the CLI.
+    """
+    return asyncio.run(coroutine)
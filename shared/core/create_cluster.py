@@ -7,16 +7,17 @@ from utils.args import cluster_from_args
 from shared.lib.regional_managed_instance import create_region_managed_instance_group, list_region_instances, region_adding_instances, get_region_managed_instance_group, region_scaling_mig, create_region_instance_group_managers_client
 from shared.lib.template import create_template, get_instance_template, update_template, create_instance_templates_client
 from shared.lib.firewall import setup_firewall
-from shared.lib.storage import setup_cloud_storage, upload_scripts 
+from shared.lib.storage import setup_cloud_storage, upload_scripts, get_bucket
 from shared.lib.secrets_manager import setup_secret_manager    
 # from shared.discovery.secrets_manager import setup_secret_manager
 from shared.lib.kms import setup_encryption_keys 
 # from shared.discovery.kms import setup_encryption_keys
 from shared.lib.images import get_image_from_family
+from shared.core.steps import StepCheckpoint, resource_name
 
 
 
-def create_cluster(project, cluster):
+def create_cluster(project, cluster, checkpoint=None):
     """
     Perform all the necessary operations in order to create a GCP couchbase cluster. This includes the following steps:
         - Check if the secret manager exists, if not create it
@@ -29,33 +30,42 @@ def create_cluster(project, cluster):
     Parameters:
         project: The GCP project object 
         cluster: The cluster parameters
+        checkpoint: The StepCheckpoint of a previous run, the completed steps are skipped and their outputs reused
     """
+    if checkpoint is None:
+        checkpoint = StepCheckpoint()
+
     # checking secret manager
     logger.info("Checking secret manager ...")
-    secret_name = setup_secret_manager(project, cluster, cluster.couchbase_params)
+    secret_name = checkpoint.run("secret", lambda: setup_secret_manager(project, cluster, cluster.couchbase_params))
 
     # checking encryption keys
     logger.info("Checking encryption keys ...")
-    key = setup_encryption_keys(project, cluster.name, cluster.region)
+    key = checkpoint.run("encryption_key", lambda: setup_encryption_keys(project, cluster.name, cluster.region),
+        serialize=resource_name, restore=lambda name: {"name": name})
 
     # checking cloud storage
     logger.info("Checking cloud storage ...")
-    bucket = setup_cloud_storage(project, cluster.storage, cluster.region, key)
+    bucket = checkpoint.run("cloud_storage", lambda: setup_cloud_storage(project, cluster.storage, cluster.region, key),
+        serialize=resource_name, restore=lambda name: get_bucket(project, name))
 
     # upload scripts 
     logger.info("Uploading scripts ...")
-    scripts = upload_scripts(project, bucket, cluster.template, cluster, secret_name)
+    scripts = checkpoint.run("scripts", lambda: upload_scripts(project, bucket, cluster.template, cluster, secret_name))
 
     # setup instance template
     logger.info("Checking instance template ...")
-    instance_template = setup_instance_template(project, cluster, cluster.template, cluster.storage, scripts, key)
+    instance_template = checkpoint.run("instance_template", lambda: setup_instance_template(project, cluster, cluster.template, cluster.storage, scripts, key),
+        serialize=lambda template: {"name": template.name, "self_link": template.self_link},
+        restore=lambda template: get_instance_template(project, template["name"]))
 
     # check managed instance group 
     logger.info("Checking managed instance group ...")
-    mig = setup_managed_instance_group(project, cluster, instance_template)
+    mig = checkpoint.run("managed_instance_group", lambda: setup_managed_instance_group(project, cluster, instance_template),
+        serialize=resource_name)
 
     logger.info("Checking firewall rules ...")
-    setup_firewall(project, cluster.name)
+    checkpoint.run("firewall", lambda: setup_firewall(project, cluster.name))
     logger.success(f"Cluster {cluster.name} created successfully")
 
 
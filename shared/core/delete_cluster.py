@@ -1,5 +1,6 @@
 from shared.lib.regional_managed_instance import delete_region_managed_instance_group, get_region_managed_instance_group
 from shared.core.instance_template_operations import delete_instance_template
+from shared.core.steps import step
 
 
 
@@ -10,11 +11,14 @@ def delete_cluster(gcp_project, cluster_name, region):
     - Deleting the instance template 
     """
     # Get managed instance group object 
-    mig = get_region_managed_instance_group(gcp_project, region, cluster_name)
+    with step("managed_instance_group", cluster_name):
+        mig = get_region_managed_instance_group(gcp_project, region, cluster_name)
     # Get instance template name 
     instance_template = mig.instance_template.split('/')[-1]
     # Delete the regional managed instance group
-    delete_region_managed_instance_group(gcp_project, region, cluster_name)
+    with step("delete_managed_instance_group", cluster_name):
+        delete_region_managed_instance_group(gcp_project, region, cluster_name)
     # Delete the instance template
-    delete_instance_template(gcp_project, instance_template)
+    with step("delete_instance_template", instance_template):
+        delete_instance_template(gcp_project, instance_template)
 
@@ -0,0 +1,180 @@
+# Description: This file contains the named steps of the orchestration functions (create_cluster, update_cluster, apply_migration, delete_cluster).
+# A step records its start and end time, its status, the ids of the GCP operations it waited for and the number of retried requests in the StepTrace of the current job.
+# The StepCheckpoint class records the outputs of the steps of the cluster pipelines, a pipeline run with the checkpoint of a previous failed run skips the completed steps and reuses their outputs.
+import contextvars
+import datetime
+import threading
+import time
+from contextlib import contextmanager
+from loguru import logger
+from utils import cancellation
+from utils.exceptions import JobCancelledException
+
+
+# trace of the job run by the current thread, None outside of a job (e.g. with the command line)
+current_trace = contextvars.ContextVar('step_trace', default=None)
+# record of the innermost running step
+current_step = contextvars.ContextVar('step_record', default=None)
+
+
+class StepTrace:
+    def __init__(self, store=None):
+        """
+        Parameters:
+            store (callable): optional callback called with the step records every time a step starts or ends, used to persist them
+        """
+        self.steps = []
+        self.store = store
+        self.lock = threading.Lock()
+
+    def add(self, record):
+        """
+        Add the record of a step that just started.
+        """
+        with self.lock:
+            self.steps.append(record)
+        self.save()
+
+    def save(self):
+        """
+        Persist the step records, the errors of the store are logged and ignored.
+        """
+        if self.store is None:
+            return
+        with self.lock:
+            steps = [dict(record, operations=list(record['operations'])) for record in self.steps]
+        try:
+            self.store(steps)
+        except Exception as e:
+            logger.warning(f"Error saving the steps of the job: {e}")
+
+
+@contextmanager
+def traced(trace):
+    """
+    Run the code of the block with `trace` as the step trace of the current thread.
+    """
+    reset = current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        current_trace.reset(reset)
+
+
+@contextmanager
+def step(name, resource=None):
+    """
+    Run the code of the block as a named step. The job stops before the step if it has been cancelled, the step
+    is published as a log event and recorded in the trace of the current job.
+    Parameters:
+        name (str): the name of the step, the durations are aggregated per name
+        resource (str): optional name of the resource the step operates on
+    """
+    # a cancelled job stops between two steps
+    cancellation.check_cancelled()
+    step_logger = logger.bind(step=name)
+    parent = current_step.get()
+    record = {
+        'name': name,
+        'resource': resource,
+        'parent': parent['name'] if parent else None,
+        'status': 'running',
+        'started_at': datetime.datetime.utcnow().isoformat(),
+        'ended_at': None,
+        'duration': None,
+        'operations': [],
+        'retries': 0
+    }
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(record)
+    reset = current_step.set(record)
+    step_logger.bind(step_status='started').info(f"Step {name} started")
+    started_at = time.time()
+    try:
+        yield record
+        record['status'] = 'completed'
+    except JobCancelledException:
+        record['status'] = 'cancelled'
+        cancellation.record_half_done(f"step {name}" + (f" of {resource}" if resource else ""), "interrupted")
+        raise
+    except Exception:
+        record['status'] = 'failed'
+        raise
+    finally:
+        current_step.reset(reset)
+        record['ended_at'] = datetime.datetime.utcnow().isoformat()
+        record['duration'] = round(time.time() - started_at, 3)
+        log = step_logger.bind(step_status=record['status'], duration=record['duration'])
+        if record['status'] == 'completed':
+            log.info(f"Step {name} completed")
+        else:
+            log.warning(f"Step {name} {record['status']}")
+        if trace is not None:
+            trace.save()
+
+
+def record_operation(operation_id):
+    """
+    Record the id of a GCP operation the current step waited for.
+    """
+    record = current_step.get()
+    if record is not None:
+        record['operations'].append(operation_id)
+
+
+def record_retry():
+    """
+    Record a retried request of the current step.
+    """
+    record = current_step.get()
+    if record is not None:
+        record['retries'] += 1
+
+
+class StepCheckpoint:
+    def __init__(self, outputs=None, store=None):
+        """
+        Parameters:
+            outputs (dict): the serialized outputs of the steps completed by a previous run, per step name
+            store (callable): optional callback called with the outputs every time a step completes, used to persist them
+        """
+        self.outputs = dict(outputs or {})
+        self.store = store
+
+    def run(self, step_name, function, serialize=None, restore=None):
+        """
+        Run a step of the pipeline, or reuse its output if the step already completed.
+        Parameters:
+            step_name (str): the name of the step
+            function (callable): the function performing the step
+            serialize (callable): converts the result of the step to a json value, the result is stored as is by default
+            restore (callable): converts the stored json value back to the value expected by the next steps
+        Returns:
+            the result of the step
+        """
+        if step_name in self.outputs:
+            logger.bind(step=step_name, step_status='skipped').info(f"Step {step_name} already completed, reusing its output")
+            output = self.outputs[step_name]
+            return restore(output) if restore else output
+        with step(step_name):
+            result = function()
+        self.outputs[step_name] = serialize(result) if serialize else result
+        if self.store:
+            self.store(self.outputs)
+        return result
+
+    def completed_steps(self):
+        """
+        Names of the completed steps.
+        """
+        return list(self.outputs.keys())
+
+
+def resource_name(resource):
+    """
+    Name of a GCP resource returned either as a client library object or as a dict by the discovery API.
+    """
+    if isinstance(resource, dict):
+        return resource['name']
+    return resource.name
@@ -6,16 +6,17 @@ from shared.entities.cluster import ClusterUpdateType
 from shared.lib.regional_managed_instance import create_region_managed_instance_group, list_region_instances, region_adding_instances, get_region_managed_instance_group, region_scaling_mig, update_region_managed_instance_group,create_region_instance_group_managers_client, apply_updates_to_instances
 from shared.lib.template import create_template, get_instance_template, update_template, create_instance_templates_client
 from shared.lib.firewall import setup_firewall
-from shared.lib.storage import setup_cloud_storage, upload_scripts
+from shared.lib.storage import setup_cloud_storage, upload_scripts, get_bucket
 # from lib.secrets_manager import setup_secret_manager
 from shared.discovery.secrets_manager import setup_secret_manager
 # from lib.kms import setup_encryption_keys
 from shared.discovery.kms import setup_encryption_keys
 from shared.lib.images import get_image_from_family
+from shared.core.steps import StepCheckpoint, resource_name
 from utils.exceptions import GCPManagedInstanceGroupNotFoundException, GCPInstanceTemplateAlreadyExistsException
 
 
-def update_cluster(project, cluster, update_type: ClusterUpdateType):
+def update_cluster(project, cluster, update_type: ClusterUpdateType, checkpoint=None):
     """
     Perform all the necessary operations in order to update a GCP couchbase cluster. This includes the following steps:
         - Check if the secret manager exists, if not create it
@@ -29,7 +30,11 @@ def update_cluster(project, cluster, update_type: ClusterUpdateType):
         project: The GCP project object
         cluster: The cluster parameters
         update_type: The type of update to perform
+        checkpoint: The StepCheckpoint of a previous run, the completed steps are skipped and their outputs reused
     """
+    if checkpoint is None:
+        checkpoint = StepCheckpoint()
+
     # check managed instance group 
     logger.info(f"Checking if managed instance group {cluster.name} exists ...")
     mig = get_region_managed_instance_group(project, cluster.region, cluster.name)
@@ -42,28 +47,33 @@ def update_cluster(project, cluster, update_type: ClusterUpdateType):
 
         # checking secret manager
         logger.info("Checking secret manager ...")
-        secret_name = setup_secret_manager(project, cluster, cluster.couchbase_params)
+        secret_name = checkpoint.run("secret", lambda: setup_secret_manager(project, cluster, cluster.couchbase_params))
 
         # checking encryption keys
         logger.info("Checking encryption keys ...")
-        key = setup_encryption_keys(project, cluster.name, cluster.region)
+        key = checkpoint.run("encryption_key", lambda: setup_encryption_keys(project, cluster.name, cluster.region),
+            serialize=resource_name, restore=lambda name: {"name": name})
 
         # checking cloud storage
         logger.info("Checking cloud storage ...")
-        bucket = setup_cloud_storage(project, cluster.storage, cluster.region, key)
+        bucket = checkpoint.run("cloud_storage", lambda: setup_cloud_storage(project, cluster.storage, cluster.region, key),
+            serialize=resource_name, restore=lambda name: get_bucket(project, name))
 
         # upload scripts 
         logger.info("Uploading scripts ...")
-        scripts = upload_scripts(project, bucket, cluster.template, cluster, secret_name)
+        scripts = checkpoint.run("scripts", lambda: upload_scripts(project, bucket, cluster.template, cluster, secret_name))
 
         # setup instance template
         logger.info("Checking instance template ...")
-        instance_template = setup_instance_template(project, cluster, cluster.template, cluster.storage, scripts, key)
+        instance_template = checkpoint.run("instance_template", lambda: setup_instance_template(project, cluster, cluster.template, cluster.storage, scripts, key),
+            serialize=lambda template: {"name": template.name, "self_link": template.self_link},
+            restore=lambda template: get_instance_template(project, template["name"]))
         # update managed instance group 
         logger.info("Updating managed instance group ...")
-        update_mig(project, cluster, instance_template, update_type)
+        checkpoint.run("managed_instance_group", lambda: update_mig(project, cluster, instance_template, update_type),
+            serialize=lambda result: cluster.name)
     logger.info("Checking firewall rules ...")
-    setup_firewall(project, cluster.name)
+    checkpoint.run("firewall", lambda: setup_firewall(project, cluster.name))
     logger.success(f"Cluster {cluster.name} updated successfully")
 
 
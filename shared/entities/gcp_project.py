@@ -1,8 +1,10 @@
 
 # GCP project class for the GCP project that hosts the cluster.
 class GCPProject:
-    def __init__(self, project_id, auth_type="service-account", service_token=None):
+    def __init__(self, project_id, auth_type="service-account", service_token=None, project_number=None):
         self.project_id = project_id
+        # the project number is only known when the project comes from a REST API request
+        self.project_number = project_number
         self.auth_type = auth_type
         # if auth_type is oauth2, then we need to set the service token
         self.service_token = service_token
@@ -6,6 +6,9 @@ from shared.lib.template import get_instance_template
 from shared.lib.instances import get_instance_serial_output
 from google.cloud import compute_v1
 from utils.shared import wait_for_extended_operation
+from utils import cancellation
+from utils.exceptions import JobCancelledException
+from shared.core.steps import step
 import google.oauth2.credentials
 
 
@@ -152,12 +155,17 @@ def __create_region_managed_instance_group(instance_group_manager_client, projec
         project=project_id, region=region, instance_group_manager=instance_group_name
     )    
     # wait till the instance group manager is stable 
-    while not instance_group_manager.status.is_stable:
-        logger.debug(f"Waiting for instance group manager {instance_group_name} to be stable")
-        time.sleep(5)
-        instance_group_manager = instance_group_manager_client.get(
-            project=project_id, region=region, instance_group_manager=instance_group_name
-        )
+    with step("mig_stabilization", instance_group_name):
+        while not instance_group_manager.status.is_stable:
+            logger.debug(f"Waiting for instance group manager {instance_group_name} to be stable")
+            try:
+                cancellation.sleep(5)
+            except JobCancelledException:
+                cancellation.record_half_done(f"managed instance group {instance_group_name}", "created but not stable yet")
+                raise
+            instance_group_manager = instance_group_manager_client.get(
+                project=project_id, region=region, instance_group_manager=instance_group_name
+            )
     logger.debug(f"Instance group manager {instance_group_name} is stable")
     # return instance group manager
     return instance_group_manager
@@ -265,10 +273,17 @@ def __apply_updates_to_instances(instance_group_manager_client, project, region,
     # check with the serial port output to verify that the startup script worked successfully.
     # if the startup script failed, the serial port output will contain the error message.
 
-    # get the list of instances in the instance group manager
-    managed_instances = __list_region_instances(instance_group_manager_client, project.project_id, region, instance_group_manager.name)
+    # get the list of instances in the instance group manager, the pager is read into a list so that
+    # the instances not updated yet can be sliced if the job is cancelled
+    managed_instances = list(__list_region_instances(instance_group_manager_client, project.project_id, region, instance_group_manager.name))
     # loop over the instances and apply update to each instance
-    for managed_instance in managed_instances:
+    for index, managed_instance in enumerate(managed_instances):
+        # the instances not updated yet are recorded if the job is cancelled
+        try:
+            cancellation.check_cancelled()
+        except JobCancelledException:
+            __record_instances_not_updated(instance_group_manager.name, managed_instances[index:])
+            raise
         logger.debug(f"Applying updates to instance {managed_instance.instance}")
         # create an instance group managers apply updates request
         apply_updates_request = compute_v1.ApplyUpdatesToInstancesRegionInstanceGroupManagerRequest(
@@ -283,32 +298,43 @@ def __apply_updates_to_instances(instance_group_manager_client, project, region,
         operation = instance_group_manager_client.apply_updates_to_instances(
             request=apply_updates_request
         )
+        # get instance name and zone from the url 
+        instance_name = managed_instance.instance.split("/")[-1]
+        instance_zone = managed_instance.instance.split("/")[-3]
+
         # wait for operation to complete
         try:
-            wait_for_extended_operation(operation, project.project_id)
+            with step("apply_updates", instance_name):
+                wait_for_extended_operation(operation, project.project_id)
+        except JobCancelledException:
+            __record_instances_not_updated(instance_group_manager.name, managed_instances[index:])
+            raise
         except Exception as e:
             logger.error(f"Error applying updates to instances: {e}")
             raise e
         logger.success(f"Updates applied to instance {managed_instance.instance}")
-        
-        # get instance name and zone from the url 
-        instance_name = managed_instance.instance.split("/")[-1]
-        instance_zone = managed_instance.instance.split("/")[-3]
 
         logger.debug("Waiting for the startup script to finish")
-        while True:    
-            time.sleep(60)
-            logger.debug("Waiting for the startup script to finish")
-            # get the serial port output of the instance
-            output = get_instance_serial_output(
-                project,
-                instance_zone,
-                instance_name
-            )
-            # use regex to get startup-script-url status code 
-            status_code = re.findall(r"startup-script-url exit status (\d+)", output)
-            if len(status_code) >= 1:
-                break
+        # the job may also be cancelled when the step starts, before the first sleep
+        try:
+            with step("startup_script", instance_name):
+                while True:    
+                    cancellation.sleep(60)
+                    logger.debug("Waiting for the startup script to finish")
+                    # get the serial port output of the instance
+                    output = get_instance_serial_output(
+                        project,
+                        instance_zone,
+                        instance_name
+                    )
+                    # use regex to get startup-script-url status code 
+                    status_code = re.findall(r"startup-script-url exit status (\d+)", output)
+                    if len(status_code) >= 1:
+                        break
+        except JobCancelledException:
+            cancellation.record_half_done(f"instance {instance_name}", "updated, startup script not verified")
+            __record_instances_not_updated(instance_group_manager.name, managed_instances[index + 1:])
+            raise
         if status_code[-1] != '0':
             logger.error("The startup script url returned an execution error")
             logger.error("Stopping the update script")
@@ -320,6 +346,12 @@ def __apply_updates_to_instances(instance_group_manager_client, project, region,
 
 
 
+# record the instances of a mig that a cancelled rolling update didn't reach
+def __record_instances_not_updated(instance_group_name, managed_instances):
+    for managed_instance in managed_instances:
+        cancellation.record_half_done(f"instance {managed_instance.instance.split('/')[-1]}", f"not updated, managed instance group {instance_group_name} left with mixed templates")
+
+
 # scaling up the mig or down
 def __region_scaling_mig(
     instance_group_manager_client,
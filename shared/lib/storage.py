@@ -72,6 +72,12 @@ def list_buckets(project):
     storage_client = create_storage_client(project)
     return __list_buckets(storage_client)
 
+# public function
+def get_bucket(project, bucket_name):
+    storage_client = create_storage_client(project)
+    # reference to an existing bucket, no request is sent
+    return storage_client.bucket(bucket_name)
+
 # public function
 def delete_bucket(project, bucket_name):
     storage_client = create_storage_client(project)
@@ -82,6 +88,11 @@ def upload_blob(project, bucket_name, source_file_name, destination_blob_name):
     storage_client = create_storage_client(project)
     return __upload_blob(storage_client, bucket_name, source_file_name, destination_blob_name)
 
+# public function
+def upload_blob_from_string(project, bucket_name, content, destination_blob_name, content_type="text/plain"):
+    storage_client = create_storage_client(project)
+    return __upload_blob_from_string(storage_client, bucket_name, content, destination_blob_name, content_type)
+
 # public function
 def download_blob(project, bucket_name, source_blob_name, destination_file_name):
     storage_client = create_storage_client(project)
@@ -190,6 +201,19 @@ def __upload_blob(storage_client, bucket_name, source_file_name, destination_blo
     return blob.public_url
 
 
+def __upload_blob_from_string(storage_client, bucket_name, content, destination_blob_name, content_type):
+    """Uploads a string to the bucket."""
+    logger.info(f"Uploading {destination_blob_name} to {bucket_name} bucket...")
+
+    bucket = storage_client.bucket(bucket_name)
+    blob = bucket.blob(destination_blob_name)
+
+    blob.upload_from_string(content, content_type=content_type)
+
+    logger.success(f"Content uploaded to {destination_blob_name}.")
+    return blob.public_url
+
+
 def __download_blob(storage_client, bucket_name, source_blob_name, destination_file_name):
     """Downloads a blob from the bucket."""
     # bucket_name = "your-bucket-name"
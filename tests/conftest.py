@@ -0,0 +1,29 @@
+# Description: Fixtures of the tests, they run against the in-memory database backend and need neither Couchbase nor GCP.
+import os
+import sys
+os.environ.setdefault('DATABASE_BACKEND', 'memory')
+os.environ.setdefault('PASSWORD_HASH_WORKERS', '0')
+# the `cmd` package of the repository shadows the standard library module imported by pdb (pytest, click.testing),
+# the standard library module is imported first with the root of the repository out of the path
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+paths = sys.path
+sys.path = [path for path in paths if os.path.abspath(path or os.curdir) != root]
+import cmd
+import pdb
+sys.path = paths
+import pytest
+from api.extensions import database, user_cache, job_events
+from api.internal.memory_database import MemoryDatabase
+
+
+@pytest.fixture(autouse=True)
+def memory_database():
+    """
+    Give each test an empty in-memory database, an empty user cache and no job events.
+    """
+    database.backend = MemoryDatabase()
+    database.connect()
+    user_cache.clear()
+    with job_events.condition:
+        job_events.streams.clear()
+    yield database
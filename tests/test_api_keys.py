@@ -0,0 +1,121 @@
+# Description: Tests of the authentication of the service clients with API keys: digests, scopes, revocation and usage counters.
+import pytest
+from flask import Flask
+from api.internal import utils
+from api.internal.api_keys import ApiKeyStore
+from api.internal.utils import admin_required
+from api.models.api_key import ApiKey, API_KEY_PREFIX
+from utils.exceptions import UnAuthorizedException, ApiKeysDisabledException, DatabaseDocumentNotFoundException
+
+
+@pytest.fixture
+def store():
+    store = ApiKeyStore()
+    store.configure('hmac-secret')
+    return store
+
+
+@pytest.fixture
+def client(store, monkeypatch):
+    monkeypatch.setattr(utils, 'api_keys', store)
+    app = Flask(__name__)
+
+    @app.route('/clusters')
+    @admin_required
+    def get_clusters():
+        return {'clusters': []}, 200
+
+    @app.route('/jobs')
+    @admin_required
+    def get_jobs():
+        return {'jobs': []}, 200
+
+    return app.test_client()
+
+
+def test_only_the_digest_of_the_key_is_stored(store, memory_database):
+    api_key, key = store.create('ci', 'admin')
+    assert key.startswith(API_KEY_PREFIX + api_key.id + '.')
+    secret = key.split('.', 1)[1]
+    document = memory_database.get('users', ApiKey.document_key(api_key.id))
+    assert document['digest'] == api_key.digest
+    assert secret not in str(document)
+    assert store.authenticate(key, 'clusters').id == api_key.id
+
+
+def test_invalid_keys_are_rejected(store):
+    api_key, key = store.create('ci', 'admin')
+    with pytest.raises(UnAuthorizedException):
+        store.authenticate(key + 'x', 'clusters')
+    with pytest.raises(UnAuthorizedException):
+        store.authenticate(f"{API_KEY_PREFIX}unknown.{key.split('.', 1)[1]}", 'clusters')
+    # a key is only valid with the HMAC secret it was created with
+    other = ApiKeyStore()
+    other.configure('other-secret')
+    other.keys = dict(store.keys)
+    with pytest.raises(UnAuthorizedException):
+        other.authenticate(key, 'clusters')
+
+
+def test_disabled_store_rejects_the_keys():
+    store = ApiKeyStore()
+    with pytest.raises(ApiKeysDisabledException):
+        store.create('ci')
+    with pytest.raises(UnAuthorizedException):
+        store.authenticate(f"{API_KEY_PREFIX}id.secret", 'clusters')
+
+
+def test_scopes_limit_the_namespaces(store, client):
+    _, scoped = store.create('monitoring', 'admin', ['jobs'])
+    _, unscoped = store.create('ci', 'admin')
+    assert client.get('/jobs', headers={'Authorization': scoped}).status_code == 200
+    response = client.get('/clusters', headers={'Authorization': scoped})
+    assert response.status_code == 401
+    assert response.get_json()['error'] == 'The API key has no access to the clusters routes'
+    assert client.get('/clusters', headers={'Authorization': unscoped}).status_code == 200
+
+
+def test_key_role_is_checked(store, client):
+    _, key = store.create('reader', 'user')
+    assert client.get('/jobs', headers={'Authorization': key}).status_code == 401
+
+
+def test_revoked_key_is_rejected_right_away(store, client):
+    api_key, key = store.create('ci', 'admin')
+    assert client.get('/jobs', headers={'Authorization': key}).status_code == 200
+    store.revoke(api_key.id)
+    assert client.get('/jobs', headers={'Authorization': key}).status_code == 401
+    with pytest.raises(DatabaseDocumentNotFoundException):
+        store.revoke(api_key.id)
+
+
+def test_key_revoked_by_another_process_is_rejected_after_a_refresh(store, memory_database):
+    api_key, key = store.create('ci', 'admin')
+    # the key is loaded by the refresh once the database returns it
+    store.refresh()
+    memory_database.remove('users', ApiKey.document_key(api_key.id))
+    assert store.authenticate(key, 'jobs').id == api_key.id
+    store.refresh()
+    with pytest.raises(UnAuthorizedException):
+        store.authenticate(key, 'jobs')
+
+
+def test_key_created_by_another_process_is_loaded_by_a_refresh(store):
+    other = ApiKeyStore()
+    other.configure('hmac-secret')
+    api_key, key = other.create('ci', 'admin')
+    with pytest.raises(UnAuthorizedException):
+        store.authenticate(key, 'jobs')
+    store.refresh()
+    assert store.authenticate(key, 'jobs').id == api_key.id
+
+
+def test_usage_is_counted_and_saved(store, memory_database):
+    api_key, key = store.create('ci', 'admin')
+    for _ in range(3):
+        store.authenticate(key, 'jobs')
+    listed = store.list()
+    assert listed[0]['usage']['requests'] == 3
+    assert 'digest' not in listed[0]
+    store.flush_usage()
+    assert memory_database.get('users', ApiKey.document_key(api_key.id))['usage']['requests'] == 3
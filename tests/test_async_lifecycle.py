@@ -0,0 +1,67 @@
+# Description: Tests of the cancellation of the asyncio variants of the lifecycle functions.
+import asyncio
+import threading
+import pytest
+from shared.core import async_lifecycle
+from utils import cancellation
+from utils.cancellation import CancellationToken, cancellable
+from utils.exceptions import JobCancelledException
+
+
+@pytest.fixture
+def slow_delete(monkeypatch):
+    """
+    Replace delete_cluster with a function waiting on a GCP operation until it is cancelled.
+    """
+    calls = {'started': threading.Event(), 'stopped': threading.Event()}
+
+    def delete_cluster(project, cluster_name, region):
+        calls['started'].set()
+        try:
+            cancellation.sleep(30)
+        except JobCancelledException:
+            cancellation.record_half_done(f"cluster {cluster_name}", "deletion still running on GCP")
+            calls['stopped'].set()
+            raise
+        return cluster_name
+
+    monkeypatch.setattr(async_lifecycle, 'delete_cluster', delete_cluster)
+    return calls
+
+
+def test_cancelling_the_task_cancels_the_lifecycle(slow_delete):
+    parent = CancellationToken()
+
+    async def main():
+        task = asyncio.create_task(async_lifecycle.delete_cluster_async(None, 'cluster', 'europe-west1'))
+        await asyncio.to_thread(slow_delete['started'].wait, 5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    with cancellable(parent):
+        asyncio.run(main())
+    # the worker thread stops at its next wait and reports the half-done cluster to the caller
+    assert slow_delete['stopped'].wait(5)
+    assert parent.resources == [{'resource': 'cluster cluster', 'state': 'deletion still running on GCP'}]
+
+
+def test_cancelling_the_caller_cancels_the_lifecycle(slow_delete):
+    parent = CancellationToken()
+
+    async def main():
+        task = asyncio.create_task(async_lifecycle.delete_cluster_async(None, 'cluster', 'europe-west1'))
+        await asyncio.to_thread(slow_delete['started'].wait, 5)
+        parent.cancel()
+        with pytest.raises(JobCancelledException):
+            await task
+
+    with cancellable(parent):
+        asyncio.run(main())
+    assert slow_delete['stopped'].is_set()
+
+
+def test_run_concurrently_returns_the_results_in_order(monkeypatch):
+    monkeypatch.setattr(async_lifecycle, 'delete_cluster', lambda project, cluster_name, region: cluster_name)
+    calls = [async_lifecycle.delete_cluster_async(None, f'cluster-{index}', 'europe-west1') for index in range(5)]
+    assert async_lifecycle.run(async_lifecycle.run_concurrently(calls, max_concurrency=2)) == [f'cluster-{index}' for index in range(5)]
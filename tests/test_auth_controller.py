@@ -0,0 +1,97 @@
+# Description: Tests of the registration, the lookup of the users by username, and the deletion and role change of the users.
+import time
+import pytest
+from flask import Flask
+from api.config import Config
+from api.internal import auth_controller
+from api.extensions import user_cache
+from api.internal.auth_controller import register_user, get_user_by_username, username_key, login_user, delete_user, update_user_role
+from api.internal.utils import check_token
+from api.models.user import User
+from utils.exceptions import UserAlreadyExistsException, UserDoesNotExistException, InvalidRoleException, UnAuthorizedException
+from utils.password_hasher import password_hasher
+
+
+@pytest.fixture(autouse=True)
+def app():
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config['PASSWORD_HASH_WORKERS'] = 0
+    password_hasher.init_app(app)
+    with app.app_context():
+        yield app
+
+
+def test_username_can_only_be_registered_once():
+    register_user(User('alice', 'password'))
+    with pytest.raises(UserAlreadyExistsException):
+        register_user(User('alice', 'other-password'))
+
+
+def test_reservation_of_a_missing_user_is_taken_over(memory_database):
+    # left by a registration that crashed before inserting its user
+    memory_database.insert_if_absent('users', username_key('bob'), {'user_id': 'missing', 'reserved_at': time.time() - 3600})
+    user = User('bob', 'password')
+    register_user(user)
+    assert get_user_by_username('bob')['id'] == user.id
+
+
+def test_recent_reservation_is_left_to_its_registration(memory_database):
+    memory_database.insert_if_absent('users', username_key('carol'), {'user_id': 'in-progress', 'reserved_at': time.time()})
+    with pytest.raises(UserAlreadyExistsException):
+        register_user(User('carol', 'password'))
+
+
+def test_query_fallback_can_be_disabled(app, memory_database, monkeypatch):
+    # a user registered before the username key documents
+    memory_database.insert('users', 'legacy', User('dave', 'password', id='legacy').to_dict())
+    assert get_user_by_username('dave')['id'] == 'legacy'
+    memory_database.remove('users', username_key('dave'))
+    app.config['USERNAME_QUERY_FALLBACK'] = False
+    monkeypatch.setattr(memory_database.backend, 'find', lambda *args, **kwargs: pytest.fail("unexpected query"))
+    assert get_user_by_username('dave') is None
+    assert get_user_by_username('unknown') is None
+
+
+def test_deleted_user_tokens_are_rejected_right_away(memory_database):
+    user = User('erin', 'password')
+    register_user(user)
+    token = login_user('erin', 'password')
+    assert check_token(token).id == user.id
+    assert check_token(token).id == user.id
+    assert user_cache.stats()['hits'] == 1
+    delete_user(user.id)
+    with pytest.raises(UnAuthorizedException):
+        check_token(token)
+    # the username can be registered again
+    assert not memory_database.check('users', username_key('erin'))
+    register_user(User('erin', 'password'))
+
+
+def test_role_change_applies_to_the_cached_tokens():
+    user = User('frank', 'password')
+    register_user(user)
+    token = login_user('frank', 'password')
+    assert check_token(token).role == 'user'
+    update_user_role(user.id, 'admin')
+    assert check_token(token).role == 'admin'
+
+
+def test_invalid_role_is_rejected(memory_database):
+    user = User('grace', 'password')
+    register_user(user)
+    with pytest.raises(InvalidRoleException):
+        update_user_role(user.id, 'superuser')
+    assert memory_database.get('users', user.id)['role'] == 'user'
+
+
+def test_documents_that_are_not_users_are_left_untouched(memory_database):
+    register_user(User('heidi', 'password'))
+    key = username_key('heidi')
+    with pytest.raises(UserDoesNotExistException):
+        delete_user(key)
+    with pytest.raises(UserDoesNotExistException):
+        update_user_role(key, 'admin')
+    assert 'role' not in memory_database.get('users', key)
+    with pytest.raises(UserDoesNotExistException):
+        delete_user('missing')
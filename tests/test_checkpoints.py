@@ -0,0 +1,54 @@
+# Description: Tests of the step checkpoints of the cluster pipelines: resume after the completed steps and fingerprint of the cluster definition.
+from api.internal.threads import checkpoint_document, load_cluster_checkpoint, clear_cluster_checkpoint
+from shared.core.steps import StepCheckpoint
+
+
+CLUSTER_JSON = {'name': 'cluster', 'size': 3}
+
+
+def run_pipeline(checkpoint, calls):
+    def step_function(name):
+        def function():
+            calls.append(name)
+            return {'name': f"{name}-resource"}
+        return function
+    return [checkpoint.run(name, step_function(name)) for name in ('create_template', 'create_mig', 'create_firewall')]
+
+
+def save_failed_run(memory_database, operation_name, outputs):
+    memory_database.insert('clusters', 'cluster', dict(CLUSTER_JSON, checkpoint=checkpoint_document(operation_name, CLUSTER_JSON, outputs)))
+
+
+def test_completed_steps_are_skipped_and_their_output_reused():
+    calls = []
+    checkpoint = StepCheckpoint({'create_template': {'name': 'saved-template'}})
+    results = run_pipeline(checkpoint, calls)
+    assert calls == ['create_mig', 'create_firewall']
+    assert results[0] == {'name': 'saved-template'}
+    assert checkpoint.completed_steps() == ['create_template', 'create_mig', 'create_firewall']
+
+
+def test_failed_run_is_resumed_with_the_same_definition(memory_database):
+    save_failed_run(memory_database, 'create_cluster', {'create_template': {'name': 'saved-template'}})
+    calls = []
+    run_pipeline(load_cluster_checkpoint('cluster', 'create_cluster', CLUSTER_JSON), calls)
+    assert calls == ['create_mig', 'create_firewall']
+    # every completed step is saved on the cluster document
+    saved = memory_database.get('clusters', 'cluster')['checkpoint']
+    assert list(saved['outputs']) == ['create_template', 'create_mig', 'create_firewall']
+    clear_cluster_checkpoint('cluster')
+    assert 'checkpoint' not in memory_database.get('clusters', 'cluster')
+
+
+def test_checkpoint_of_another_definition_is_not_resumed(memory_database):
+    save_failed_run(memory_database, 'create_cluster', {'create_template': {'name': 'saved-template'}})
+    calls = []
+    run_pipeline(load_cluster_checkpoint('cluster', 'create_cluster', dict(CLUSTER_JSON, size=5)), calls)
+    assert calls == ['create_template', 'create_mig', 'create_firewall']
+
+
+def test_checkpoint_of_another_operation_is_not_resumed(memory_database):
+    save_failed_run(memory_database, 'update_cluster', {'create_template': {'name': 'saved-template'}})
+    calls = []
+    run_pipeline(load_cluster_checkpoint('cluster', 'create_cluster', CLUSTER_JSON), calls)
+    assert calls == ['create_template', 'create_mig', 'create_firewall']
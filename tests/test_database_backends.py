@@ -0,0 +1,130 @@
+# Description: Contract of the embedded database backends, the SQLite backend must behave like the in-memory backend used by the other tests.
+import datetime
+import time
+import pytest
+from api.internal.memory_database import MemoryDatabase
+from api.internal.sqlite_database import SQLiteDatabase
+from utils.exceptions import DatabaseConflictException, DatabaseDocumentNotFoundException
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path):
+    backend = MemoryDatabase() if request.param == 'memory' else SQLiteDatabase(str(tmp_path / 'database.sqlite'))
+    backend.connect()
+    return backend
+
+
+def test_get_missing_document(backend):
+    with pytest.raises(DatabaseDocumentNotFoundException):
+        backend.get('jobs', 'job')
+    assert not backend.check('jobs', 'job')
+
+
+def test_upsert_and_replace_with_cas(backend):
+    backend.upsert('jobs', 'job', {'status': 'PENDING'})
+    document, cas = backend.get_with_cas('jobs', 'job')
+    assert document == {'status': 'PENDING'}
+    new_cas = backend.replace_with_cas('jobs', 'job', {'status': 'RUNNING'}, cas)
+    assert new_cas != cas
+    with pytest.raises(DatabaseConflictException):
+        backend.replace('jobs', 'job', {'status': 'FAILED'}, cas=cas)
+    assert backend.get('jobs', 'job') == {'status': 'RUNNING'}
+    with pytest.raises(DatabaseDocumentNotFoundException):
+        backend.replace('jobs', 'other', {'status': 'RUNNING'})
+
+
+def test_insert_if_absent(backend):
+    assert backend.insert_if_absent('users', 'username::alice', {'user_id': '1'})
+    assert not backend.insert_if_absent('users', 'username::alice', {'user_id': '2'})
+    assert backend.get('users', 'username::alice') == {'user_id': '1'}
+
+
+def test_insert_if_absent_after_expiry(backend):
+    assert backend.insert_if_absent('jobs', 'job-lock::key', {'job_id': 'job-1'}, expiry=datetime.timedelta(seconds=0.2))
+    assert not backend.insert_if_absent('jobs', 'job-lock::key', {'job_id': 'job-2'})
+    time.sleep(0.3)
+    assert not backend.check('jobs', 'job-lock::key')
+    assert backend.insert_if_absent('jobs', 'job-lock::key', {'job_id': 'job-2'})
+    assert backend.get('jobs', 'job-lock::key') == {'job_id': 'job-2'}
+
+
+def test_mutate_in(backend):
+    backend.upsert('jobs', 'job', {'status': 'PENDING', 'steps': {'create': 'done'}})
+    _, cas = backend.get_with_cas('jobs', 'job')
+    backend.mutate_in('jobs', 'job', fields={'status': 'RUNNING', 'steps.resize': 'pending'}, appends={'history': ['RUNNING']}, increments={'attempts': 1}, cas=cas)
+    backend.mutate_in('jobs', 'job', appends={'history': ['COMPLETED']}, increments={'attempts': 2})
+    assert backend.get('jobs', 'job') == {
+        'status': 'RUNNING',
+        'steps': {'create': 'done', 'resize': 'pending'},
+        'history': ['RUNNING', 'COMPLETED'],
+        'attempts': 3
+    }
+    with pytest.raises(DatabaseConflictException):
+        backend.mutate_in('jobs', 'job', fields={'status': 'FAILED'}, cas=cas)
+    with pytest.raises(DatabaseDocumentNotFoundException):
+        backend.mutate_in('jobs', 'other', fields={'status': 'FAILED'})
+    backend.mutate_in('jobs', 'other', increments={'attempts': 1}, create_document=True)
+    assert backend.get('jobs', 'other') == {'attempts': 1}
+
+
+def test_mutate_in_keeps_the_expiry(backend):
+    backend.insert_if_absent('jobs', 'job-lock::key', {'job_id': 'job'}, expiry=datetime.timedelta(seconds=0.2))
+    backend.mutate_in('jobs', 'job-lock::key', fields={'owner': 'worker'})
+    time.sleep(0.3)
+    assert not backend.check('jobs', 'job-lock::key')
+
+
+def test_remove(backend):
+    backend.upsert_multi('jobs', {'a': {'n': 1}, 'b': {'n': 2}})
+    backend.remove('jobs', 'a')
+    with pytest.raises(DatabaseDocumentNotFoundException):
+        backend.remove('jobs', 'a')
+    assert backend.remove_multi('jobs', ['a', 'b']) == ['b']
+    assert backend.get_multi('jobs', ['a', 'b']) == {}
+
+
+def test_find_conditions(backend):
+    backend.upsert_multi('jobs', {
+        'a': {'status': 'FAILED', 'size': 1, 'cluster': {'name': 'x'}},
+        'b': {'status': 'COMPLETED', 'size': 2, 'cluster': {'name': 'y'}},
+        'c': {'status': 'FAILED', 'size': 3, 'cluster': {'name': 'x'}, 'message': None},
+        'd': {'day': '2020-01-01'}
+    })
+
+    def keys(conditions):
+        return sorted(key for key, _ in backend.find('jobs', conditions))
+
+    assert keys([('status', '=', 'FAILED')]) == ['a', 'c']
+    assert keys([('cluster.name', '=', 'x'), ('size', '>', 1)]) == ['c']
+    assert keys([('size', '<=', 2)]) == ['a', 'b']
+    assert keys([('status', 'in', ['COMPLETED', 'CANCELLED'])]) == ['b']
+    assert keys([('status', 'exists', None)]) == ['a', 'b', 'c']
+    # a field holding null exists
+    assert keys([('message', 'exists', None)]) == ['c']
+    assert backend.measure('jobs', [('status', '=', 'FAILED')])['items'] == 2
+
+
+def test_find_order_and_pages(backend):
+    backend.upsert_multi('jobs', {
+        'a': {'created_at': '2020-01-01'},
+        'b': {'created_at': '2020-01-02'},
+        'c': {'created_at': '2020-01-02'},
+        'd': {'created_at': '2020-01-03'},
+        'e': {'created_at': None},
+        'f': {'name': 'f'}
+    })
+    rows = backend.find('jobs', order_by=['created_at'], descending=True)
+    # the documents without a value to sort by are left out, the key breaks the ties
+    assert [key for key, _ in rows] == ['d', 'c', 'b', 'a']
+    page = backend.find('jobs', order_by=['created_at'], descending=True, limit=2, after=['2020-01-02', 'c'])
+    assert [key for key, _ in page] == ['b', 'a']
+    page = backend.find('jobs', order_by=['created_at'], limit=2, after=['2020-01-02', 'b'])
+    assert [key for key, _ in page] == ['c', 'd']
+
+
+def test_find_skips_the_expired_documents(backend):
+    backend.upsert('jobs', 'kept', {'status': 'FAILED'})
+    backend.insert_if_absent('jobs', 'expired', {'status': 'FAILED'}, expiry=datetime.timedelta(seconds=0.2))
+    time.sleep(0.3)
+    assert [key for key, _ in backend.find('jobs', [('status', '=', 'FAILED')])] == ['kept']
+    assert backend.measure('jobs')['items'] == 1
@@ -0,0 +1,92 @@
+# Description: Tests of the JobExecutor: lock key ordering, rejections and queue positions.
+import threading
+import time
+import pytest
+from api.internal.executor import JobExecutor
+from utils.exceptions import JobQueueFullException, JobExecutorUnavailableException
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def executor():
+    executor = JobExecutor()
+    yield executor
+    executor.shutdown()
+
+
+def test_jobs_with_the_same_lock_key_run_in_submission_order(executor):
+    executor.start(4, 16)
+    started = []
+    release = threading.Event()
+
+    def job(name):
+        started.append(name)
+        if name == 'first':
+            release.wait(5)
+
+    positions = [executor.submit(name, job, name, lock_key=('project', 'region', 'cluster')) for name in ('first', 'second', 'third')]
+    assert positions == [0, 1, 2]
+    # the other jobs wait for the key even with idle workers
+    wait_until(lambda: started == ['first'])
+    time.sleep(0.05)
+    assert started == ['first']
+    release.set()
+    wait_until(lambda: executor.stats()['completed'] == 3)
+    assert started == ['first', 'second', 'third']
+    assert executor.stats()['locked_keys'] == 0
+
+
+def test_jobs_with_different_lock_keys_run_in_parallel(executor):
+    executor.start(2, 16)
+    barrier = threading.Barrier(2, timeout=5)
+    executor.submit('a', barrier.wait, lock_key='cluster-a')
+    executor.submit('b', barrier.wait, lock_key='cluster-b')
+    wait_until(lambda: executor.stats()['completed'] == 2)
+    assert not barrier.broken
+
+
+def test_submit_is_rejected_when_the_queue_is_full(executor):
+    executor.start(1, 1)
+    release = threading.Event()
+    executor.submit('running', release.wait, 5)
+    wait_until(lambda: executor.stats()['active'] == 1)
+    executor.submit('queued', lambda: None)
+    with pytest.raises(JobQueueFullException):
+        executor.submit('rejected', lambda: None)
+    release.set()
+    assert executor.stats()['rejected'] == 1
+
+
+def test_submit_is_rejected_when_the_executor_is_not_running():
+    executor = JobExecutor()
+    with pytest.raises(JobExecutorUnavailableException):
+        executor.submit('job', lambda: None)
+
+
+def test_positions_are_saved_outside_of_the_lock_and_in_order(executor):
+    positions = []
+
+    def on_position_change(job_id, position):
+        # the listener must be able to use the executor, it would deadlock if the condition was held
+        checker = threading.Thread(target=executor.stats)
+        checker.start()
+        checker.join(1)
+        assert not checker.is_alive()
+        positions.append((job_id, position))
+
+    executor.on_position_change = on_position_change
+    executor.start(1, 16)
+    release = threading.Event()
+    executor.submit('first', release.wait, 5, lock_key='cluster')
+    executor.submit('second', lambda: None, lock_key='cluster')
+    executor.submit('third', lambda: None, lock_key='cluster')
+    release.set()
+    wait_until(lambda: executor.stats()['completed'] == 3)
+    assert positions == [('second', 1), ('third', 2), ('second', None), ('third', 1), ('third', None)]
+    assert executor.position_versions == {}
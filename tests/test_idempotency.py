@@ -0,0 +1,97 @@
+# Description: Tests of the `idempotent` decorator of the mutating routes: replay, conflicts and scope of the keys.
+import threading
+import pytest
+from flask import Flask
+from api.internal import utils
+from api.internal.utils import admin_required, idempotent
+from api.models.api_key import ApiKey
+
+
+@pytest.fixture
+def app(monkeypatch):
+    # the token is the id of the admin API key authenticated by `admin_required`
+    monkeypatch.setattr(utils, 'check_token', lambda token: ApiKey('client', role='admin', id=token))
+    app = Flask(__name__)
+    app.config['IDEMPOTENCY_KEY_TTL'] = 60
+    app.calls = []
+    app.started = threading.Event()
+    app.release = threading.Event()
+    app.release.set()
+
+    @app.route('/clusters', methods=['POST'])
+    @admin_required
+    @idempotent
+    def create_cluster():
+        app.calls.append(1)
+        app.started.set()
+        app.release.wait(5)
+        return {'name': f"job-{len(app.calls)}"}, 201
+
+    return app
+
+
+def post(client, key, token='admin', body=None):
+    return client.post('/clusters', json=body or {'name': 'cluster'}, headers={'Authorization': token, 'Idempotency-Key': key})
+
+
+def test_retried_request_replays_the_first_response(app):
+    client = app.test_client()
+    first = post(client, 'key')
+    retry = post(client, 'key')
+    assert first.status_code == retry.status_code == 201
+    assert retry.get_json() == first.get_json() == {'name': 'job-1'}
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert len(app.calls) == 1
+
+
+def test_key_reused_with_other_parameters_is_rejected(app):
+    client = app.test_client()
+    post(client, 'key')
+    assert post(client, 'key', body={'name': 'other'}).status_code == 422
+    assert len(app.calls) == 1
+
+
+def test_request_in_progress_with_the_same_key_is_rejected(app):
+    app.release.clear()
+    responses = []
+    first = threading.Thread(target=lambda: responses.append(post(app.test_client(), 'key')))
+    first.start()
+    try:
+        assert app.started.wait(5)
+        assert post(app.test_client(), 'key').status_code == 409
+    finally:
+        app.release.set()
+        first.join(5)
+    assert responses[0].status_code == 201
+    assert len(app.calls) == 1
+
+
+def test_keys_are_scoped_to_the_caller(app):
+    client = app.test_client()
+    assert post(client, 'key', token='admin-a').get_json() == {'name': 'job-1'}
+    assert post(client, 'key', token='admin-b').get_json() == {'name': 'job-2'}
+    assert len(app.calls) == 2
+
+
+def test_response_is_returned_when_it_cant_be_saved(app, memory_database, monkeypatch):
+    mutate_in = memory_database.backend.mutate_in
+
+    def failing_mutate_in(bucket, *args, **kwargs):
+        if bucket == utils.IDEMPOTENCY_BUCKET:
+            raise RuntimeError("database unavailable")
+        return mutate_in(bucket, *args, **kwargs)
+
+    monkeypatch.setattr(memory_database.backend, 'mutate_in', failing_mutate_in)
+    client = app.test_client()
+    response = post(client, 'key')
+    assert response.status_code == 201
+    assert response.get_json() == {'name': 'job-1'}
+    # the job started, the retries must not start another one
+    assert post(client, 'key').status_code == 409
+    assert len(app.calls) == 1
+
+
+def test_idempotency_records_are_kept_out_of_the_jobs_bucket(app, memory_database):
+    post(app.test_client(), 'key')
+    assert memory_database.find('jobs') == []
+    assert len(memory_database.find(utils.IDEMPOTENCY_BUCKET)) == 1
@@ -0,0 +1,42 @@
+# Description: Tests of the JobArchiver compaction into per-day summary documents.
+import pytest
+from api.internal.job_archiver import JobArchiver
+
+
+@pytest.fixture
+def archiver(memory_database):
+    for index in range(3):
+        memory_database.insert('jobs', f"job-{index}", {
+            'name': f"job-{index}",
+            'type': 'create_cluster',
+            'status': 'COMPLETED',
+            'created_at': f"2020-01-01T00:00:0{index}"
+        })
+    archiver = JobArchiver()
+    archiver.configure(0, 'couchbase', archive_after_seconds=0)
+    return archiver
+
+
+def test_jobs_are_compacted_into_a_daily_summary(archiver, memory_database):
+    assert archiver.run_once() == {'archived': 3, 'failed': 0}
+    summary = memory_database.get('jobs', 'jobs-archive::2020-01-01')
+    assert summary['total'] == 3
+    assert summary['statuses'] == {'COMPLETED': 3}
+    assert memory_database.find('jobs', [('created_at', 'exists', None)]) == []
+
+
+def test_failed_removal_doesnt_archive_the_jobs_twice(archiver, memory_database, monkeypatch):
+    def failing_remove_multi(bucket, keys):
+        raise RuntimeError("database unavailable")
+
+    monkeypatch.setattr(memory_database.backend, 'remove_multi', failing_remove_multi)
+    archiver.run_once()
+    assert archiver.stats()['last_error'] is not None
+    monkeypatch.undo()
+    assert archiver.run_once()['archived'] == 3
+    summary = memory_database.get('jobs', 'jobs-archive::2020-01-01')
+    assert summary['total'] == 3
+    assert summary['types'] == {'create_cluster': 3}
+    assert len(summary['jobs']) == 3
+    # the error is cleared by the successful run
+    assert archiver.stats()['last_error'] is None
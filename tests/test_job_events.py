@@ -0,0 +1,56 @@
+# Description: Tests of the Server-Sent Events of the jobs and of their resume with `Last-Event-ID`.
+import pytest
+from flask import Flask
+from api import api_blueprint
+from api.extensions import job_events
+from api.internal import utils
+from api.internal.jobs_controller import add_job
+from api.internal.job_events import JobEventBus
+from api.models.api_key import ApiKey
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(utils, 'check_token', lambda token: ApiKey('client', role='admin', id=token))
+    app = Flask(__name__)
+    app.register_blueprint(api_blueprint)
+    return app.test_client()
+
+
+def event_ids(body):
+    return [int(line[len('id: '):]) for line in body.splitlines() if line.startswith('id: ')]
+
+
+def test_wait_returns_the_events_after_the_last_event_id():
+    bus = JobEventBus()
+    for index in range(3):
+        bus.publish('job', 'log', {'message': f"line {index}"})
+    events, finished = bus.wait('job', 1, timeout=0)
+    assert [event['id'] for event in events] == [2, 3]
+    assert not finished
+    bus.publish('job', 'status', {'status': 'COMPLETED'})
+    events, finished = bus.wait('job', 3, timeout=0)
+    assert [event['id'] for event in events] == [4]
+    assert finished
+
+
+def test_stream_resumes_after_the_last_event_id(client):
+    # the job publishes its PENDING status when it is inserted
+    add_job('job', 'cluster', 'create_cluster', 'PENDING', 'project')
+    job_events.publish('job', 'log', {'message': "creating the template"})
+    job_events.publish_status('job', {'status': 'COMPLETED'})
+    first = client.get('/api/v1/jobs/job/events', headers={'Authorization': 'admin'})
+    assert first.mimetype == 'text/event-stream'
+    ids = event_ids(first.get_data(as_text=True))
+    assert len(ids) == 3
+    resumed = client.get('/api/v1/jobs/job/events', headers={'Authorization': 'admin', 'Last-Event-ID': str(ids[0])})
+    body = resumed.get_data(as_text=True)
+    assert event_ids(body) == ids[1:]
+    assert 'COMPLETED' in body
+    # the query parameter is accepted by the clients that can't set headers
+    resumed = client.get(f"/api/v1/jobs/job/events?last_event_id={ids[1]}", headers={'Authorization': 'admin'})
+    assert event_ids(resumed.get_data(as_text=True)) == ids[2:]
+
+
+def test_stream_of_an_unknown_job_is_not_found(client):
+    assert client.get('/api/v1/jobs/unknown/events', headers={'Authorization': 'admin'}).status_code == 404
@@ -0,0 +1,117 @@
+# Description: Tests of the DurableJobQueue: claims, lock keys, lease expiry and heartbeats. The queue runs N1QL statements, the
+# in-memory backend of the tests answers them in python and records the scan consistency they were run with.
+from types import SimpleNamespace
+import pytest
+from api.extensions import database
+from api.internal.job_queue import DurableJobQueue, lock_document_id
+from api.internal.jobs_controller import add_job, update_job_status
+from api.internal.memory_database import MemoryDatabase
+
+
+class QueueMemoryDatabase(MemoryDatabase):
+    supports_query = True
+
+    def __init__(self):
+        super().__init__()
+        self.scan_consistencies = []
+
+    def query(self, statement, scan_consistency=None, **params):
+        self.scan_consistencies.append(scan_consistency)
+        jobs = [(key, job) for key, job in self.find('jobs') if job.get('queued')]
+        if statement.startswith("SELECT META().id"):
+            claimable = [(key, job) for key, job in jobs if job['status'] == 'PENDING' or
+                (job['status'] in ('RUNNING', 'CANCELLING') and job['lease_expires_at'] < params['now'])]
+            claimable.sort(key=lambda row: (row[1].get('priority_rank', 1), row[1]['created_at']))
+            return [{'id': key} for key, _ in claimable[:params['limit']]]
+        if statement.startswith("SELECT COUNT(*)") and 'lock_key' in statement:
+            count = sum(1 for key, job in jobs if job['lock_key'] == params['lock_key'] and key != params['job_id'] and (
+                (job['status'] in ('RUNNING', 'CANCELLING') and job['lease_expires_at'] >= params['now']) or
+                (job['status'] == 'PENDING' and job['created_at'] < params['created_at'])))
+            return [{'count': count}]
+        raise NotImplementedError(statement)
+
+
+@pytest.fixture
+def queue():
+    database.backend = QueueMemoryDatabase()
+    queue = DurableJobQueue()
+    queue.configure(True, 60, 2)
+    return queue
+
+
+def enqueue(queue, job_id, lock_key=None, priority='normal'):
+    gcp_project = SimpleNamespace(project_id='project', project_number='1')
+    fields = queue.queue_fields('create_cluster', gcp_project, lock_key, {}, priority)
+    add_job(job_id, 'cluster', 'create_cluster', 'PENDING', 'project', fields)
+
+
+def expire_lease(job_id):
+    database.mutate_in('jobs', job_id, {'lease_expires_at': 0})
+
+
+def test_jobs_are_claimed_by_priority_then_creation_order(queue):
+    enqueue(queue, 'create', priority='low')
+    enqueue(queue, 'delete', priority='high')
+    enqueue(queue, 'update')
+    assert [job['name'] for job in queue.claim('worker', 3)] == ['delete', 'update', 'create']
+    assert queue.claim('other-worker', 3) == []
+
+
+def test_queue_queries_wait_for_the_indexes(queue):
+    enqueue(queue, 'job', lock_key=('project', 'region', 'cluster'))
+    queue.claim('worker', 1)
+    assert database.scan_consistencies
+    assert set(database.scan_consistencies) == {'request_plus'}
+
+
+def test_jobs_with_the_same_lock_key_run_one_at_a_time(queue):
+    lock_key = ('project', 'region', 'cluster')
+    enqueue(queue, 'first', lock_key=lock_key)
+    enqueue(queue, 'second', lock_key=lock_key)
+    first, = queue.claim('worker-a', 2)
+    assert first['name'] == 'first'
+    assert queue.claim('worker-b', 2) == []
+    update_job_status('first', 'COMPLETED')
+    queue.release(first)
+    assert [job['name'] for job in queue.claim('worker-b', 2)] == ['second']
+
+
+def test_lock_document_serializes_the_claims_missed_by_the_query(queue, monkeypatch):
+    lock_key = ('project', 'region', 'cluster')
+    enqueue(queue, 'first', lock_key=lock_key)
+    enqueue(queue, 'second', lock_key=lock_key)
+    queue.claim('worker-a', 1)
+    # the query doesn't see the running job, e.g. the claims of two workers racing
+    monkeypatch.setattr(queue, '_DurableJobQueue__lock_key_busy', lambda job, now: False)
+    assert queue.claim('worker-b', 2) == []
+    assert database.get('jobs', lock_document_id(lock_key))['job_id'] == 'first'
+
+
+def test_job_with_an_expired_lease_is_claimed_again(queue):
+    lock_key = ('project', 'region', 'cluster')
+    enqueue(queue, 'job', lock_key=lock_key)
+    queue.claim('worker-a', 1)
+    expire_lease('job')
+    job, = queue.claim('worker-b', 1)
+    assert job['lease_owner'] == 'worker-b'
+    assert job['attempts'] == 2
+    assert database.get('jobs', lock_document_id(lock_key))['owner'] == 'worker-b'
+
+
+def test_job_whose_lease_expired_too_many_times_fails(queue):
+    enqueue(queue, 'job')
+    for worker in ('worker-a', 'worker-b'):
+        queue.claim(worker, 1)
+        expire_lease('job')
+    assert queue.claim('worker-c', 1) == []
+    assert database.get('jobs', 'job')['status'] == 'FAILED'
+
+
+def test_heartbeat_extends_the_lease_and_reports_the_lost_jobs(queue):
+    enqueue(queue, 'job')
+    job, = queue.claim('worker-a', 1)
+    database.mutate_in('jobs', 'job', {'lease_expires_at': job['lease_expires_at'] - 30})
+    assert queue.heartbeat('worker-a', ['job']) == []
+    assert database.get('jobs', 'job')['lease_expires_at'] > job['lease_expires_at'] - 30
+    # the lease has been claimed by another worker
+    assert queue.heartbeat('worker-b', ['job']) == ['job']
@@ -0,0 +1,90 @@
+# Description: Tests of the aggregation of the job and step durations and of the pagination of the job list.
+import pytest
+from api.internal.jobs_controller import percentiles, get_step_stats, get_job_list, backfill_job_created_at, decode_job_cursor
+from utils.exceptions import InvalidCursorException
+
+
+def insert_job(database, job_id, created_at=None, status='COMPLETED', **fields):
+    job = dict({'name': job_id, 'type': 'create_cluster', 'status': status, 'status_history': [{'status': 'PENDING', 'at': created_at or '2019-06-01T00:00:00'}]}, **fields)
+    if created_at:
+        job['created_at'] = created_at
+    database.insert('jobs', job_id, job)
+
+
+def test_percentiles_ignore_null_durations():
+    assert percentiles([None, 3, 1, 2]) == {'count': 3, 'p50': 2, 'p95': 3, 'p99': 3, 'max': 3}
+
+
+def test_percentiles_of_no_duration():
+    assert percentiles([]) == {'count': 0, 'p50': None, 'p95': None, 'p99': None, 'max': None}
+
+
+def test_step_stats_skip_the_null_durations(memory_database):
+    memory_database.insert('jobs', 'job', {
+        'name': 'job',
+        'type': 'create_cluster',
+        'status': 'COMPLETED',
+        'created_at': '2020-01-01T00:00:00',
+        'duration': None,
+        'steps': [{'name': 'create_template', 'status': 'completed', 'duration': None}, {'name': 'create_mig', 'status': 'completed', 'duration': 4}]
+    })
+    stats = get_step_stats()['create_cluster']
+    assert 'job' not in stats
+    assert 'create_template' not in stats['steps']
+    assert stats['steps']['create_mig']['p50'] == 4
+
+
+def test_job_list_pages_follow_the_cursor(memory_database):
+    for index in range(5):
+        insert_job(memory_database, f'job-{index}', f'2020-01-0{index + 1}T00:00:00')
+    # two jobs share the creation time of job-2, the id breaks the tie
+    insert_job(memory_database, 'job-2b', '2020-01-03T00:00:00')
+    names, cursor = [], None
+    while True:
+        jobs, cursor = get_job_list(limit=2, cursor=cursor)
+        assert len(jobs) <= 2
+        names += [job['name'] for job in jobs]
+        if cursor is None:
+            break
+    assert names == ['job-4', 'job-3', 'job-2b', 'job-2', 'job-1', 'job-0']
+
+
+def test_job_list_last_page_has_no_cursor(memory_database):
+    insert_job(memory_database, 'job-0', '2020-01-01T00:00:00')
+    insert_job(memory_database, 'job-1', '2020-01-02T00:00:00')
+    jobs, cursor = get_job_list(limit=2)
+    assert [job['name'] for job in jobs] == ['job-1', 'job-0']
+    assert cursor is None
+    jobs, cursor = get_job_list(limit=1)
+    assert decode_job_cursor(cursor) == ('2020-01-02T00:00:00', 'job-1')
+
+
+def test_job_list_filters_the_pages(memory_database):
+    insert_job(memory_database, 'job-0', '2020-01-01T00:00:00', status='FAILED')
+    insert_job(memory_database, 'job-1', '2020-01-02T00:00:00')
+    insert_job(memory_database, 'job-2', '2020-01-03T00:00:00', status='FAILED')
+    jobs, cursor = get_job_list({'status': 'FAILED', 'type': None}, limit=1)
+    assert [job['name'] for job in jobs] == ['job-2']
+    jobs, cursor = get_job_list({'status': 'FAILED'}, limit=1, cursor=cursor)
+    assert [job['name'] for job in jobs] == ['job-0']
+    assert cursor is None
+
+
+def test_job_list_rejects_a_malformed_cursor(memory_database):
+    with pytest.raises(InvalidCursorException):
+        get_job_list(cursor='not a cursor')
+
+
+def test_backfill_lists_the_jobs_without_creation_time(memory_database):
+    insert_job(memory_database, 'job-new', '2020-01-02T00:00:00')
+    insert_job(memory_database, 'job-legacy')
+    memory_database.insert('jobs', 'job-bare', {'name': 'job-bare', 'type': 'create_cluster', 'status': 'COMPLETED'})
+    # the other documents of the bucket are never listed
+    memory_database.insert('jobs', 'jobs-archive::2020-01-01', {'archive': True, 'day': '2020-01-01', 'created_at': '2020-01-09T00:00:00'})
+    memory_database.insert('jobs', 'job-lock::key', {'job_id': 'job-new', 'owner': 'worker', 'created_at': '2020-01-09T00:00:00'})
+    assert backfill_job_created_at() == 2
+    assert backfill_job_created_at() == 0
+    jobs, _ = get_job_list()
+    assert [job['name'] for job in jobs] == ['job-new', 'job-legacy', 'job-bare']
+    assert jobs[1]['created_at'] == '2019-06-01T00:00:00'
+    assert jobs[2]['created_at'] == '1970-01-01T00:00:00'
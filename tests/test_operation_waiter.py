@@ -0,0 +1,75 @@
+# Description: Tests of the OperationWaiter thread: completion, failures of the polls and retries.
+import pytest
+from google.api_core import exceptions as core_exceptions
+from utils.operation_waiter import OperationWaiter
+
+
+class FakeOperation():
+    name = 'operation'
+    error_code = 0
+    error_message = None
+    warnings = []
+
+    def __init__(self, polls=None, result='done'):
+        # values returned or raised by the successive calls of done(), True once they are consumed
+        self.polls = list(polls or [])
+        self.value = result
+
+    def done(self):
+        if not self.polls:
+            return True
+        poll = self.polls.pop(0)
+        if isinstance(poll, Exception):
+            raise poll
+        return poll
+
+    def result(self):
+        return self.value
+
+
+@pytest.fixture
+def waiter():
+    return OperationWaiter(min_interval=0.01, max_interval=0.02)
+
+
+def test_future_completes_once_the_operation_is_done(waiter):
+    future = waiter.watch(FakeOperation(polls=[False, False]))
+    assert future.result(timeout=5) == 'done'
+    assert waiter.stats()['completed'] == 1
+
+
+def test_poll_error_fails_only_its_operation(waiter):
+    failing = waiter.watch(FakeOperation(polls=[ValueError("broken")]))
+    with pytest.raises(ValueError):
+        failing.result(timeout=5)
+    # the thread is still polling the other operations
+    assert waiter.watch(FakeOperation()).result(timeout=5) == 'done'
+    assert waiter.stats()['failed'] == 1
+
+
+def test_unexpected_error_doesnt_stop_the_thread(waiter, monkeypatch):
+    operation = FakeOperation()
+    monkeypatch.setattr(operation, 'result', lambda: (_ for _ in ()).throw(RuntimeError("unexpected")))
+    # an error raised outside of the guarded calls of the poll
+    monkeypatch.setattr(FakeOperation, 'error_code', property(lambda self: 1 / 0), raising=False)
+    broken = waiter.watch(FakeOperation())
+    with pytest.raises(ZeroDivisionError):
+        broken.result(timeout=5)
+    monkeypatch.undo()
+    assert waiter.watch(FakeOperation()).result(timeout=5) == 'done'
+    assert waiter.thread.is_alive()
+
+
+def test_failing_retry_callback_doesnt_stop_the_thread(waiter):
+    def on_retry():
+        raise RuntimeError("callback error")
+
+    future = waiter.watch(FakeOperation(polls=[core_exceptions.ServiceUnavailable("unavailable")]), on_retry=on_retry)
+    assert future.result(timeout=5) == 'done'
+    assert waiter.watch(FakeOperation()).result(timeout=5) == 'done'
+
+
+def test_operation_failing_too_many_polls_fails(waiter):
+    errors = [core_exceptions.ServiceUnavailable("unavailable")] * 10
+    with pytest.raises(core_exceptions.ServiceUnavailable):
+        waiter.watch(FakeOperation(polls=errors)).result(timeout=5)
@@ -0,0 +1,62 @@
+# Description: Tests of the cancellation of the rolling update of a regional managed instance group.
+from types import SimpleNamespace
+import pytest
+from shared.lib import regional_managed_instance
+from utils.cancellation import CancellationToken, cancellable
+from utils.exceptions import JobCancelledException
+
+
+# module level function, its name isn't mangled
+apply_updates_to_instances = getattr(regional_managed_instance, '__apply_updates_to_instances')
+
+
+class Pager():
+    """
+    Iterable without indexing, like the ListManagedInstancesPager returned by the GCP client.
+    """
+    def __init__(self, items):
+        self.items = items
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+class FakeInstanceGroupManagerClient():
+    def __init__(self, instance_names):
+        self.instances = [SimpleNamespace(instance=f"projects/project/zones/zone-a/instances/{name}") for name in instance_names]
+        self.updated = []
+
+    def list_managed_instances(self, request):
+        return Pager(self.instances)
+
+    def apply_updates_to_instances(self, request):
+        self.updated.append(request.region_instance_group_managers_apply_updates_request_resource.instances[0])
+        return SimpleNamespace(name=f"operation-{len(self.updated)}")
+
+
+def run_update(client, token):
+    with cancellable(token):
+        apply_updates_to_instances(client, SimpleNamespace(project_id='project'), 'region', SimpleNamespace(name='mig'))
+
+
+def test_cancelled_update_records_the_instances_not_updated(monkeypatch):
+    client = FakeInstanceGroupManagerClient(['node-001', 'node-002', 'node-003'])
+    token = CancellationToken()
+    # the job is cancelled while the first instance is updated
+    monkeypatch.setattr(regional_managed_instance, 'wait_for_extended_operation', lambda operation, project_id: token.cancel())
+    with pytest.raises(JobCancelledException):
+        run_update(client, token)
+    assert len(client.updated) == 1
+    assert [resource['resource'] for resource in token.resources] == ['instance node-001', 'instance node-002', 'instance node-003']
+    assert token.resources[0]['state'] == "updated, startup script not verified"
+    assert all(resource['state'].startswith("not updated") for resource in token.resources[1:])
+
+
+def test_update_cancelled_before_it_starts_records_all_the_instances():
+    client = FakeInstanceGroupManagerClient(['node-001', 'node-002'])
+    token = CancellationToken()
+    token.cancel()
+    with pytest.raises(JobCancelledException):
+        run_update(client, token)
+    assert client.updated == []
+    assert [resource['resource'] for resource in token.resources] == ['instance node-001', 'instance node-002']
@@ -0,0 +1,55 @@
+# Description: Tests of the FairShareScheduler weights, quotas and priority classes, and of the parsing of the project weights.
+import pytest
+from api.config import parse_project_weights
+from api.internal.scheduler import FairShareScheduler
+
+
+def pop_projects(scheduler, count):
+    projects = []
+    for _ in range(count):
+        _, project = scheduler.pop()
+        scheduler.release(project)
+        projects.append(project)
+    return projects
+
+
+def test_projects_are_served_in_proportion_of_their_weight():
+    scheduler = FairShareScheduler(project_weights={'heavy': 3, 'light': 1}, aging_seconds=0)
+    for index in range(8):
+        scheduler.push(f"heavy-{index}", 'heavy')
+        scheduler.push(f"light-{index}", 'light')
+    projects = pop_projects(scheduler, 8)
+    assert projects.count('heavy') == 6
+    assert projects.count('light') == 2
+
+
+def test_higher_priority_class_runs_first():
+    scheduler = FairShareScheduler(aging_seconds=0)
+    scheduler.push('create', 'project', 'low')
+    scheduler.push('delete', 'project', 'high')
+    assert scheduler.pop() == ('delete', 'project')
+
+
+def test_project_quota_blocks_the_other_jobs_of_the_project():
+    scheduler = FairShareScheduler(project_quota=1)
+    scheduler.push('a1', 'a')
+    scheduler.push('a2', 'a')
+    assert scheduler.pop() == ('a1', 'a')
+    assert scheduler.pop() is None
+    scheduler.release('a')
+    assert scheduler.pop() == ('a2', 'a')
+
+
+@pytest.mark.parametrize('weight', [0, -1])
+def test_weights_not_greater_than_zero_are_rejected(weight):
+    with pytest.raises(ValueError):
+        FairShareScheduler(project_weights={'project': weight})
+    with pytest.raises(ValueError):
+        FairShareScheduler().configure(0, {'project': weight}, 300)
+
+
+def test_parse_project_weights():
+    assert parse_project_weights('a=2, b = 0.5,') == {'a': 2.0, 'b': 0.5}
+    assert parse_project_weights('') == {}
+    with pytest.raises(ValueError):
+        parse_project_weights('a=0')
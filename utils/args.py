@@ -24,6 +24,10 @@ def parse_args_from_cmdline():
 
     add_server_cmd_args(subparsers)
 
+    add_worker_cmd_args(subparsers)
+
+    add_migrate_cmd_args(subparsers)
+
     namespace = parser.parse_args()
     
     # if no command is specified, then print the help 
@@ -150,6 +154,41 @@ def add_server_cmd_args(subparsers):
     # set the function to be called when running the sub command
     server_subparser.set_defaults(command="server")
 
+# Add "worker"  subcommand and arguments
+def add_worker_cmd_args(subparsers):
+    """
+    Add the arguments for the worker subcommand
+    """
+    worker_subparser = subparsers.add_parser('worker', help='Launch a worker process that runs the jobs of the durable job queue')
+
+    # number of jobs run at the same time
+    worker_subparser.add_argument('--concurrency', dest='concurrency', default=4, help='Number of jobs run at the same time by the worker')
+
+    # lease duration
+    worker_subparser.add_argument('--lease-seconds', dest='lease_seconds', default=60, help='Duration of the lease of a claimed job, the lease is renewed while the job is running')
+
+    # maximum number of attempts
+    worker_subparser.add_argument('--max-attempts', dest='max_attempts', default=3, help='Number of times a job is claimed before being failed')
+
+    # polling interval
+    worker_subparser.add_argument('--poll-interval', dest='poll_interval', default=2, help='Seconds between two claims of the job queue')
+
+    # set the function to be called when running the sub command
+    worker_subparser.set_defaults(command="worker")
+
+# Add "migrate-db" subcommand and arguments
+def add_migrate_cmd_args(subparsers):
+    """
+    Add the arguments for the migrate-db subcommand
+    """
+    migrate_subparser = subparsers.add_parser('migrate-db', help='Create the indexes of the database')
+
+    # primary indexes
+    migrate_subparser.add_argument('--primary-indexes', dest='primary_indexes', action='store_true', help='Also create the primary indexes of the buckets, only needed for ad hoc queries')
+
+    # set the function to be called when running the sub command
+    migrate_subparser.set_defaults(command="migrate-db")
+
 def required_error_msg(arg, command):
     """
     Print the error message for a required argument
@@ -0,0 +1,146 @@
+# Description: This file contains the cooperative cancellation of the long running operations. A job runs its operation inside `cancellable(token)`,
+# the wait loops of the operations (GCP operations, managed instance group stability, serial output polling) sleep with `sleep` which raises
+# JobCancelledException as soon as the token of the current job is cancelled. The resources left half-done by a cancelled operation are recorded on the token.
+import concurrent.futures
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from loguru import logger
+from utils.exceptions import JobCancelledException
+
+
+# token of the job run by the current thread, None outside of a job (e.g. with the command line)
+current_token = contextvars.ContextVar('cancellation_token', default=None)
+
+
+class CancellationToken:
+    def __init__(self, check=None, check_interval=30):
+        """
+        Parameters:
+            check (callable): optional function returning True when the job has been cancelled by another process, it is called at most once per `check_interval`
+            check_interval (int): the seconds between two calls of `check`
+        """
+        self.event = threading.Event()
+        self.reason = None
+        self.check = check
+        self.check_interval = check_interval
+        self.last_check = time.monotonic()
+        # resources left half-done by the cancellation
+        self.resources = []
+        self.lock = threading.Lock()
+
+    def cancel(self, reason="The job has been cancelled"):
+        """
+        Cancel the job, the next wait loop of its operation raises JobCancelledException.
+        """
+        self.reason = reason
+        self.event.set()
+
+    def is_cancelled(self):
+        """
+        Check if the job has been cancelled, `check` is called if the last check is older than `check_interval`.
+        """
+        if self.event.is_set():
+            return True
+        if self.check and time.monotonic() - self.last_check >= self.check_interval:
+            self.last_check = time.monotonic()
+            try:
+                if self.check():
+                    self.cancel()
+            except Exception as e:
+                logger.warning(f"Error checking the cancellation of the job: {e}")
+        return self.event.is_set()
+
+    def raise_if_cancelled(self):
+        """
+        Raise JobCancelledException if the job has been cancelled.
+        """
+        if self.is_cancelled():
+            raise JobCancelledException(self.reason)
+
+    def sleep(self, seconds):
+        """
+        Sleep for `seconds`, the sleep is interrupted as soon as the job is cancelled.
+        Raises:
+            JobCancelledException: if the job is cancelled before or during the sleep
+        """
+        deadline = time.monotonic() + seconds
+        while True:
+            self.raise_if_cancelled()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            # wake up regularly to call `check`, `cancel` wakes up the sleep right away
+            self.event.wait(min(remaining, self.check_interval) if self.check else remaining)
+
+    def record_resource(self, resource, state):
+        """
+        Record a resource left half-done by the cancellation.
+        """
+        with self.lock:
+            self.resources.append({'resource': resource, 'state': state})
+
+
+@contextmanager
+def cancellable(token):
+    """
+    Run the code of the block with `token` as the cancellation token of the current thread.
+    """
+    reset = current_token.set(token)
+    try:
+        yield token
+    finally:
+        current_token.reset(reset)
+
+
+def sleep(seconds):
+    """
+    Sleep for `seconds`, the sleep is interrupted if the current job is cancelled.
+    Raises:
+        JobCancelledException: if the current job is cancelled
+    """
+    token = current_token.get()
+    if token is None:
+        time.sleep(seconds)
+    else:
+        token.sleep(seconds)
+
+
+def wait_future(future, poll_interval=1):
+    """
+    Wait for the result of a future, the wait is interrupted if the current job is cancelled.
+    Parameters:
+        future (concurrent.futures.Future): the future to wait for
+        poll_interval (float): the seconds between two checks of the cancellation
+    Returns:
+        the result of the future
+    Raises:
+        JobCancelledException: if the current job is cancelled, the future is left running
+    """
+    token = current_token.get()
+    if token is None:
+        return future.result()
+    while True:
+        token.raise_if_cancelled()
+        concurrent.futures.wait([future], timeout=poll_interval)
+        if future.done():
+            return future.result()
+
+
+def check_cancelled():
+    """
+    Raise JobCancelledException if the current job has been cancelled.
+    """
+    token = current_token.get()
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+def record_half_done(resource, state):
+    """
+    Record a resource left half-done by the cancellation of the current job.
+    """
+    token = current_token.get()
+    if token is not None:
+        token.record_resource(resource, state)
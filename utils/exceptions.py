@@ -85,3 +85,33 @@ class UserDoesNotExistException(InternalException):
 
 class InvalidPasswordException(InternalException):
     pass
+
+class InvalidRoleException(InternalException):
+    pass
+
+class JobQueueFullException(InternalException):
+    pass
+
+class JobExecutorUnavailableException(InternalException):
+    pass
+
+class DatabaseConflictException(InternalException):
+    pass
+
+class InvalidCursorException(InternalException):
+    pass
+
+class JobCancelledException(InternalException):
+    pass
+
+class DatabaseDocumentNotFoundException(InternalException):
+    pass
+
+class DatabaseOperationNotSupportedException(InternalException):
+    pass
+
+class PasswordHasherBusyException(InternalException):
+    pass
+
+class ApiKeysDisabledException(InternalException):
+    pass
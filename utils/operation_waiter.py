@@ -0,0 +1,208 @@
+# Description: This file contains the OperationWaiter class, a single thread that supervises all the pending GCP extended operations (managed instance groups, templates, disks, firewall rules...).
+# The operations are registered with `watch` which returns a future, the thread polls the operations that are due in rounds of at most `batch_size` operations and
+# completes their future (and callbacks) once they are done. The extended operations have no batch poll API, the operations of a round are polled one after the other.
+# An error raised while polling an operation fails the future of that operation only, the thread keeps polling the other operations. The poll interval of an operation grows from `min_interval` to `max_interval` seconds while it stays pending, so hundreds of concurrent operations
+# cost one thread and a few requests per second instead of one parked thread each.
+import concurrent.futures
+import heapq
+import itertools
+import threading
+import time
+from loguru import logger
+from google.api_core import exceptions as core_exceptions
+from utils.exceptions import GCPOperationFailedException
+
+
+# errors of the operation polls that are retried
+TRANSIENT_POLL_ERRORS = (core_exceptions.ServiceUnavailable, core_exceptions.InternalServerError, core_exceptions.TooManyRequests, core_exceptions.DeadlineExceeded)
+# number of consecutive failed polls before the error is raised
+MAX_POLL_RETRIES = 5
+
+
+class OperationWaiter():
+    # init method or constructor
+    def __init__(self, min_interval=1, max_interval=10, batch_size=50):
+        """
+        Parameters:
+            min_interval (float): the seconds before the first poll of an operation
+            max_interval (float): the maximum seconds between two polls of an operation
+            batch_size (int): the maximum number of operations polled per round (one `done()` call each), the other due operations are polled on the next round
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.batch_size = batch_size
+        # pending operations ordered by their next poll time
+        self.pending = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.polls = 0
+        self.completed = 0
+        self.failed = 0
+
+    def configure(self, max_interval, batch_size):
+        """
+        Change the maximum poll interval and the size of the poll batches, the pending operations are kept.
+        """
+        with self.condition:
+            self.max_interval = max_interval
+            self.batch_size = batch_size
+
+    def watch(self, operation, verbose_name="operation", timeout=1000, callback=None, on_retry=None):
+        """
+        Register an extended operation, the waiter thread is started on the first call.
+        Parameters:
+            operation (ExtendedOperation): the long-running operation to wait for
+            verbose_name (str): a more verbose name of the operation, used in the logs and errors
+            timeout (int): the seconds after which the future fails with a TimeoutError, None to wait indefinitely
+            callback (callable): optional function called with the future once the operation is done
+            on_retry (callable): optional function called from the waiter thread when a poll of the operation is retried
+        Returns:
+            concurrent.futures.Future: the future of the result of the operation
+        """
+        future = concurrent.futures.Future()
+        if callback is not None:
+            future.add_done_callback(callback)
+        now = time.monotonic()
+        entry = {
+            'operation': operation,
+            'verbose_name': verbose_name,
+            'future': future,
+            'deadline': now + timeout if timeout else None,
+            'interval': self.min_interval,
+            'failed_polls': 0,
+            'on_retry': on_retry
+        }
+        with self.condition:
+            heapq.heappush(self.pending, (now + self.min_interval, next(self.counter), entry))
+            self.__start()
+            self.condition.notify()
+        return future
+
+    def stats(self):
+        """
+        Get the state of the waiter.
+        Returns:
+            dict: the number of pending operations and the counters of the waiter
+        """
+        with self.condition:
+            return {
+                'pending': len(self.pending),
+                'polls': self.polls,
+                'completed': self.completed,
+                'failed': self.failed
+            }
+
+    def __start(self):
+        """
+        Start the waiter thread if it isn't running. The condition must be held by the caller.
+        """
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.__run, name="operation-waiter", daemon=True)
+            self.thread.start()
+
+    def __run(self):
+        """
+        Loop of the waiter thread: wait for the next due operations, poll them one by one and reschedule the pending ones.
+        """
+        while True:
+            with self.condition:
+                while not self.pending or self.pending[0][0] > time.monotonic():
+                    timeout = self.pending[0][0] - time.monotonic() if self.pending else None
+                    self.condition.wait(timeout)
+                batch = []
+                now = time.monotonic()
+                while self.pending and self.pending[0][0] <= now and len(batch) < self.batch_size:
+                    batch.append(heapq.heappop(self.pending)[2])
+
+            rescheduled = []
+            for entry in batch:
+                try:
+                    if self.__poll(entry):
+                        continue
+                except Exception as e:
+                    # an unexpected error fails the operation, the thread must survive to complete the other futures
+                    logger.error(f"Unexpected error polling the {entry['verbose_name']}: {e}")
+                    self.__fail(entry, e)
+                    continue
+                # the pending operations are polled less and less often
+                entry['interval'] = min(entry['interval'] * 2, self.max_interval)
+                rescheduled.append(entry)
+
+            with self.condition:
+                self.polls += len(batch)
+                now = time.monotonic()
+                for entry in rescheduled:
+                    heapq.heappush(self.pending, (now + entry['interval'], next(self.counter), entry))
+
+    def __poll(self, entry):
+        """
+        Poll an operation and complete its future if it's done, failed or timed out.
+        Returns:
+            bool: True if the operation doesn't need to be polled anymore
+        """
+        operation = entry['operation']
+        future = entry['future']
+        # the waiter of a cancelled future isn't interested in the operation anymore
+        if future.cancelled():
+            return True
+        try:
+            done = operation.done()
+            entry['failed_polls'] = 0
+        except TRANSIENT_POLL_ERRORS as e:
+            # the transient errors are retried on the next poll
+            entry['failed_polls'] += 1
+            if entry['failed_polls'] > MAX_POLL_RETRIES:
+                return self.__fail(entry, e)
+            logger.warning(f"Error polling the operation {operation.name}, retrying: {e}")
+            if entry['on_retry']:
+                try:
+                    entry['on_retry']()
+                except Exception as retry_error:
+                    logger.warning(f"Error in the retry callback of the operation {operation.name}: {retry_error}")
+            done = False
+        except Exception as e:
+            return self.__fail(entry, e)
+
+        if not done:
+            if entry['deadline'] and time.monotonic() >= entry['deadline']:
+                return self.__fail(entry, concurrent.futures.TimeoutError(f"The {entry['verbose_name']} {operation.name} didn't finish in time"))
+            return False
+
+        try:
+            result = operation.result()
+        except Exception as e:
+            return self.__fail(entry, e)
+        if operation.error_code:
+            logger.error(f"Error during {entry['verbose_name']} {operation.name}: {operation.error_message}")
+            logger.error(f"Operation ID: {operation.name}")
+            return self.__fail(entry, GCPOperationFailedException(operation.error_message))
+        if operation.warnings:
+            logger.warning(f"Warnings during {entry['verbose_name']} {operation.name}:")
+            for warning in operation.warnings:
+                logger.warning(f" - {warning.code}: {warning.message}")
+        with self.condition:
+            self.completed += 1
+        if future.set_running_or_notify_cancel():
+            future.set_result(result)
+        return True
+
+    def __fail(self, entry, exception):
+        """
+        Complete the future of an operation with an exception.
+        Returns:
+            bool: always True, the operation isn't polled anymore
+        """
+        with self.condition:
+            self.failed += 1
+        future = entry['future']
+        # the future may already be completed if the error was raised after its result was set
+        if future.done():
+            return True
+        if future.running() or future.set_running_or_notify_cancel():
+            future.set_exception(exception)
+        return True
+
+
+# waiter shared by all the GCP calls of the process
+operation_waiter = OperationWaiter()
@@ -0,0 +1,148 @@
+# Description: This file contains the PasswordHasher class, which hashes and verifies the bcrypt passwords of the users in a bounded pool of worker processes instead of on the
+# request threads. bcrypt holds the CPU for the whole hash, so a burst of logins would otherwise stall the other requests of the server. At most `workers + queue_size` passwords
+# are hashed or waiting at once, a request waiting more than `queue_timeout` seconds for a slot fails with PasswordHasherBusyException. With 0 workers the passwords are hashed inline.
+import concurrent.futures
+import multiprocessing
+import threading
+import bcrypt
+from loguru import logger
+from utils.exceptions import PasswordHasherBusyException
+
+
+def hash_password(password, rounds):
+    """
+    Hash a clear text password with bcrypt, run in the worker processes.
+    Returns:
+        str: the bcrypt hash, including its cost factor
+    """
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def check_password(password_hash, password):
+    """
+    Check a clear text password against a bcrypt hash, run in the worker processes.
+    """
+    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+
+
+class PasswordHasher():
+    # init method or constructor
+    def __init__(self, rounds=12, workers=0, queue_size=32, queue_timeout=5):
+        """
+        Parameters:
+            rounds (int): the bcrypt cost factor of the new hashes
+            workers (int): the number of worker processes, 0 hashes the passwords inline
+            queue_size (int): the maximum number of passwords waiting for a worker
+            queue_timeout (float): the maximum seconds a password waits for a slot
+        """
+        self.lock = threading.Lock()
+        self.pool = None
+        self.configure(rounds, workers, queue_size, queue_timeout)
+
+    def init_app(self, app):
+        """
+        Configure the hasher with the configuration of the flask application.
+        Parameters:
+            app: the Flask application instance.
+        """
+        self.configure(
+            app.config.get('BCRYPT_LOG_ROUNDS', 12),
+            app.config.get('PASSWORD_HASH_WORKERS', 0),
+            app.config.get('PASSWORD_HASH_QUEUE_SIZE', 32),
+            app.config.get('PASSWORD_HASH_QUEUE_TIMEOUT', 5)
+        )
+
+    def configure(self, rounds, workers, queue_size, queue_timeout):
+        """
+        Change the cost factor and the size of the pool, the pool is started again on its next use.
+        """
+        with self.lock:
+            self.rounds = rounds
+            self.workers = workers
+            self.queue_size = queue_size
+            self.queue_timeout = queue_timeout
+            # a slot per running or waiting password
+            self.slots = threading.BoundedSemaphore(workers + queue_size) if workers > 0 else None
+            self.__shutdown()
+
+    def hash(self, password):
+        """
+        Hash a clear text password with the configured cost factor.
+        Returns:
+            str: the bcrypt hash
+        Raises:
+            PasswordHasherBusyException: if no slot is free after `queue_timeout` seconds
+        """
+        return self.__run(hash_password, password, self.rounds)
+
+    def verify(self, password_hash, password):
+        """
+        Check a clear text password against a bcrypt hash.
+        Returns:
+            bool: True if the password matches
+        Raises:
+            PasswordHasherBusyException: if no slot is free after `queue_timeout` seconds
+        """
+        return self.__run(check_password, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """
+        Check if a bcrypt hash has been computed with another cost factor than the configured one.
+        """
+        try:
+            return int(password_hash.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def shutdown(self):
+        """
+        Stop the worker processes.
+        """
+        with self.lock:
+            self.__shutdown()
+
+    def __run(self, function, *args):
+        """
+        Run a function in the pool, or inline without workers.
+        """
+        slots = self.slots
+        if slots is None:
+            return function(*args)
+        if not slots.acquire(timeout=self.queue_timeout):
+            raise PasswordHasherBusyException("Too many passwords are being hashed, please retry later")
+        try:
+            future = self.__pool().submit(function, *args)
+        except Exception as e:
+            slots.release()
+            raise e
+        future.add_done_callback(lambda _: slots.release())
+        try:
+            return future.result()
+        except concurrent.futures.process.BrokenProcessPool as e:
+            # a worker died, the pool is started again on the next call
+            logger.error(f"The password hashing pool is broken: {e}")
+            with self.lock:
+                self.__shutdown()
+            raise e
+
+    def __pool(self):
+        """
+        Get the pool of worker processes, it is started on the first call.
+        """
+        with self.lock:
+            if self.pool is None:
+                # the workers are spawned rather than forked from a process running threads
+                self.pool = concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self.pool
+
+    def __shutdown(self):
+        """
+        Stop the worker processes, the lock must be held by the caller.
+        """
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+            self.pool = None
+
+
+# hasher of the passwords of the users, configured by the REST API server
+password_hasher = PasswordHasher()
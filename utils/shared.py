@@ -1,12 +1,17 @@
 # Description: This file contains shared functions that interact with the GCP API and are used by multiple modules.
 import os
 import sys
+import contextvars
+import functools
 from typing import Any
 from loguru import logger
 from utils.env import get_env_project_id, check_application_credentials, check_compute_engine_service_account_email, check_storage_service_account_email, check_service_account_oauth_token
 from shared.entities.gcp_project import GCPProject
 from google.api_core.extended_operation import ExtendedOperation
-from utils.exceptions import GCPOperationFailedException, UnAuthorizedException, ProjectIdNotProvidedException
+from utils.exceptions import UnAuthorizedException, ProjectIdNotProvidedException, InvalidOAUTHTokenException, JobCancelledException
+from utils import cancellation
+from utils.operation_waiter import operation_waiter
+from shared.core.steps import record_operation, record_retry
 
 # Check parameters
 def check_gcp_params(args):
@@ -78,7 +83,7 @@ def check_gcp_params_from_request(args):
     if "SERVICE_ACCOUNT_OAUTH_TOKEN" not in os.environ:
         raise InvalidOAUTHTokenException("No oauth token found")
 
-    return GCPProject(args["project-id"], auth_type="oauth", service_token=os.environ.get("SERVICE_ACCOUNT_OAUTH_TOKEN"))
+    return GCPProject(args["project-id"], auth_type="oauth", service_token=os.environ.get("SERVICE_ACCOUNT_OAUTH_TOKEN"), project_number=args["project-number"])
         
 
 def wait_for_extended_operation(
@@ -104,23 +109,19 @@ def wait_for_extended_operation(
         set for the `operation`.
         In case of an operation taking longer than `timeout` seconds to complete,
         a `concurrent.futures.TimeoutError` will be raised.
+        If the current job is cancelled, JobCancelledException is raised and the operation is recorded as half-done,
+        the operation itself keeps running on GCP.
     """
-
-    result = operation.result(timeout=timeout)
-
-    if operation.error_code:
-        logger.error(
-            f"Error during {verbose_name} {operation.name}: {operation.error_message}"
-        )
-        logger.error(f"Operation ID: {operation.name}")
-        raise GCPOperationFailedException(operation.error_message)
-
-    if operation.warnings:
-        logger.warning(f"Warnings during {verbose_name} {operation.name}:")
-        for warning in operation.warnings:
-            logger.warning(f" - {warning.code}: {warning.message}")
-
-    return result
+    # the operation id is recorded on the current step of the job
+    record_operation(operation.name)
+    # the operation is polled by the shared waiter thread, the retried polls are recorded on the current step
+    future = operation_waiter.watch(operation, verbose_name, timeout, on_retry=functools.partial(contextvars.copy_context().run, record_retry))
+    try:
+        return cancellation.wait_future(future)
+    except JobCancelledException:
+        future.cancel()
+        cancellation.record_half_done(f"operation {operation.name}", f"{verbose_name} still running on GCP when the job was cancelled")
+        raise
 
 
 def wait_for_operation(compute, project, zone, operation):
@@ -138,7 +139,7 @@ def wait_for_operation(compute, project, zone, operation):
                 raise Exception(result["error"])
             return result
 
-        time.sleep(1)
+        cancellation.sleep(1)
 
 
 def wait_for_operation_global(compute, project, operation):
@@ -155,3 +156,5 @@ def wait_for_operation_global(compute, project, operation):
             if "error" in result:
                 raise Exception(result["error"])
             return result
+
+        cancellation.sleep(1)